@@ -0,0 +1,230 @@
+# File: bench/generate.py
+# Revision: 1.0 - Synthetic media_assets.db generator for benchmarks
+#
+# Builds a media_assets.db with the same schema, indexes, FTS tables and
+# counters as bmm-rw creates, filled with a deterministic synthetic
+# collection: movies and TV shows with titles, taglines, overviews, poster
+# URLs and IMDB/TMDB ids, physical and digital copies linked to them, books
+# with ISBNs, and the usual mix of "To Acquire", flagged and untitled rows.
+# The same size and seed always give the same rows, so benchmark results from
+# different versions of the apps are comparable.
+#
+#   python bench/generate.py --size 100k              -> bench/data/media_100k.db
+#   python bench/generate.py --size 1m --seed 7 --out /tmp/big.db
+#
+# Sizes are media rows: 1k, 100k, 1m or a plain number. Roughly one asset is
+# created per media row, plus links between them.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from types import ModuleType
+from typing import Iterator, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RW_DIR = os.path.join(REPO_DIR, "bmm-rw")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+BATCH_ROWS = 5_000
+
+ADJECTIVES = (
+    "Silent", "Last", "Broken", "Hidden", "Golden", "Dark", "Lost", "Crimson", "Frozen", "Wild",
+    "Burning", "Distant", "Electric", "Endless", "Fallen", "Forgotten", "Hollow", "Iron", "Midnight",
+    "Northern", "Quiet", "Restless", "Scarlet", "Secret", "Shattered", "Starlit", "Sunken", "Velvet",
+)
+NOUNS = (
+    "Harbor", "Kingdom", "Empire", "River", "Horizon", "Garden", "Signal", "Mountain", "Station",
+    "Frontier", "Voyage", "Legacy", "Protocol", "Orchard", "Lighthouse", "Citadel", "Archive",
+    "Circuit", "Desert", "Echo", "Galaxy", "Island", "Labyrinth", "Meridian", "Mirror", "Outpost",
+)
+PEOPLE = ("Detective", "Captain", "Doctor", "Agent", "Professor", "Stranger", "Queen", "Pilot", "Ranger")
+TV_FORMS = ("Chronicles", "Files", "Diaries", "Saga", "Stories", "Unit", "Station")
+WORDS = (
+    "a", "the", "of", "and", "to", "in", "young", "old", "family", "city", "war", "love", "secret", "journey",
+    "mission", "team", "truth", "past", "future", "crew", "small", "town", "must", "find", "save", "escape",
+    "discovers", "hunts", "between", "world", "friends", "rivals", "across", "night", "strange", "ancient",
+    "power", "fight", "home", "stolen", "mysterious", "signal", "unlikely", "reluctant", "hero", "ship",
+)
+FORMATS = ("DVD", "Blu-ray", "4K UHD", "Digital", "DVD", "Blu-ray", "VHS", "Digital")
+BOOK_FORMATS = ("Hardcover", "Paperback", "eBook")
+LOCATIONS = ("Living Room", "Basement", "Office", "Storage", "Bedroom", "Plex", "Kindle")
+ROMAN = ("II", "III", "IV", "Returns", "Reloaded")
+
+MEDIA_COLUMNS = (
+    "id", "title", "subtitle", "imageurl", "mtype", "notes", "imdbid", "tmdbid",
+    "active", "flag", "acquire", "creation",
+)
+ASSET_COLUMNS = (
+    "id", "format", "location", "notes", "subtitle", "title", "imageurl", "image", "dupe",
+    "imdbid", "tmdbid", "active", "flag", "mtype", "isbn", "creation",
+)
+
+def parse_size(size: str) -> int:
+    """Number of media rows for a size name ("1k", "100k", "1m") or a plain number"""
+    value = SIZES.get(size.lower())
+    if value is None:
+        value = int(size.replace("_", ""))
+    if value < 1:
+        raise ValueError("size must be at least 1")
+    return value
+
+def default_path(size: str) -> str:
+    return os.path.join(DATA_DIR, f"media_{size.lower()}.db")
+
+def make_title(rng: random.Random, mtype: int = 1) -> str:
+    shape = rng.random()
+    if mtype == 2 and shape < 0.4:
+        title = f"{rng.choice(NOUNS)} {rng.choice(TV_FORMS)}"
+    elif shape < 0.45:
+        title = f"The {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    elif shape < 0.7:
+        title = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    elif shape < 0.85:
+        title = f"The {rng.choice(PEOPLE)} of {rng.choice(NOUNS)}"
+    else:
+        title = f"{rng.choice(NOUNS)} of the {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    if mtype == 1 and rng.random() < 0.08:
+        title = f"{title} {rng.choice(ROMAN)}"
+    return title
+
+def make_sentence(rng: random.Random, low: int, high: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(low, high))]
+    return " ".join(words).capitalize() + "."
+
+def make_poster_path(rng: random.Random) -> str:
+    return "/" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(27)) + ".jpg"
+
+def make_isbn(rng: random.Random) -> str:
+    digits = [9, 7, 8] + [rng.randint(0, 9) for _ in range(9)]
+    check = (10 - sum(d * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits)) % 10) % 10
+    return "".join(str(d) for d in digits) + str(check)
+
+def _timestamp(base: datetime, rng: random.Random, index: int) -> str:
+    moment = base + timedelta(minutes=index * 7, seconds=rng.randint(0, 400))
+    return moment.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def generate_rows(count: int, seed: int) -> Iterator[Tuple[str, tuple]]:
+    """Yield ("media" | "assets" | "media_asset_link", row) in insert order"""
+    rng = random.Random(seed)
+    base = datetime(2015, 1, 1)
+    asset_id = 0
+    for media_id in range(1, count + 1):
+        mtype = 1 if rng.random() < 0.7 else 2
+        title = None if rng.random() < 0.005 else make_title(rng, mtype)
+        poster = make_poster_path(rng) if rng.random() < 0.9 else None
+        imdbid = f"tt{rng.randint(100000, 9999999):07d}" if mtype == 1 else None
+        # TMDB ids are unique per type, as in a real library
+        tmdbid = 10_000 + media_id * 3 + (0 if mtype == 1 else 1) if rng.random() < 0.95 else None
+        owned = rng.random() < 0.82
+        yield "media", (
+            media_id, title,
+            make_sentence(rng, 3, 8) if rng.random() < 0.6 else None,
+            f"https://image.tmdb.org/t/p/w92{poster}" if poster else None,
+            mtype, make_sentence(rng, 15, 40), imdbid, tmdbid,
+            owned, rng.random() < 0.03, not owned,
+            _timestamp(base, rng, media_id),
+        )
+        if not owned:
+            continue
+        for _ in range(1 if rng.random() < 0.85 else 2):
+            asset_id += 1
+            yield "assets", (
+                asset_id, rng.choice(FORMATS), rng.choice(LOCATIONS),
+                make_sentence(rng, 2, 10) if rng.random() < 0.3 else None,
+                None, title,
+                f"https://image.tmdb.org/t/p/w92{poster}" if poster else None,
+                None, False, imdbid, tmdbid, rng.random() < 0.97, rng.random() < 0.02, mtype, None,
+                _timestamp(base, rng, media_id),
+            )
+            yield "media_asset_link", (media_id, asset_id)
+        # Books and other assets without a TMDB record, not linked to any media
+        if rng.random() < 0.08:
+            asset_id += 1
+            yield "assets", (
+                asset_id, rng.choice(BOOK_FORMATS), rng.choice(LOCATIONS), None,
+                make_sentence(rng, 2, 6), make_title(rng), None, None, False, None, None,
+                True, False, 3, make_isbn(rng), _timestamp(base, rng, media_id),
+            )
+
+def _create_schema(path: str) -> ModuleType:
+    """Create the empty tables from bmm-rw's own models"""
+    os.environ["BMM_DATABASE_PATH"] = os.path.abspath(path)
+    os.environ.setdefault("BMM_REQUEST_LOG", "0")
+    sys.path.insert(0, RW_DIR)
+    cwd = os.getcwd()
+    os.chdir(RW_DIR)  # main.py resolves templates/ and static/ relative to the working directory
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    main.SQLModel.metadata.create_all(main.engine)
+    main.engine.dispose()
+    return main
+
+def _insert_rows(path: str, count: int, seed: int) -> dict:
+    statements = {
+        "media": f"INSERT INTO media ({', '.join(MEDIA_COLUMNS)}) VALUES ({', '.join('?' * len(MEDIA_COLUMNS))})",
+        "assets": f"INSERT INTO assets ({', '.join(ASSET_COLUMNS)}) VALUES ({', '.join('?' * len(ASSET_COLUMNS))})",
+        "media_asset_link": "INSERT INTO media_asset_link (media_id, asset_id) VALUES (?, ?)",
+    }
+    totals = {table: 0 for table in statements}
+    batches: dict = {table: [] for table in statements}
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    try:
+        def flush():
+            for table, rows in batches.items():
+                if rows:
+                    conn.executemany(statements[table], rows)
+                    totals[table] += len(rows)
+                    rows.clear()
+        pending = 0
+        for table, row in generate_rows(count, seed):
+            batches[table].append(row)
+            pending += 1
+            if pending >= BATCH_ROWS:
+                flush()
+                pending = 0
+        flush()
+        conn.commit()
+    finally:
+        conn.close()
+    return totals
+
+def generate(size: str, path: Optional[str] = None, seed: int = 1, force: bool = False) -> str:
+    """Build the dataset for size at path (default bench/data/media_<size>.db) and return the path"""
+    count = parse_size(size)
+    path = os.path.abspath(path or default_path(size))
+    if os.path.exists(path):
+        if not force:
+            return path
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    started = time.perf_counter()
+    main = _create_schema(path)
+    totals = _insert_rows(path, count, seed)
+    # Indexes, migrations, FTS index and counters exactly as the app builds them
+    main.create_db_and_tables()
+    main.engine.dispose()
+    print(f"{path}: {totals['media']} media, {totals['assets']} assets, "
+          f"{totals['media_asset_link']} links in {time.perf_counter() - started:.1f}s")
+    return path
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Generate a synthetic media_assets.db for benchmarks")
+    parser.add_argument("--size", default="1k", help="media rows: 1k, 100k, 1m or a number (default 1k)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default 1)")
+    parser.add_argument("--out", help="database file to write (default bench/data/media_<size>.db)")
+    parser.add_argument("--force", action="store_true", help="replace the file if it exists")
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    generate(args.size, args.out, args.seed, args.force)
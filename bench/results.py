@@ -0,0 +1,135 @@
+# File: bench/results.py
+# Revision: 1.0 - Benchmark statistics, result files and comparison
+#
+# Each run is saved as one JSON file in bench/results/ (named after the time
+# and the --label), holding the git commit, the app versions, the dataset and
+# settings, and p50/p90/p99 latency and throughput per app and workload, with
+# a per-operation breakdown. compare() lines two files up and marks changes
+# beyond a threshold, so a regression shows up before the change is merged.
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from generate import BENCH_DIR, REPO_DIR
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(latencies_ms: List[float], errors: int, seconds: float) -> dict:
+    """Latency percentiles (successful requests, ms) and throughput (requests/s)"""
+    values = sorted(latencies_ms)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / seconds, 1) if seconds else 0.0,
+        "mean_ms": round(sum(values) / len(values), 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50), 2),
+        "p90_ms": round(percentile(values, 0.90), 2),
+        "p99_ms": round(percentile(values, 0.99), 2),
+        "max_ms": round(values[-1], 2) if values else 0.0,
+    }
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def app_version(app_dir: str) -> Optional[str]:
+    """Version from the first line of the app's main.py ("# main.py  version 1.58")"""
+    try:
+        with open(os.path.join(app_dir, "main.py")) as f:
+            match = re.search(r"version\s+([\d.]+)", f.readline())
+    except OSError:
+        return None
+    return match.group(1) if match else None
+
+def environment() -> dict:
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "bmm_rw": app_version(os.path.join(REPO_DIR, "bmm-rw")),
+        "bmm_ro": app_version(os.path.join(REPO_DIR, "bmm-ro")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def save(result: dict, directory: str = RESULTS_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    label = re.sub(r"[^A-Za-z0-9_.-]+", "-", result.get("label") or "run").strip("-")
+    started = datetime.fromisoformat(result["started"])
+    path = os.path.join(directory, f"{started:%Y%m%d-%H%M%S}-{label}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+        f.write("\n")
+    return path
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def _rows(result: dict) -> Dict[Tuple[str, str], dict]:
+    return {(app, workload): stats for app, workloads in result["results"].items() for workload, stats in workloads.items()}
+
+def format_table(result: dict) -> str:
+    lines = [f"{'app':<4} {'workload':<8} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errors':>7}"]
+    for (app, workload), stats in _rows(result).items():
+        lines.append(
+            f"{app:<4} {workload:<8} {stats['throughput_rps']:>9.1f} {stats['p50_ms']:>9.2f} "
+            f"{stats['p90_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['errors']:>7}"
+        )
+    return "\n".join(lines)
+
+def _change(before: float, after: float) -> Optional[float]:
+    return (after - before) / before * 100 if before else None
+
+def compare(baseline: dict, candidate: dict, threshold: float = 10.0) -> Tuple[str, bool]:
+    """Table of changes from baseline to candidate, and whether any is a regression beyond threshold percent"""
+    lines = [
+        f"baseline  {baseline.get('label')} ({baseline['environment'].get('commit')}, {baseline['started']})",
+        f"candidate {candidate.get('label')} ({candidate['environment'].get('commit')}, {candidate['started']})",
+    ]
+    if baseline.get("dataset") != candidate.get("dataset") or baseline.get("settings") != candidate.get("settings"):
+        lines.append("WARNING: the runs used different datasets or settings")
+    lines.append(f"{'app':<4} {'workload':<8} {'req/s':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    regressed = False
+    before_rows = _rows(baseline)
+    for key, after in _rows(candidate).items():
+        before = before_rows.get(key)
+        if before is None:
+            continue
+        cells = []
+        # Lower throughput or higher latency is worse
+        for metric, worse_sign in (("throughput_rps", -1), ("p50_ms", 1), ("p99_ms", 1)):
+            change = _change(before[metric], after[metric])
+            mark = ""
+            if change is not None and change * worse_sign > threshold:
+                mark = " !"
+                regressed = True
+            text = f"{after[metric]:.1f} ({change:+.0f}%)" if change is not None else f"{after[metric]:.1f}"
+            cells.append(f"{text + mark:>18}")
+        lines.append(f"{key[0]:<4} {key[1]:<8} " + " ".join(cells))
+    if regressed:
+        lines.append(f"! = worse by more than {threshold:g}%")
+    return "\n".join(lines), regressed
+
+def latest(directory: str = RESULTS_DIR, count: int = 2) -> List[str]:
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names[-count:]]
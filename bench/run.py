@@ -0,0 +1,266 @@
+# File: bench/run.py
+# Revision: 1.1 - TMDB client-side rate limit turned off against the stub
+#
+# For a run the driver:
+#   1. generates the dataset for --size if bench/data/ doesn't have it yet
+#      (generate.py) and copies it to a scratch directory, so write workloads
+#      never change the original
+#   2. starts the TMDB stub (tmdb_stub.py) and bmm-rw/bmm-ro with uvicorn on
+#      free ports, pointed at the copy and the stub
+#   3. replays each workload (workloads.py) against each app with --concurrency
+#      workers for --warmup + --duration seconds; only the measured part counts
+#   4. prints p50/p90/p99 latency and throughput and saves them in
+#      bench/results/ (results.py)
+#
+#   python bench/run.py run --size 100k --label baseline
+#   python bench/run.py run --size 1k --apps ro --workloads list,detail --duration 5
+#   python bench/run.py run --rw-url http://localhost:8000 --database bmm-rw/media_assets.db --workloads list
+#   python bench/run.py compare                       (the two newest result files)
+#   python bench/run.py compare OLD.json NEW.json --threshold 5
+#
+# The driver is a single asyncio process; at a few thousand requests/s it
+# becomes the bottleneck itself, so compare runs made on the same machine.
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+import generate
+import results
+from workloads import WORKLOADS, Dataset, Workload, request_stream
+
+APP_DIRS = {"rw": generate.RW_DIR, "ro": os.path.join(generate.REPO_DIR, "bmm-ro")}
+STARTUP_TIMEOUT = 300
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url: str, process: subprocess.Popen, log_path: str) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}, see {log_path}")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} did not start within {STARTUP_TIMEOUT}s, see {log_path}")
+
+def start_process(stack: ExitStack, command: List[str], cwd: str, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = stack.enter_context(open(log_path, "w"))
+    process = subprocess.Popen(command, cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+    def stop():
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    stack.callback(stop)
+    return process
+
+def start_apps(stack: ExitStack, args, run_dir: str, database: str) -> Dict[str, str]:
+    """Start the TMDB stub and the selected apps; return app -> base URL"""
+    stub_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = start_process(stack, [
+        sys.executable, "tmdb_stub.py", "--port", str(stub_port),
+        "--latency-ms", str(args.tmdb_latency_ms), "--jitter-ms", str(args.tmdb_jitter_ms),
+        "--error-rate", str(args.tmdb_error_rate),
+    ], generate.BENCH_DIR, {}, os.path.join(run_dir, "tmdb_stub.log"))
+    wait_until_ready(f"{stub_url}/search/movie", stub, os.path.join(run_dir, "tmdb_stub.log"))
+
+    env = {
+        "BMM_DATABASE_PATH": database,
+        "TMDB_BASE_URL": stub_url,
+        "TMDB_API_KEY": "benchmark",
+        "TMDB_CACHE_PATH": os.path.join(run_dir, "tmdb_cache.db"),
+        "TMDB_RATE_LIMIT": "0",  # the stub has no quota; measure the app, not the client-side limiter
+        "BMM_IMAGE_CACHE_DIR": "",  # hotlink posters instead of downloading them from TMDB
+        "BMM_REQUEST_LOG": "0",
+    }
+    urls = {}
+    # bmm-rw first: it brings the schema up to date before bmm-ro opens the file
+    for app in ("rw", "ro"):
+        if app not in args.apps:
+            continue
+        port = free_port()
+        log_path = os.path.join(run_dir, f"bmm-{app}.log")
+        process = start_process(stack, [
+            sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning",
+        ], APP_DIRS[app], env, log_path)
+        urls[app] = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{urls[app]}/", process, log_path)
+    return urls
+
+async def drive(base_url: str, workload: Workload, app: str, dataset: Dataset, args) -> dict:
+    """Replay one workload against one app and summarize the measured requests"""
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+    clock = time.perf_counter
+    measure_from = clock() + args.warmup
+    stop = measure_from + args.duration
+
+    async def worker(client: httpx.AsyncClient, number: int):
+        stream = request_stream(workload, app, dataset, args.seed * 1000 + number)
+        while True:
+            request = next(stream)
+            started = clock()
+            if started >= stop:
+                return
+            try:
+                response = await client.request(
+                    request.method, request.path, params=request.params, headers=request.headers, data=request.data
+                )
+                status = str(response.status_code)
+                ok = response.status_code < 400
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+                ok = False
+            elapsed_ms = (clock() - started) * 1000
+            if started < measure_from:
+                continue
+            statuses[status] = statuses.get(status, 0) + 1
+            if ok:
+                latencies.setdefault(request.op, []).append(elapsed_ms)
+            else:
+                errors[request.op] = errors.get(request.op, 0) + 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        await asyncio.gather(*(worker(client, number) for number in range(args.concurrency)))
+
+    operations = sorted(set(latencies) | set(errors))
+    summary = results.summarize(
+        [value for values in latencies.values() for value in values], sum(errors.values()), args.duration
+    )
+    summary["statuses"] = dict(sorted(statuses.items()))
+    summary["operations"] = {
+        op: results.summarize(latencies.get(op, []), errors.get(op, 0), args.duration) for op in operations
+    }
+    return summary
+
+def run(args) -> int:
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        print(f"run: unknown workload(s) {', '.join(unknown)}; choose from {', '.join(WORKLOADS)}", file=sys.stderr)
+        return 2
+    external = {app: url for app, url in (("rw", args.rw_url), ("ro", args.ro_url)) if url}
+    started = datetime.now()
+
+    with ExitStack() as stack:
+        if external:
+            urls = external
+            args.apps = list(external)
+            database = os.path.abspath(args.database or generate.default_path(args.size))
+            if not os.path.exists(database):
+                print(f"run: --database {database} not found (needed to pick ids and search words)", file=sys.stderr)
+                return 2
+        else:
+            source = generate.generate(args.size, args.database, args.seed)
+            run_dir = tempfile.mkdtemp(prefix="bmm-bench-")
+            if args.keep:
+                print(f"Run directory (kept): {run_dir}")
+            else:
+                stack.callback(shutil.rmtree, run_dir, True)
+            database = os.path.join(run_dir, "media_assets.db")
+            for suffix in ("", "-wal"):
+                if os.path.exists(source + suffix):
+                    shutil.copyfile(source + suffix, database + suffix)
+            urls = start_apps(stack, args, run_dir, database)
+
+        dataset = Dataset(database, args.seed)
+        print(f"Dataset: {dataset.media_count} media, {dataset.asset_count} assets; "
+              f"{args.concurrency} workers, {args.warmup:g}s warmup + {args.duration:g}s per workload")
+        measured: Dict[str, Dict[str, dict]] = {app: {} for app in args.apps}
+        # Workloads in the outer loop, so the write workload runs last for every app
+        for name in args.workloads:
+            workload = WORKLOADS[name]
+            for app in args.apps:
+                if app not in workload.apps:
+                    continue
+                summary = asyncio.run(drive(urls[app], workload, app, dataset, args))
+                measured[app][name] = summary
+                print(f"  {app} {name:<7} {summary['throughput_rps']:>8.1f} req/s  p50 {summary['p50_ms']:.2f} ms  "
+                      f"p99 {summary['p99_ms']:.2f} ms  errors {summary['errors']}")
+
+    result = {
+        "label": args.label,
+        "started": started.isoformat(timespec="seconds"),
+        "environment": results.environment(),
+        "dataset": {
+            "size": None if external else args.size, "seed": args.seed,
+            "media": dataset.media_count, "assets": dataset.asset_count,
+        },
+        "settings": {
+            "apps": args.apps, "workloads": args.workloads, "concurrency": args.concurrency,
+            "duration": args.duration, "warmup": args.warmup,
+            "tmdb_latency_ms": None if external else args.tmdb_latency_ms,
+            "tmdb_error_rate": None if external else args.tmdb_error_rate,
+        },
+        "results": {app: workloads for app, workloads in measured.items() if workloads},
+    }
+    print(results.format_table(result))
+    if not args.no_save:
+        print(f"Saved {results.save(result)}")
+    return 0
+
+def compare(args) -> int:
+    paths = args.files or results.latest(count=2)
+    if len(paths) != 2:
+        print("compare: give two result files (or run the benchmark twice first)", file=sys.stderr)
+        return 2
+    table, regressed = results.compare(results.load(paths[0]), results.load(paths[1]), args.threshold)
+    print(table)
+    return 1 if regressed else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Media Assets Manager benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="Benchmark the apps and save the results")
+    parser_run.add_argument("--size", default="1k", help="dataset size: 1k, 100k, 1m or a number (default 1k)")
+    parser_run.add_argument("--seed", type=int, default=1, help="dataset and request sequence seed (default 1)")
+    parser_run.add_argument("--database", help="dataset file (default bench/data/media_<size>.db, generated if missing)")
+    parser_run.add_argument("--apps", type=lambda value: value.split(","), default=["rw", "ro"],
+                            help="apps to benchmark: rw,ro (default both)")
+    parser_run.add_argument("--workloads", type=lambda value: value.split(","), default=list(WORKLOADS),
+                            help=f"comma-separated workloads (default {','.join(WORKLOADS)})")
+    parser_run.add_argument("--concurrency", type=int, default=8, help="concurrent clients (default 8)")
+    parser_run.add_argument("--duration", type=float, default=15, help="measured seconds per workload (default 15)")
+    parser_run.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each workload (default 3)")
+    parser_run.add_argument("--tmdb-latency-ms", type=float, default=80, help="TMDB stub response delay (default 80)")
+    parser_run.add_argument("--tmdb-jitter-ms", type=float, default=20, help="TMDB stub delay variation (default 20)")
+    parser_run.add_argument("--tmdb-error-rate", type=float, default=0, help="fraction of TMDB stub 503s (default 0)")
+    parser_run.add_argument("--rw-url", help="benchmark an already running bmm-rw instead of starting one")
+    parser_run.add_argument("--ro-url", help="benchmark an already running bmm-ro instead of starting one")
+    parser_run.add_argument("--label", default="run", help="name for the result file (e.g. the branch)")
+    parser_run.add_argument("--keep", action="store_true", help="keep the scratch directory with the app logs")
+    parser_run.add_argument("--no-save", action="store_true", help="print the results without saving them")
+    parser_run.set_defaults(func=run)
+
+    parser_compare = commands.add_parser("compare", help="Compare two result files")
+    parser_compare.add_argument("files", nargs="*", help="baseline and candidate (default: the two newest results)")
+    parser_compare.add_argument("--threshold", type=float, default=10, help="percent change reported as a regression (default 10)")
+    parser_compare.set_defaults(func=compare)
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
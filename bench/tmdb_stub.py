@@ -0,0 +1,163 @@
+# File: bench/tmdb_stub.py
+# Revision: 1.1 - external_ids for TV details (append_to_response)
+#
+# Answers the TMDB endpoints bmm-rw calls (/search/movie, /search/tv,
+# /movie/{id}, /tv/{id}, .../external_ids) with deterministic synthetic JSON, after a
+# configurable delay, so TMDB search and import routes can be load tested
+# without an API key, network jitter or TMDB's rate limits. Point bmm-rw at it
+# with TMDB_BASE_URL=http://127.0.0.1:<port>.
+#
+#   python bench/tmdb_stub.py --port 8099 --latency-ms 80 --error-rate 0.01
+#
+# run.py starts one in-process for each benchmark run.
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from generate import make_poster_path, make_sentence, make_title
+
+RESULTS_PER_PAGE = 20
+
+def _rng(*parts) -> random.Random:
+    """Random generator seeded by the request, so the same request gets the same answer"""
+    return random.Random(zlib.crc32("/".join(str(part) for part in parts).encode()))
+
+def search_page(search_type: str, query: str, page: int) -> dict:
+    rng = _rng(search_type, query.lower())
+    total_results = rng.randint(0, 400)
+    total_pages = (total_results + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+    results = []
+    if page <= total_pages:
+        count = min(RESULTS_PER_PAGE, total_results - (page - 1) * RESULTS_PER_PAGE)
+        page_rng = _rng(search_type, query.lower(), page)
+        for _ in range(count):
+            tmdb_id = page_rng.randint(10_000, 3_000_000)
+            title = f"{query.title()} {make_title(page_rng, 1 if search_type == 'movie' else 2)}"
+            date = f"{page_rng.randint(1950, 2025)}-{page_rng.randint(1, 12):02d}-{page_rng.randint(1, 28):02d}"
+            item = {
+                "id": tmdb_id,
+                "poster_path": make_poster_path(page_rng) if page_rng.random() < 0.9 else None,
+                "overview": make_sentence(page_rng, 15, 40),
+                "popularity": round(page_rng.uniform(0, 100), 3),
+            }
+            if search_type == "movie":
+                item.update({"title": title, "original_title": title, "release_date": date})
+            else:
+                item.update({"name": title, "original_name": title, "first_air_date": date})
+            results.append(item)
+    return {"page": page, "results": results, "total_results": total_results, "total_pages": total_pages}
+
+def details(search_type: str, tmdb_id: int) -> dict:
+    rng = _rng(search_type, tmdb_id)
+    title = make_title(rng, 1 if search_type == "movie" else 2)
+    data = {
+        "id": tmdb_id,
+        "tagline": make_sentence(rng, 3, 8),
+        "overview": make_sentence(rng, 15, 40),
+        "poster_path": make_poster_path(rng),
+    }
+    if search_type == "movie":
+        data.update({"title": title, "original_title": title, "imdb_id": f"tt{rng.randint(100000, 9999999):07d}"})
+    else:
+        data.update({"name": title, "original_name": title})
+    return data
+
+def external_ids(search_type: str, tmdb_id: int) -> dict:
+    rng = _rng(search_type, tmdb_id, "external_ids")
+    return {"id": tmdb_id, "imdb_id": f"tt{rng.randint(100000, 9999999):07d}"}
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        if parts and parts[0] == "3":  # accept the real API's /3 prefix too
+            parts = parts[1:]
+
+        delay = server.latency_ms + random.uniform(-server.jitter_ms, server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        server.count(parts)
+        if random.random() < server.error_rate:
+            self._send(503, {"status_code": 11, "status_message": "Stub: simulated failure"})
+        elif len(parts) == 2 and parts[0] == "search" and parts[1] in ("movie", "tv"):
+            try:
+                page = max(1, int(params.get("page", "1")))
+            except ValueError:
+                page = 1
+            self._send(200, search_page(parts[1], params.get("query", ""), page))
+        elif len(parts) == 2 and parts[0] in ("movie", "tv") and parts[1].isdigit():
+            data = details(parts[0], int(parts[1]))
+            if "external_ids" in params.get("append_to_response", "").split(","):
+                data["external_ids"] = external_ids(parts[0], int(parts[1]))
+            self._send(200, data)
+        elif len(parts) == 3 and parts[0] in ("movie", "tv") and parts[1].isdigit() and parts[2] == "external_ids":
+            self._send(200, external_ids(parts[0], int(parts[1])))
+        else:
+            self._send(404, {"status_code": 34, "status_message": "The resource you requested could not be found."})
+
+    def _send(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0):
+        super().__init__(address, StubHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, parts: List[str]) -> None:
+        kind = "/" + "/".join(part if not part.isdigit() else "{id}" for part in parts)
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start(port: int = 0, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+          host: str = "127.0.0.1") -> StubServer:
+    """Serve the stub on a background thread (port 0 picks a free port); stop with server.shutdown()"""
+    server = StubServer((host, port), latency_ms, jitter_ms, error_rate)
+    threading.Thread(target=server.serve_forever, name="tmdb-stub", daemon=True).start()
+    return server
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Local TMDB API stub for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8099, help="port to listen on (default 8099)")
+    parser.add_argument("--latency-ms", type=float, default=80, help="delay before each response (default 80)")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="random +/- variation of the delay (default 20)")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered 503 (default 0)")
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    stub = StubServer((args.host, args.port), args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"TMDB stub listening on {stub.base_url} (use TMDB_BASE_URL={stub.base_url})")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,197 @@
+# File: bench/workloads.py
+# Revision: 1.0 - Request mixes replayed by the benchmark driver
+#
+# A workload is a weighted mix of operations. Each operation builds one
+# request from a seeded random generator and a sample of the dataset (ids,
+# title words, list cursors), so a run replays the same sequence of requests
+# against every version of the apps.
+#
+#   list    first pages, status filters and deep keyset pages   (bmm-rw, bmm-ro)
+#   search  live search and pickers; TMDB search via the stub   (bmm-rw, bmm-ro)
+#   detail  media and asset detail pages, with list context     (bmm-rw, bmm-ro)
+#   form    new/edit forms                                      (bmm-rw)
+#   write   create and edit media and assets                    (bmm-rw)
+import os
+import random
+import sqlite3
+import sys
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from generate import ADJECTIVES, FORMATS, LOCATIONS, NOUNS, RW_DIR, WORDS, make_sentence, make_title
+
+SAMPLE_IDS = 2000
+SAMPLE_CURSORS = 200
+
+class Request(NamedTuple):
+    op: str  # operation name, used to break results down
+    method: str
+    path: str
+    params: Optional[dict] = None
+    headers: Optional[dict] = None
+    data: Optional[dict] = None
+
+HTMX = {"HX-Request": "true"}
+
+class Dataset:
+    """What the operations need to know about the database: sample ids, cursors and search words"""
+
+    def __init__(self, path: str, seed: int = 1):
+        sys.path.insert(0, RW_DIR)
+        from pagination import encode_cursor
+
+        rng = random.Random(seed)
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        try:
+            self.media_count, self.max_media_id = conn.execute("SELECT count(*), max(id) FROM media").fetchone()
+            self.asset_count, self.max_asset_id = conn.execute("SELECT count(*), max(id) FROM assets").fetchone()
+            self.media_ids = self._sample_ids(conn, "media", rng)
+            self.asset_ids = self._sample_ids(conn, "assets", rng)
+            self.media_cursors = [
+                encode_cursor(title, row_id) for title, row_id in
+                self._sample_rows(conn, "SELECT title, id FROM media WHERE id IN ({})", self.media_ids[:SAMPLE_CURSORS])
+            ]
+            self.asset_cursors = [
+                encode_cursor(title, row_id) for title, row_id in
+                self._sample_rows(conn, "SELECT title, id FROM assets WHERE id IN ({})", self.asset_ids[:SAMPLE_CURSORS])
+            ]
+        finally:
+            conn.close()
+        words = list(ADJECTIVES + NOUNS) + [word for word in WORDS if len(word) > 3]
+        self.search_words = words
+        # Typeahead prefixes as typed: "si", "sil", "sile", ...
+        self.prefixes = sorted({word.lower()[:length] for word in words for length in (2, 3, 4) if len(word) > length})
+
+    @staticmethod
+    def _sample_ids(conn, table: str, rng: random.Random) -> List[int]:
+        low, high = conn.execute(f"SELECT min(id), max(id) FROM {table}").fetchone()
+        if low is None:
+            return []
+        candidates = [rng.randint(low, high) for _ in range(SAMPLE_IDS)]
+        rows = []
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            rows += [row[0] for row in conn.execute(
+                f"SELECT id FROM {table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            )]
+        rng.shuffle(rows)
+        return rows
+
+    @staticmethod
+    def _sample_rows(conn, sql: str, ids: List[int]) -> List[Tuple]:
+        if not ids:
+            return []
+        return conn.execute(sql.format(", ".join("?" * len(ids))), ids).fetchall()
+
+# Operations: (rng, dataset) -> Request
+
+def media_list(rng, ds):
+    return Request("media_list", "GET", "/media/")
+
+def media_list_htmx(rng, ds):
+    return Request("media_list_htmx", "GET", "/media/", headers=HTMX)
+
+def media_status(rng, ds):
+    return Request("media_status", "GET", "/media/", {"status": rng.choice(("active", "acquire", "flag"))}, HTMX)
+
+def media_deep_page(rng, ds):
+    return Request("media_deep_page", "GET", "/media/", {"after": rng.choice(ds.media_cursors)}, HTMX)
+
+def asset_list(rng, ds):
+    return Request("asset_list", "GET", "/assets/")
+
+def asset_deep_page(rng, ds):
+    return Request("asset_deep_page", "GET", "/assets/", {"after": rng.choice(ds.asset_cursors)}, HTMX)
+
+def media_search(rng, ds):
+    return Request("media_search", "GET", "/media/", {"search": rng.choice(ds.search_words)}, HTMX)
+
+def media_search_prefix(rng, ds):
+    return Request("media_search_prefix", "GET", "/media/", {"search": rng.choice(ds.prefixes)}, HTMX)
+
+def asset_search(rng, ds):
+    return Request("asset_search", "GET", "/assets/", {"search": rng.choice(ds.search_words)}, HTMX)
+
+def media_picker(rng, ds):
+    return Request("media_picker", "GET", "/pickers/media", {"q": rng.choice(ds.prefixes)}, HTMX)
+
+def asset_picker(rng, ds):
+    return Request("asset_picker", "GET", "/pickers/assets", {"q": rng.choice(ds.prefixes)}, HTMX)
+
+def tmdb_search(rng, ds):
+    params = {"query": rng.choice(ds.search_words), "search_type": rng.choice(("movie", "tv")), "page": rng.randint(1, 3)}
+    return Request("tmdb_search", "GET", "/tmdb-search/", params, HTMX)
+
+def media_detail(rng, ds):
+    return Request("media_detail", "GET", f"/media/{rng.choice(ds.media_ids)}")
+
+def media_detail_in_list(rng, ds):
+    params = {"status": rng.choice(("active", "acquire", "flag"))} if rng.random() < 0.5 else {"search": rng.choice(ds.search_words)}
+    return Request("media_detail_in_list", "GET", f"/media/{rng.choice(ds.media_ids)}", params)
+
+def asset_detail(rng, ds):
+    return Request("asset_detail", "GET", f"/assets/{rng.choice(ds.asset_ids)}")
+
+def media_new_form(rng, ds):
+    return Request("media_new_form", "GET", "/media/new")
+
+def asset_new_form(rng, ds):
+    return Request("asset_new_form", "GET", "/assets/new")
+
+def media_edit_form(rng, ds):
+    return Request("media_edit_form", "GET", f"/media/{rng.choice(ds.media_ids)}/edit")
+
+def asset_edit_form(rng, ds):
+    return Request("asset_edit_form", "GET", f"/assets/{rng.choice(ds.asset_ids)}/edit")
+
+def create_media(rng, ds):
+    mtype = rng.choice((1, 2))
+    data = {"title": make_title(rng, mtype), "mtype": str(mtype), "notes": make_sentence(rng, 15, 40), "acquire": "true"}
+    return Request("create_media", "POST", "/media/new", data=data)
+
+def create_asset(rng, ds):
+    data = {
+        "title": make_title(rng), "format": rng.choice(FORMATS), "location": rng.choice(LOCATIONS),
+        "notes": make_sentence(rng, 2, 10), "media_ids": str(rng.choice(ds.media_ids)),
+    }
+    return Request("create_asset", "POST", "/assets/new", data=data)
+
+def edit_asset(rng, ds):
+    data = {
+        "title": make_title(rng), "format": rng.choice(FORMATS), "location": rng.choice(LOCATIONS),
+        "notes": make_sentence(rng, 2, 10), "media_ids": str(rng.choice(ds.media_ids)),
+    }
+    return Request("edit_asset", "POST", f"/assets/{rng.choice(ds.asset_ids)}/edit", data=data)
+
+class Workload(NamedTuple):
+    name: str
+    apps: Tuple[str, ...]
+    mix: Dict[str, List[Tuple[Callable, int]]]  # app -> [(operation, weight)]
+
+    def operations(self, app: str) -> List[Tuple[Callable, int]]:
+        return self.mix.get(app) or self.mix["*"]
+
+WORKLOADS: Dict[str, Workload] = {workload.name: workload for workload in (
+    Workload("list", ("rw", "ro"), {"*": [
+        (media_list, 2), (media_list_htmx, 2), (media_status, 3), (media_deep_page, 3),
+        (asset_list, 1), (asset_deep_page, 2),
+    ]}),
+    Workload("search", ("rw", "ro"), {
+        "ro": [(media_search, 4), (media_search_prefix, 3), (asset_search, 2)],
+        "rw": [
+            (media_search, 4), (media_search_prefix, 3), (asset_search, 2),
+            (media_picker, 2), (asset_picker, 1), (tmdb_search, 2),
+        ],
+    }),
+    Workload("detail", ("rw", "ro"), {"*": [(media_detail, 4), (media_detail_in_list, 2), (asset_detail, 3)]}),
+    Workload("form", ("rw",), {"*": [(media_new_form, 1), (asset_new_form, 1), (media_edit_form, 2), (asset_edit_form, 2)]}),
+    Workload("write", ("rw",), {"*": [(create_media, 2), (create_asset, 2), (edit_asset, 3)]}),
+)}
+
+def request_stream(workload: Workload, app: str, dataset: Dataset, seed: int):
+    """Endless, reproducible sequence of requests for one worker"""
+    rng = random.Random(seed)
+    operations = workload.operations(app)
+    functions = [operation for operation, _ in operations]
+    weights = [weight for _, weight in operations]
+    while True:
+        yield rng.choices(functions, weights)[0](rng, dataset)
@@ -0,0 +1,126 @@
+# File: bmm-ro/counters.py
+# Revision: 1.0 - Collection counters for the home page dashboard
+#
+# The "collection_stats" table holds one row per (entity, dimension, value)
+# with a running count: totals, per-status, per-mtype and per-format. Triggers
+# on "media" and "assets" add or subtract from those rows inside the same
+# transaction as the write that caused them, so the counters are always
+# consistent with the tables and the home page reads them without a scan.
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+# (dimension, value expression, delta expression) - each entry becomes one counter
+# row per distinct value. "{r}" is "new"/"old" in the triggers, the table when backfilling.
+COUNTER_SPECS = {
+    "media": [
+        ("all", "''", "1"),
+        ("status", "'active'", "CASE WHEN {r}.active THEN 1 ELSE 0 END"),
+        ("status", "'inactive'", "CASE WHEN {r}.active THEN 0 ELSE 1 END"),
+        ("status", "'flagged'", "CASE WHEN {r}.flag THEN 1 ELSE 0 END"),
+        ("status", "'acquire'", "CASE WHEN {r}.acquire THEN 1 ELSE 0 END"),
+        ("mtype", "coalesce(CAST({r}.mtype AS TEXT), '')", "1"),
+    ],
+    "assets": [
+        ("all", "''", "1"),
+        ("status", "'active'", "CASE WHEN {r}.active THEN 1 ELSE 0 END"),
+        ("status", "'inactive'", "CASE WHEN {r}.active THEN 0 ELSE 1 END"),
+        ("status", "'flagged'", "CASE WHEN {r}.flag THEN 1 ELSE 0 END"),
+        ("status", "'dupe'", "CASE WHEN {r}.dupe THEN 1 ELSE 0 END"),
+        ("mtype", "coalesce(CAST({r}.mtype AS TEXT), '')", "1"),
+        ("format", "coalesce({r}.format, '')", "1"),
+    ],
+}
+
+# Statuses always present in the result of read_counters, even when zero
+STATUSES = {
+    "media": ("active", "inactive", "flagged", "acquire"),
+    "assets": ("active", "inactive", "flagged", "dupe"),
+}
+
+CREATE_TABLE = (
+    "CREATE TABLE collection_stats ("
+    "entity TEXT NOT NULL, dimension TEXT NOT NULL, value TEXT NOT NULL, "
+    "count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (entity, dimension, value)) WITHOUT ROWID"
+)
+
+def _upsert(entity: str, row: str, sign: str) -> str:
+    """One UPSERT adding (sign * delta) to every counter the row contributes to"""
+    values = ", ".join(
+        f"('{entity}', '{dimension}', {value.format(r=row)}, {sign}({delta.format(r=row)}))"
+        for dimension, value, delta in COUNTER_SPECS[entity]
+    )
+    return (
+        f"INSERT INTO collection_stats (entity, dimension, value, count) VALUES {values} "
+        "ON CONFLICT (entity, dimension, value) DO UPDATE SET count = count + excluded.count;"
+    )
+
+def _trigger_ddl(entity: str) -> list:
+    add_new, remove_old = _upsert(entity, "new", "+"), _upsert(entity, "old", "-")
+    return [
+        f"CREATE TRIGGER {entity}_stats_ai AFTER INSERT ON {entity} BEGIN {add_new} END",
+        f"CREATE TRIGGER {entity}_stats_ad AFTER DELETE ON {entity} BEGIN {remove_old} END",
+        f"CREATE TRIGGER {entity}_stats_au AFTER UPDATE ON {entity} BEGIN {remove_old} {add_new} END",
+    ]
+
+def _backfill_sql(entity: str) -> str:
+    """Recompute every counter row for one entity from its table"""
+    selects = " UNION ALL ".join(
+        f"SELECT '{dimension}' AS dimension, {value.format(r=entity)} AS value, "
+        f"sum({delta.format(r=entity)}) AS count FROM {entity} GROUP BY 2"
+        for dimension, value, delta in COUNTER_SPECS[entity]
+    )
+    return (
+        f"INSERT INTO collection_stats (entity, dimension, value, count) "
+        f"SELECT '{entity}', dimension, value, count FROM ({selects}) WHERE count IS NOT NULL"
+    )
+
+def counters_available(engine) -> bool:
+    """Return True if the counters table exists (bmm-rw creates it)"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'collection_stats'")
+        ).first() is not None
+
+def ensure_counters(engine) -> None:
+    """Create the counters table and triggers if missing, seeding it from the current rows"""
+    if counters_available(engine):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_TABLE))
+        for entity in COUNTER_SPECS:
+            for statement in _trigger_ddl(entity):
+                conn.execute(text(statement))
+            conn.execute(text(_backfill_sql(entity)))
+
+def rebuild_counters(engine) -> None:
+    """Recount everything from scratch (repair tool - the triggers keep it current)"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM collection_stats"))
+        for entity in COUNTER_SPECS:
+            conn.execute(text(_backfill_sql(entity)))
+
+def read_counters(session) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """Read all counters as {entity: {dimension: {value: count}}}.
+
+    The table holds a handful of rows per distinct status/format/type, so this
+    costs the same no matter how large the collection is.
+    """
+    result = {
+        entity: {"all": {"": 0}, "status": {status: 0 for status in STATUSES[entity]}}
+        for entity in COUNTER_SPECS
+    }
+    rows = session.exec(text("SELECT entity, dimension, value, count FROM collection_stats")).all()
+    for entity, dimension, value, count in rows:
+        if count or dimension in ("all", "status"):
+            result.setdefault(entity, {}).setdefault(dimension, {})[value] = count
+    for entity in result:
+        result[entity]["total"] = result[entity]["all"][""]
+    return result
+
+def get_count(session, entity: str, dimension: str = "all", value: str = "") -> Optional[int]:
+    """Read a single counter, or None if it has never been recorded"""
+    return session.exec(
+        text("SELECT count FROM collection_stats WHERE entity = :entity AND dimension = :dimension AND value = :value"),
+        params={"entity": entity, "dimension": dimension, "value": value}
+    ).scalar()
@@ -0,0 +1,56 @@
+# File: bmm-ro/db_profile.py
+# Revision: 1.0 - SQLite connection profile: WAL journaling and per-connection pragmas
+#
+# Both apps open the same media_assets.db. In WAL mode readers never block the
+# writer and the writer never blocks readers, so bmm-ro keeps serving pages
+# while bmm-rw saves an edit. bmm-rw switches the file to WAL (a persistent
+# setting of the database file); bmm-ro opens it with mode=ro and query_only,
+# so SQLite itself refuses any write from the viewer.
+#
+# The pragmas below are applied to every new pooled connection.
+#
+# Settings (read from the environment / .env when the engine is created):
+#   BMM_SQLITE_JOURNAL_MODE    journal mode set by bmm-rw (default WAL)
+#   BMM_SQLITE_SYNCHRONOUS     synchronous level (default NORMAL - safe with WAL)
+#   BMM_SQLITE_BUSY_TIMEOUT    milliseconds to wait for a lock before failing (default 5000)
+#   BMM_SQLITE_CACHE_SIZE      page cache per connection in KiB (default 20000)
+#   BMM_SQLITE_MMAP_SIZE       bytes of the file to memory-map (default 268435456, 0 disables)
+#   BMM_SQLITE_TEMP_STORE      where temporary tables and indexes live (default MEMORY)
+#   BMM_SQLITE_READ_ONLY       bmm-ro only: "0" opens the database read-write (default 1)
+import os
+from typing import List
+
+from sqlalchemy import event
+
+def database_url(path: str, read_only: bool = False) -> str:
+    """SQLAlchemy URL for the database file; read_only opens it with SQLite's mode=ro"""
+    if read_only:
+        return f"sqlite:///file:{path}?mode=ro&uri=true"
+    return f"sqlite:///{path}"
+
+def connection_pragmas(read_only: bool = False) -> List[str]:
+    """PRAGMA statements run on each new connection"""
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(os.getenv('BMM_SQLITE_BUSY_TIMEOUT', '5000'))}",
+        f"PRAGMA cache_size = {-abs(int(os.getenv('BMM_SQLITE_CACHE_SIZE', '20000')))}",
+        f"PRAGMA mmap_size = {int(os.getenv('BMM_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))}",
+        f"PRAGMA temp_store = {os.getenv('BMM_SQLITE_TEMP_STORE', 'MEMORY')}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        # journal_mode is stored in the file, so only the writer sets it
+        pragmas.insert(0, f"PRAGMA journal_mode = {os.getenv('BMM_SQLITE_JOURNAL_MODE', 'WAL')}")
+        pragmas.append(f"PRAGMA synchronous = {os.getenv('BMM_SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    return pragmas
+
+def apply_profile(engine, read_only: bool = False) -> None:
+    """Run the profile's pragmas on every connection the engine opens"""
+    pragmas = connection_pragmas(read_only)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
@@ -0,0 +1,188 @@
+# File: bmm-ro/instrumentation.py
+# Revision: 1.1 - Requests and statements also recorded in metrics.py
+#
+# Every request gets a RequestTimings object in a context variable. Engine
+# cursor events add each SQL statement's duration to it, the Jinja template
+# class adds render time and tmdb_client adds TMDB call time. Work done on the
+# thread pool (sync routes, run_db) sees the same object, since the context is
+# copied into the worker thread.
+#
+# When the response goes out the totals are sent as a Server-Timing header
+# (visible in the browser's network panel) and logged as one JSON line on the
+# "bmm.request" logger. Statements slower than BMM_SLOW_QUERY_MS are logged
+# with their bound parameters on "bmm.slow_query", so slow list/search queries
+# and N+1 patterns show up without turning on SQLAlchemy's echo.
+#
+# Settings (read from the environment / .env when the engine is instrumented):
+#   BMM_SQL_ECHO               "1" turns SQLAlchemy's statement echo back on (default off)
+#   BMM_SLOW_QUERY_MS          statements at least this slow are logged (default 100)
+#   BMM_SLOW_QUERY_SAMPLE      fraction of slow statements logged, 0..1 (default 1)
+#   BMM_QUERY_COUNT_WARN       requests running more statements are logged as warnings (default 25)
+#   BMM_REQUEST_LOG            "0" disables the per-request log line (default on)
+#   BMM_LOG_LEVEL              level of the bmm.* loggers (default INFO)
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+import metrics
+
+request_log = logging.getLogger("bmm.request")
+slow_query_log = logging.getLogger("bmm.slow_query")
+
+_settings = {}
+
+class RequestTimings:
+    """Counters for one request (milliseconds)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.db_queries = 0
+        self.db_ms = 0.0
+        self.template_renders = 0
+        self.template_ms = 0.0
+        self.tmdb_calls = 0
+        self.tmdb_ms = 0.0
+
+    def add(self, kind: str, elapsed_ms: float) -> None:
+        with self._lock:
+            if kind == "db":
+                self.db_queries += 1
+                self.db_ms += elapsed_ms
+            elif kind == "template":
+                self.template_renders += 1
+                self.template_ms += elapsed_ms
+            elif kind == "tmdb":
+                self.tmdb_calls += 1
+                self.tmdb_ms += elapsed_ms
+
+    def server_timing(self, total_ms: float) -> str:
+        queries = "1 query" if self.db_queries == 1 else f"{self.db_queries} queries"
+        parts = [f'db;dur={self.db_ms:.1f};desc="{queries}"', f"tpl;dur={self.template_ms:.1f}"]
+        if self.tmdb_calls:
+            calls = "1 call" if self.tmdb_calls == 1 else f"{self.tmdb_calls} calls"
+            parts.append(f'tmdb;dur={self.tmdb_ms:.1f};desc="{calls}"')
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("bmm_request_timings", default=None)
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+def record(kind: str, elapsed_ms: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(kind, elapsed_ms)
+
+@contextmanager
+def timed(kind: str):
+    """Time a block and add it to the current request under kind ("tmdb", ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, (time.perf_counter() - start) * 1000)
+
+def configure() -> None:
+    """Read settings and give the bmm.* loggers a handler if the app hasn't configured one"""
+    _settings.update({
+        "echo": os.getenv("BMM_SQL_ECHO", "0") == "1",
+        "slow_ms": float(os.getenv("BMM_SLOW_QUERY_MS", "100")),
+        "slow_sample": float(os.getenv("BMM_SLOW_QUERY_SAMPLE", "1")),
+        "query_warn": int(os.getenv("BMM_QUERY_COUNT_WARN", "25")),
+        "request_log": os.getenv("BMM_REQUEST_LOG", "1") != "0",
+    })
+    logger = logging.getLogger("bmm")
+    logger.setLevel(os.getenv("BMM_LOG_LEVEL", "INFO").upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+def sql_echo() -> bool:
+    """Value for create_engine(echo=...)"""
+    if not _settings:
+        configure()
+    return _settings["echo"]
+
+def instrument_engine(engine) -> None:
+    """Time every statement the engine runs and log the slow ones"""
+    if not _settings:
+        configure()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bmm_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["bmm_query_start"].pop()) * 1000
+        record("db", elapsed_ms)
+        metrics.db_queries.observe(elapsed_ms / 1000)
+        if elapsed_ms >= _settings["slow_ms"] and random.random() < _settings["slow_sample"]:
+            slow_query_log.warning(json.dumps({
+                "duration_ms": round(elapsed_ms, 1),
+                "statement": " ".join(statement.split()),
+                "parameters": repr(parameters)[:500],
+            }))
+
+    @event.listens_for(engine, "handle_error")
+    def failed_query(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("bmm_query_start"):
+            connection.info["bmm_query_start"].pop()
+
+def instrument_templates(templates) -> None:
+    """Time every top-level template render (call before any template is loaded)"""
+    base_class = templates.env.template_class
+
+    class TimedTemplate(base_class):
+        def render(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                record("template", (time.perf_counter() - start) * 1000)
+
+    templates.env.template_class = TimedTemplate
+
+async def handle_request(request, call_next):
+    """HTTP middleware body: collect timings for the request and report them"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.observe_request(request, 500, time.perf_counter() - start)
+        raise
+    finally:
+        _current.reset(token)
+    total_ms = (time.perf_counter() - start) * 1000
+    metrics.observe_request(request, response.status_code, total_ms / 1000)
+    response.headers["Server-Timing"] = timings.server_timing(total_ms)
+
+    path = request.url.path
+    too_many_queries = timings.db_queries > _settings["query_warn"]
+    if (_settings["request_log"] or too_many_queries) and not path.startswith("/static/"):
+        request_log.log(logging.WARNING if too_many_queries else logging.INFO, json.dumps({
+            "method": request.method,
+            "path": path,
+            "status": response.status_code,
+            "duration_ms": round(total_ms, 1),
+            "db_queries": timings.db_queries,
+            "db_ms": round(timings.db_ms, 1),
+            "template_ms": round(timings.template_ms, 1),
+            "tmdb_calls": timings.tmdb_calls,
+            "tmdb_ms": round(timings.tmdb_ms, 1),
+        }))
+    return response
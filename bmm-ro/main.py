@@ -1,16 +1,30 @@
-# main.py (Read-Only Version) version 1.14
+# main.py (Read-Only Version) version 1.28
 # File: bmm-ro/main.py
-# Revision: 1.14 - Added HTMX support and mobile-first responsive UI
+# Revision: 1.28 - Previous/Next of ranked search results follow the rank order
 #  
 from fastapi import FastAPI, Request, Depends, Query, HTTPException, Header
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlmodel import Field, Session, SQLModel, create_engine, select, Relationship, col, func
-from typing import Optional, List
+from sqlalchemy import Index
+from sqlalchemy.orm import joinedload
+from urllib.parse import urlencode
+from typing import Optional, List, Callable
 from datetime import datetime
 import os
+import anyio
 import re
+import search_index
+import pagination
+import counters
+import db_profile
+import exporter
+import images
+import instrumentation
+import metrics
+import page_cache
+from search_index import assets_fts, media_fts
 from typing import TYPE_CHECKING
 
 def get_version():
@@ -73,6 +87,8 @@ class MediaBase(SQLModel):
 
 class Media(MediaBase, table=True):
     __tablename__ = "media"
+    # Serves the "already in library" check on TMDB search results (created by bmm-rw)
+    __table_args__ = (Index("ix_media_mtype_tmdbid", "mtype", "tmdbid"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     creation: datetime = Field(default_factory=datetime.now)
@@ -81,8 +97,28 @@ class Media(MediaBase, table=True):
     assets: List["Asset"] = Relationship(back_populates="media", link_model=MediaAssetLink)
 
 # Database setup - using the same database as the main application
-DATABASE_URL = "sqlite:///./media_assets.db"
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
+# BMM_DATABASE_PATH points the app at another database file (e.g. a benchmark dataset)
+DATABASE_PATH = os.getenv("BMM_DATABASE_PATH", "./media_assets.db")
+# Open the shared database with SQLite's own read-only mode (see db_profile.py)
+READ_ONLY_DATABASE = os.getenv("BMM_SQLITE_READ_ONLY", "1") != "0"
+DATABASE_URL = db_profile.database_url(DATABASE_PATH, read_only=READ_ONLY_DATABASE)
+# Size of the worker pool that runs blocking database work off the event loop
+DB_THREADS = int(os.getenv("BMM_DB_THREADS", "8"))
+engine = create_engine(
+    DATABASE_URL,
+    echo=instrumentation.sql_echo(),
+    connect_args={"check_same_thread": False},
+    pool_size=DB_THREADS,
+    max_overflow=DB_THREADS
+)
+db_profile.apply_profile(engine, read_only=READ_ONLY_DATABASE)
+instrumentation.instrument_engine(engine)
+metrics.register_pool(engine)
+metrics.register_thread_pool()
+
+# Set at startup - the FTS5 index and the counters are created and maintained by bmm-rw
+FTS_ENABLED = False
+COUNTERS_ENABLED = False
 
 def get_session():
     with Session(engine) as session:
@@ -94,6 +130,20 @@ app = FastAPI(title="Media Assets Viewer")
 # Templates and static files setup
 templates = Jinja2Templates(directory="templates-readonly")
 app.mount("/static", StaticFiles(directory="static"), name="static")
+instrumentation.instrument_templates(templates)
+templates.env.filters["poster_src"] = images.poster_src
+templates.env.filters["poster_srcset"] = images.poster_srcset
+
+# Rendered pages served from memory, or 304, until the database changes (see page_cache.py).
+# Declared before instrument_requests so that one wraps it and still times cached responses.
+@app.middleware("http")
+async def serve_cached_pages(request: Request, call_next):
+    return await page_cache.handle_request(request, call_next)
+
+# Query count, DB/template/TMDB time per request: Server-Timing header and request log
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    return await instrumentation.handle_request(request, call_next)
 
 # Get version once at startup
 APP_VERSION = get_version()
@@ -108,54 +158,99 @@ def get_base_context(request: Request) -> dict:
 
 # Routes - Read-only version
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, session: Session = Depends(get_session)):
-    media_count = session.exec(select(Media)).all().__len__()
-    asset_count = session.exec(select(Asset)).all().__len__()
+def home(request: Request, session: Session = Depends(get_session)):
+    if COUNTERS_ENABLED:
+        # Dashboard counters are kept current by bmm-rw's triggers - no table scans
+        stats = counters.read_counters(session)
+        media_count = stats["media"]["total"]
+        asset_count = stats["assets"]["total"]
+    else:
+        stats = None
+        media_count = session.exec(select(func.count()).select_from(Media)).one()
+        asset_count = session.exec(select(func.count()).select_from(Asset)).one()
     context = get_base_context(request)
-    context.update({"media_count": media_count, "asset_count": asset_count})
+    context.update({"media_count": media_count, "asset_count": asset_count, "stats": stats})
     return templates.TemplateResponse("home.html", context)
 
+def search_filters(model, fts, search: Optional[str]) -> list:
+    """A list page's search as WHERE criteria on model (or an alias of it) - FTS5 when available"""
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        return [model.id.in_(select(fts.c.rowid).where(search_index.matches(fts, match)))]
+    if search:
+        return [col(model.title).contains(search)]
+    return []
+
+def with_neighbors(model, fts, search: Optional[str], criteria_for: Optional[Callable] = None):
+    """SELECT of model plus the prev_id/next_id of its row in the list a detail page was
+    opened from: relevance order for an FTS search, (title, id) order otherwise"""
+    criteria_for = criteria_for or (lambda alias: [])
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        ranked = pagination.ranked_neighbors(model, fts, search_index.matches(fts, match), criteria_for)
+        return select(model, ranked.c.prev_id, ranked.c.next_id).outerjoin(ranked, ranked.c.id == model.id)
+    return select(model, *pagination.neighbor_columns(
+        model, lambda alias: search_filters(alias, fts, search) + criteria_for(alias)
+    ))
+
+def media_status_filters(model, status: Optional[str]) -> list:
+    """The media list's status filter as WHERE criteria on model (or an alias of it)"""
+    if status == "active":
+        return [model.active == True]
+    if status == "inactive":
+        return [model.active == False]
+    if status == "flagged":
+        return [model.flag == True]
+    if status == "acquire":
+        return [model.acquire == True]
+    return []
+
+def list_query_string(search: Optional[str], status: Optional[str] = None) -> str:
+    """Query string carrying a list's search/status to its detail pages, for Previous/Next"""
+    return urlencode({name: value for name, value in (("search", search), ("status", status)) if value})
+
 # Asset Routes - Read-only
 @app.get("/assets/", response_class=HTMLResponse)
-async def list_assets(
+def list_assets(
     request: Request, 
     session: Session = Depends(get_session),
     page: int = Query(1, ge=1),
     per_page: int = Query(50, ge=1, le=100),
-    search: str = None
+    search: str = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    count: Optional[str] = Query(None, regex="^exact$")
 ):
-    # Calculate offset based on page and per_page
-    offset = (page - 1) * per_page
-    
     # Base query
     query = select(Asset)
     count_query = select(func.count()).select_from(Asset)
     
-    # Apply search filter if provided
-    if search:
+    order_by = [Asset.title]
+    
+    # Apply search filter if provided - FTS5 index when available, ranked by relevance
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        query = query.join(assets_fts, assets_fts.c.rowid == Asset.id).where(search_index.matches(assets_fts, match))
+        count_query = select(func.count()).select_from(assets_fts).where(search_index.matches(assets_fts, match))
+        order_by = [assets_fts.c.rank, Asset.title, Asset.id]
+    elif search:
         query = query.where(col(Asset.title).contains(search))
         count_query = count_query.where(col(Asset.title).contains(search))
     
-    # Get total count for pagination
-    total_count = session.exec(count_query).one()
-    
-    # Calculate total pages
-    total_pages = (total_count + per_page - 1) // per_page
-    
-    # Get assets with pagination (sorted alphabetically by title)
-    assets = session.exec(query.order_by(Asset.title).offset(offset).limit(per_page)).all()
+    # Get assets with pagination (sorted alphabetically by title, or by rank when searching)
+    assets, page_data = pagination.paginate(
+        session, query, count_query, Asset, order_by, page, per_page,
+        after=after, before=before, exact_count=count == "exact", filtered=bool(search),
+        known_total=counters.get_count(session, "assets") if COUNTERS_ENABLED and not search else None
+    )
     
     # Context for the template
     context = get_base_context(request)
     context.update({
         "assets": assets,
         "search": search or "", 
-        "pagination": {
-            "page": page,
-            "per_page": per_page,
-            "total_count": total_count,
-            "total_pages": total_pages
-        }
+        "pagination": page_data,
+        "list_query": list_query_string(search)
     })
     
     # Return partial template for HTMX requests
@@ -166,81 +261,75 @@ async def list_assets(
     return templates.TemplateResponse("asset_list.html", context)
 
 @app.get("/assets/{asset_id}", response_class=HTMLResponse)
-async def get_asset(
+def get_asset(
     request: Request,
     asset_id: int,
+    search: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
-    asset = session.get(Asset, asset_id)
-    if not asset:
+    # One statement: the asset, its linked media, and its neighbors in the
+    # list it was opened from (same order and search)
+    row = session.exec(
+        with_neighbors(Asset, assets_fts, search)
+        .where(Asset.id == asset_id)
+        .options(joinedload(Asset.media))
+    ).unique().first()
+    if not row:
         raise HTTPException(status_code=404, detail="Asset not found")
-    
-    # Get the previous and next asset IDs for navigation
-    prev_asset = session.exec(
-        select(Asset).where(Asset.id < asset_id).order_by(Asset.id.desc()).limit(1)
-    ).first()
-    
-    next_asset = session.exec(
-        select(Asset).where(Asset.id > asset_id).order_by(Asset.id).limit(1)
-    ).first()
-    
-    prev_id = prev_asset.id if prev_asset else None
-    next_id = next_asset.id if next_asset else None
+    asset, prev_id, next_id = row
     
     context = get_base_context(request)
     context.update({
         "asset": asset,
         "prev_id": prev_id,
-        "next_id": next_id
+        "next_id": next_id,
+        "list_query": list_query_string(search)
     })
     
     return templates.TemplateResponse("asset_detail.html", context)
 
 # Media Routes - Read-only
 @app.get("/media/", response_class=HTMLResponse)
-async def list_media(
+def list_media(
     request: Request, 
     session: Session = Depends(get_session),
     page: int = Query(1, ge=1),
     per_page: int = Query(50, ge=1, le=100),
     search: str = None,
-    status: str = None
+    status: str = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    count: Optional[str] = Query(None, regex="^exact$")
 ):
-    # Calculate offset based on page and per_page
-    offset = (page - 1) * per_page
-    
     # Base query
     query = select(Media)
     count_query = select(func.count()).select_from(Media)
     
-    # Apply search filter if provided
-    if search:
+    order_by = [Media.title]
+    
+    # Apply search filter if provided - FTS5 index when available, ranked by relevance
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        query = query.join(media_fts, media_fts.c.rowid == Media.id).where(search_index.matches(media_fts, match))
+        count_query = count_query.join(media_fts, media_fts.c.rowid == Media.id).where(search_index.matches(media_fts, match))
+        order_by = [media_fts.c.rank, Media.title, Media.id]
+    elif search:
         query = query.where(col(Media.title).contains(search))
         count_query = count_query.where(col(Media.title).contains(search))
     
     # Apply status filter if provided
-    if status:
-        if status == "active":
-            query = query.where(Media.active == True)
-            count_query = count_query.where(Media.active == True)
-        elif status == "inactive":
-            query = query.where(Media.active == False)
-            count_query = count_query.where(Media.active == False)
-        elif status == "flagged":
-            query = query.where(Media.flag == True)
-            count_query = count_query.where(Media.flag == True)
-        elif status == "acquire":
-            query = query.where(Media.acquire == True)
-            count_query = count_query.where(Media.acquire == True)
-    
-    # Get total count for pagination
-    total_count = session.exec(count_query).one()
-    
-    # Calculate total pages
-    total_pages = (total_count + per_page - 1) // per_page
-    
-    # Get media items with pagination (sorted alphabetically by title)
-    media_items = session.exec(query.order_by(Media.title).offset(offset).limit(per_page)).all()
+    for criterion in media_status_filters(Media, status):
+        query = query.where(criterion)
+        count_query = count_query.where(criterion)
+    
+    # Get media items with pagination (sorted alphabetically by title, or by rank when searching)
+    media_items, page_data = pagination.paginate(
+        session, query, count_query, Media, order_by, page, per_page,
+        after=after, before=before, exact_count=count == "exact", filtered=bool(search or status),
+        known_total=None if search or not COUNTERS_ENABLED else (
+            counters.get_count(session, "media", "status", status) if status else counters.get_count(session, "media")
+        )
+    )
     
     # Context for the template
     context = get_base_context(request)
@@ -248,12 +337,8 @@ async def list_media(
         "media_items": media_items, 
         "search": search or "",
         "status": status or "",
-        "pagination": {
-            "page": page,
-            "per_page": per_page,
-            "total_count": total_count,
-            "total_pages": total_pages
-        }
+        "pagination": page_data,
+        "list_query": list_query_string(search, status)
     })
     
     # Return partial template for HTMX requests
@@ -264,36 +349,97 @@ async def list_media(
     return templates.TemplateResponse("media_list.html", context)
 
 @app.get("/media/{media_id}", response_class=HTMLResponse)
-async def get_media(
+def get_media(
     request: Request,
     media_id: int,
+    search: Optional[str] = None,
+    status: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
-    media = session.get(Media, media_id)
-    if not media:
+    # One statement: the media, its linked assets, and its neighbors in the
+    # list it was opened from (same order, search and status filter)
+    row = session.exec(
+        with_neighbors(Media, media_fts, search, lambda alias: media_status_filters(alias, status))
+        .where(Media.id == media_id)
+        .options(joinedload(Media.assets))
+    ).unique().first()
+    if not row:
         raise HTTPException(status_code=404, detail="Media not found")
-    
-    # Get the previous and next media IDs for navigation
-    prev_media = session.exec(
-        select(Media).where(Media.id < media_id).order_by(Media.id.desc()).limit(1)
-    ).first()
-    
-    next_media = session.exec(
-        select(Media).where(Media.id > media_id).order_by(Media.id).limit(1)
-    ).first()
-    
-    prev_id = prev_media.id if prev_media else None
-    next_id = next_media.id if next_media else None
+    media, prev_id, next_id = row
     
     context = get_base_context(request)
     context.update({
         "media": media,
         "prev_id": prev_id,
-        "next_id": next_id
+        "next_id": next_id,
+        "list_query": list_query_string(search, status)
     })
     
     return templates.TemplateResponse("media_detail.html", context)
 
+# Streaming export (see exporter.py): /export/media.csv, /export/assets.ndjson.gz, /export/links.csv ...
+# A list's search (and the media status filter) narrow the export the same way.
+def export_statement(entity: str, search: Optional[str] = None, status: Optional[str] = None):
+    """Core select for an export, in id order so rows stream straight off the primary key"""
+    if entity == "media":
+        criteria = search_filters(Media, media_fts, search) + media_status_filters(Media, status)
+        return select(*exporter.table_columns(Media.__table__)).where(*criteria).order_by(Media.id)
+    if entity == "assets":
+        return select(*exporter.table_columns(Asset.__table__)).where(*search_filters(Asset, assets_fts, search)).order_by(Asset.id)
+    if entity == "links":
+        return select(*exporter.table_columns(MediaAssetLink.__table__)).order_by(MediaAssetLink.media_id, MediaAssetLink.asset_id)
+    return None
+
+@app.get("/export/{name}")
+def export_collection(name: str, search: Optional[str] = None, status: Optional[str] = None):
+    parsed = exporter.parse_name(name)
+    statement = export_statement(parsed[0], search, status) if parsed else None
+    if statement is None:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    entity, fmt, compress = parsed
+    return StreamingResponse(
+        exporter.stream(engine, statement, fmt, compress),
+        media_type=exporter.media_type(fmt, compress),
+        headers={"Content-Disposition": f'attachment; filename="{exporter.filename(entity, fmt, compress)}"'}
+    )
+
+# Cached poster images (see images.py) - the file name is a content hash, so
+# responses never change and browsers may keep them forever
+@app.get("/images/{name}")
+def get_image(name: str, if_none_match: Optional[str] = Header(None)):
+    path = images.file_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    headers = {"ETag": images.etag_for(name), "Cache-Control": images.CACHE_CONTROL}
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+# Prometheus metrics (see metrics.py) - async so scrape-time gauges read the worker
+# thread limiter from the event loop
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.on_event("startup")
+def on_startup():
+    global FTS_ENABLED, COUNTERS_ENABLED
+    # Bound the worker pool that the (sync) routes execute on
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADS
+    FTS_ENABLED = search_index.fts_available(engine)
+    COUNTERS_ENABLED = counters.counters_available(engine)
+    images.start()
+    # A stored poster changes the image URLs in pages, so it invalidates them too
+    page_cache.start(DATABASE_PATH, lambda: images.generation)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    images.stop()
+    page_cache.stop()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)  # Using a different port from the main app
\ No newline at end of file
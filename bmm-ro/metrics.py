@@ -0,0 +1,210 @@
+# File: bmm-ro/metrics.py
+# Revision: 1.0 - Prometheus text-format metrics for /metrics
+#
+# A small in-process registry of counters, histograms and scrape-time gauges,
+# rendered in the Prometheus text exposition format. Recording is a dict
+# lookup and an add under a lock, so it is cheap enough for every request and
+# every SQL statement. Gauges (pool usage, cache hit ratios) are computed only
+# when /metrics is scraped.
+#
+# Settings (read from the environment / .env):
+#   BMM_METRICS                "0" makes /metrics answer 404 (default on)
+import bisect
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import anyio
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_lock = threading.Lock()
+_registry: List["Metric"] = []
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        _registry.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with _lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in sorted(values)]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket (+Inf last)], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        with _lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.label_names, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+class Gauge(Metric):
+    """Value(s) computed at scrape time by a callback returning [(label values, value)].
+
+    kind="counter" exports running totals kept elsewhere (e.g. a module's stats dict).
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str], collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]], kind: str = "gauge"):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in self.collect()]
+
+# Requests, recorded by instrumentation.handle_request
+http_requests = Counter(
+    "bmm_http_requests_total", "HTTP requests by route template, status and response kind (htmx partial or full page)",
+    ("method", "route", "status", "kind")
+)
+http_duration = Histogram(
+    "bmm_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+# SQL statements, recorded by instrumentation's engine events
+db_queries = Histogram("bmm_db_query_duration_seconds", "SQL statement latency", (), QUERY_BUCKETS)
+# TMDB API calls, recorded by tmdb_client
+tmdb_duration = Histogram("bmm_tmdb_request_duration_seconds", "TMDB API call latency by endpoint", ("endpoint",))
+tmdb_responses = Counter("bmm_tmdb_responses_total", "TMDB API responses by endpoint and HTTP status", ("endpoint", "status"))
+tmdb_errors = Counter("bmm_tmdb_errors_total", "TMDB API calls that failed without a response", ("endpoint", "error"))
+
+_caches: Dict[str, Tuple[dict, Tuple[str, ...], Tuple[str, ...]]] = {}
+
+def register_cache(name: str, stats: dict, hit_keys: Iterable[str], miss_keys: Iterable[str]) -> None:
+    """Export a module's stats dict as bmm_cache_events_total plus a hit ratio"""
+    _caches[name] = (stats, tuple(hit_keys), tuple(miss_keys))
+
+def _cache_events():
+    for name, (stats, _, _) in sorted(_caches.items()):
+        for event_name, value in sorted(stats.items()):
+            yield (name, event_name), value
+
+def _cache_ratios():
+    for name, (stats, hit_keys, miss_keys) in sorted(_caches.items()):
+        hits = sum(stats.get(key, 0) for key in hit_keys)
+        lookups = hits + sum(stats.get(key, 0) for key in miss_keys)
+        yield (name,), (hits / lookups if lookups else 0.0)
+
+Gauge("bmm_cache_events_total", "Cache events (hits, misses, stores, ...) since start", ("cache", "event"), _cache_events, kind="counter")
+Gauge("bmm_cache_hit_ratio", "Cache hits / lookups since start", ("cache",), _cache_ratios)
+
+def register_pool(engine) -> None:
+    """Export the engine's connection pool usage"""
+    pool = engine.pool
+
+    def collect():
+        yield ("size",), pool.size()
+        yield ("checked_out",), pool.checkedout()
+        yield ("checked_in",), pool.checkedin()
+        yield ("overflow",), max(0, pool.overflow())  # SQLAlchemy counts up from -pool_size
+    Gauge("bmm_db_pool_connections", "Database connection pool usage", ("state",), collect)
+
+def register_thread_pool() -> None:
+    """Export usage of the worker threads that run sync routes and database work"""
+    def collect():
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        yield ("total",), limiter.total_tokens
+        yield ("busy",), limiter.borrowed_tokens
+    Gauge("bmm_worker_threads", "Worker thread pool usage", ("state",), collect)
+
+def tmdb_endpoint(path: str) -> str:
+    """Low-cardinality label for a TMDB path: "/search/movie", "/movie/{id}", ..."""
+    parts = [part if not part.isdigit() else "{id}" for part in path.split("/")]
+    return "/".join(parts)
+
+def enabled() -> bool:
+    return os.getenv("BMM_METRICS", "1") != "0"
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        body = metric.render()
+        if body or not isinstance(metric, Gauge):
+            lines.extend(metric.header())
+            lines.extend(body)
+    return "\n".join(lines) + "\n"
+
+_route_paths: Dict[Callable, str] = {}
+
+def route_template(request) -> str:
+    """The path template of the route that handled the request, e.g. /assets/{asset_id}.
+
+    Raw paths would give every record its own time series, so requests are
+    labelled by route instead; anything the router didn't match is "unmatched".
+    """
+    route = request.scope.get("route")
+    if route is not None:
+        return route.path
+    endpoint = request.scope.get("endpoint")
+    if endpoint is not None:
+        path = _route_paths.get(endpoint)
+        if path is None:
+            for candidate in request.scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is endpoint:
+                    path = _route_paths[endpoint] = candidate.path
+                    break
+        if path is not None:
+            return path
+    if request.url.path.startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+def observe_request(request, status: int, seconds: float) -> None:
+    route = route_template(request)
+    kind = "htmx" if request.headers.get("HX-Request") else "page"
+    http_requests.inc(request.method, route, str(status), kind)
+    http_duration.observe(seconds, request.method, route)
@@ -0,0 +1,215 @@
+# File: bmm-ro/page_cache.py
+# Revision: 1.2 - The database is checked for changes at most every BMM_PAGE_CACHE_CHECK_MS
+#
+# bmm-ro never writes to media_assets.db, so its pages only change when bmm-rw
+# commits (or a poster finishes downloading, which changes the image URLs).
+# SQLite's PRAGMA data_version, read on a connection of our own, changes
+# whenever another connection has committed since the previous read; each
+# change starts a new "generation" of the data. The check runs at most once
+# every BMM_PAGE_CACHE_CHECK_MS; requests in between reuse its answer without
+# touching SQLite or the lock, so a bmm-rw edit shows up within that time.
+#
+# Rendered pages are kept in an in-memory LRU keyed by path, query string and
+# HX-Request; only 200 text/html responses are stored, and the LRU is emptied
+# when the generation changes. A cached page carries an ETag (process +
+# generation + a hash of its key) and a Last-Modified time, with
+# Cache-Control: no-cache so browsers revalidate on every visit and bmm-rw's
+# edits show up at once. A request for a page in the cache is answered 304
+# when its If-None-Match / If-Modified-Since matches, otherwise from the
+# cache; anything else runs the route. So a 404, a redirect or a download is
+# never answered 304, whatever validator the client sends.
+#
+# Settings (read from the environment / .env when the cache is started):
+#   BMM_PAGE_CACHE             "0" disables the page cache and 304 responses (default on)
+#   BMM_PAGE_CACHE_ITEMS       rendered pages kept in memory (default 1000)
+#   BMM_PAGE_CACHE_MAX_BYTES   memory for rendered pages in bytes (default 67108864)
+#   BMM_PAGE_CACHE_CHECK_MS    milliseconds between checks for database changes (default 250)
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Response
+from starlette.routing import Match
+
+import metrics
+
+# Paths with caching of their own (or none wanted)
+UNCACHED_PREFIXES = ("/static/", "/images/", "/metrics")
+CACHE_CONTROL = "no-cache"
+
+class CachedPage(NamedTuple):
+    body: bytes
+    content_type: str
+
+_settings = {}
+_lock = threading.Lock()
+_pages: "OrderedDict[Tuple[str, str, bool], CachedPage]" = OrderedDict()
+_state = {"conn": None, "files": (), "extra": None, "version": None, "generation": 0, "modified": 0.0, "bytes": 0,
+          "current": (0, 0.0), "next_check": 0.0}
+# ETags from an earlier run (older templates) never match
+_boot = secrets.token_hex(4)
+_started = time.time()
+
+# Counters, exposed for monitoring
+stats = {"hits": 0, "not_modified": 0, "misses": 0, "stores": 0, "invalidations": 0}
+metrics.register_cache("page", stats, hit_keys=("hits", "not_modified"), miss_keys=("misses",))
+
+def start(database_path: str, extra_version: Optional[Callable[[], object]] = None) -> None:
+    """Open the change-detection connection (called from the app's startup event).
+
+    extra_version, if given, is another source of change: the cache is also
+    emptied when its value changes.
+    """
+    _settings.update({
+        "enabled": os.getenv("BMM_PAGE_CACHE", "1") != "0",
+        "max_items": int(os.getenv("BMM_PAGE_CACHE_ITEMS", "1000")),
+        "max_bytes": int(os.getenv("BMM_PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        "check_interval": float(os.getenv("BMM_PAGE_CACHE_CHECK_MS", "250")) / 1000,
+    })
+    if not _settings["enabled"] or _state["conn"] is not None:
+        return
+    path = os.path.abspath(database_path)
+    _state["conn"] = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, check_same_thread=False)
+    _state["files"] = (path, path + "-wal")
+    _state["extra"] = extra_version
+
+def stop() -> None:
+    """Close the connection and drop the cached pages (called from the shutdown event)"""
+    with _lock:
+        if _state["conn"] is not None:
+            _state["conn"].close()
+            _state["conn"] = None
+        _pages.clear()
+        _state["bytes"] = 0
+        _state["next_check"] = 0.0
+
+def enabled() -> bool:
+    return bool(_settings.get("enabled")) and _state["conn"] is not None
+
+def _files_modified() -> float:
+    modified = _started
+    for path in _state["files"]:
+        try:
+            modified = max(modified, os.path.getmtime(path))
+        except OSError:
+            pass
+    return modified
+
+def generation() -> Tuple[int, float]:
+    """Current data generation and its Last-Modified time, emptying the cache if the data changed"""
+    if time.monotonic() < _state["next_check"]:
+        return _state["current"]
+    with _lock:
+        version = (
+            _state["conn"].execute("PRAGMA data_version").fetchone()[0],
+            _state["extra"]() if _state["extra"] else None,
+        )
+        if version != _state["version"]:
+            if _state["version"] is not None:
+                _state["generation"] += 1
+                stats["invalidations"] += 1
+                _pages.clear()
+                _state["bytes"] = 0
+            _state["version"] = version
+            # Never earlier than our start, so a page rendered by older templates isn't "not modified"
+            _state["modified"] = _files_modified()
+        _state["current"] = (_state["generation"], _state["modified"])
+        _state["next_check"] = time.monotonic() + _settings["check_interval"]
+        return _state["current"]
+
+def _get(key: Tuple[str, str, bool]) -> Optional[CachedPage]:
+    with _lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+        return page
+
+def _put(key: Tuple[str, str, bool], page: CachedPage, page_generation: int) -> None:
+    size = len(page.body)
+    if size > _settings["max_bytes"]:
+        return
+    with _lock:
+        # Rendered while the data changed - it may already be stale
+        if page_generation != _state["generation"]:
+            return
+        previous = _pages.pop(key, None)
+        if previous is not None:
+            _state["bytes"] -= len(previous.body)
+        _pages[key] = page
+        _state["bytes"] += size
+        while len(_pages) > _settings["max_items"] or _state["bytes"] > _settings["max_bytes"]:
+            _, evicted = _pages.popitem(last=False)
+            _state["bytes"] -= len(evicted.body)
+    stats["stores"] += 1
+
+def _not_modified(request, etag: str, modified: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _match_route(request) -> None:
+    """Resolve the route without running it, so metrics label cached responses like rendered ones"""
+    for route in request.app.router.routes:
+        match, child_scope = route.matches(request.scope)
+        if match == Match.FULL:
+            request.scope.update(child_scope)
+            return
+
+def _etag(key: Tuple[str, str, bool], page_generation: int) -> str:
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{_boot}-{page_generation}-{digest}"'
+
+async def handle_request(request, call_next):
+    """HTTP middleware body: answer from the cache or with 304 when the data hasn't changed"""
+    path = request.url.path
+    if request.method != "GET" or not enabled() or path.startswith(UNCACHED_PREFIXES):
+        return await call_next(request)
+
+    page_generation, modified = generation()
+    htmx = request.headers.get("HX-Request") == "true"
+    key = (path, request.url.query, htmx)
+    etag = _etag(key, page_generation)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+        # Full page and HTMX partial share a URL; keep browsers from mixing them up
+        "Vary": "HX-Request",
+    }
+    # Only a page this generation rendered (a 200 HTML page) can be "not modified"
+    page = _get(key)
+    if page is not None and _not_modified(request, etag, modified):
+        stats["not_modified"] += 1
+        _match_route(request)
+        return Response(status_code=304, headers=headers)
+    if page is not None:
+        stats["hits"] += 1
+        _match_route(request)
+        return Response(content=page.body, headers={**headers, "Content-Type": page.content_type})
+
+    stats["misses"] += 1
+    response = await call_next(request)
+    content_type = response.headers.get("content-type", "")
+    if response.status_code != 200 or not content_type.startswith("text/html"):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    _put(key, CachedPage(body, content_type), page_generation)
+    response_headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    response_headers.update(headers)
+    return Response(content=body, status_code=200, headers=response_headers)
@@ -0,0 +1,87 @@
+# File: bmm-ro/search_index.py
+# Revision: 1.1 - Missing FTS5 reported through logging
+#
+# The FTS tables are external-content tables over "assets" and "media".
+# Triggers keep them in step with every INSERT/UPDATE/DELETE, so the write
+# routes never touch the index themselves and it can't drift out of sync.
+import logging
+import re
+from typing import Optional
+
+from sqlalchemy import column, literal_column, table, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger("bmm.search")
+
+# Indexed columns per source table, with bm25 weights (title counts most)
+FTS_COLUMNS = {
+    "assets": (("title", 10.0), ("subtitle", 4.0), ("notes", 1.0), ("location", 2.0), ("isbn", 5.0)),
+    "media": (("title", 10.0), ("subtitle", 4.0), ("notes", 1.0)),
+}
+
+# Lightweight table clauses for use in queries (not part of SQLModel.metadata)
+assets_fts = table("assets_fts", column("rowid"), column("rank"))
+media_fts = table("media_fts", column("rowid"), column("rank"))
+
+def _fts_ddl(source: str) -> list:
+    """Build the CREATE statements for one source table's FTS index"""
+    fts = f"{source}_fts"
+    cols = [name for name, _ in FTS_COLUMNS[source]]
+    col_list = ", ".join(cols)
+    new_vals = ", ".join(f"new.{c}" for c in cols)
+    old_vals = ", ".join(f"old.{c}" for c in cols)
+    weights = ", ".join(str(weight) for _, weight in FTS_COLUMNS[source])
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({col_list}, content='{source}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {source} BEGIN "
+        f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END",
+        # Only fires when an indexed column is written, so status toggles don't churn the index
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {col_list} ON {source} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+        f"INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals}); END",
+        # Persist the ranking function so "ORDER BY rank" uses the column weights
+        f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', 'bm25({weights})')",
+        # Index whatever rows already exist
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+def fts_available(engine) -> bool:
+    """Return True if both FTS tables exist in the database"""
+    with engine.connect() as conn:
+        names = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('assets_fts', 'media_fts')")
+        ).scalars().all()
+    return len(names) == 2
+
+def ensure_fts(engine) -> bool:
+    """Create any missing FTS tables and triggers. Returns False if FTS5 is unavailable."""
+    try:
+        with engine.begin() as conn:
+            for source in FTS_COLUMNS:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {"name": f"{source}_fts"}
+                ).first()
+                if exists:
+                    continue
+                for statement in _fts_ddl(source):
+                    conn.execute(text(statement))
+    except OperationalError as exc:
+        # SQLite built without FTS5 - searches fall back to LIKE
+        logger.warning("FTS5 search index unavailable, searching with LIKE: %s", exc)
+        return False
+    return True
+
+def match_expression(search: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match as a prefix"""
+    terms = re.findall(r"\w+", search or "")
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+def matches(fts, expression: str):
+    """WHERE clause for "<fts table> MATCH :expression" """
+    return literal_column(fts.name).op("MATCH")(expression)
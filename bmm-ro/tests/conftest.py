@@ -0,0 +1,10 @@
+# Shared setup for the bmm-ro tests (python -m pytest bmm-ro/tests)
+#
+# The modules under test are imported from bmm-ro/ itself; they don't need
+# the app (main.py) or its database, so nothing else is set up here.
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
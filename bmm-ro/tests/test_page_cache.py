@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
+from fastapi.testclient import TestClient
+
+import page_cache
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "media_assets.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE media (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.execute("INSERT INTO media (title) VALUES ('Alien')")
+    return path
+
+@pytest.fixture
+def renders():
+    """How many times each route ran"""
+    return {}
+
+@pytest.fixture
+def client(database, renders, monkeypatch):
+    """An app with the page cache in front of a page, a 404, a redirect and a download"""
+    monkeypatch.setenv("BMM_PAGE_CACHE", "1")
+    # Check for changes on every request, so a write shows up on the next one
+    monkeypatch.setenv("BMM_PAGE_CACHE_CHECK_MS", "0")
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def serve_cached_pages(request: Request, call_next):
+        return await page_cache.handle_request(request, call_next)
+
+    def ran(name):
+        renders[name] = renders.get(name, 0) + 1
+
+    @app.get("/media", response_class=HTMLResponse)
+    def media_list(request: Request):
+        ran("media")
+        with sqlite3.connect(database) as conn:
+            titles = [title for title, in conn.execute("SELECT title FROM media ORDER BY id")]
+        partial = request.headers.get("HX-Request") == "true"
+        return ("<tr>" if partial else "<html>") + ", ".join(titles)
+
+    @app.get("/missing", response_class=HTMLResponse)
+    def missing():
+        ran("missing")
+        return HTMLResponse("<p>Not found</p>", status_code=404)
+
+    @app.get("/old")
+    def old():
+        ran("old")
+        return RedirectResponse("/media")
+
+    @app.get("/export.csv")
+    def export():
+        ran("export")
+        return PlainTextResponse("id,title\n1,Alien\n", media_type="text/csv")
+
+    page_cache.start(database)
+    yield TestClient(app)
+    page_cache.stop()
+
+def write(database, title):
+    with sqlite3.connect(database) as conn:
+        conn.execute("INSERT INTO media (title) VALUES (?)", (title,))
+
+def test_second_request_is_served_from_the_cache(client, renders):
+    first = client.get("/media")
+    second = client.get("/media")
+    assert first.status_code == second.status_code == 200
+    assert second.text == first.text == "<html>Alien"
+    assert second.headers["etag"] == first.headers["etag"]
+    assert second.headers["cache-control"] == "no-cache"
+    assert renders["media"] == 1
+
+def test_full_page_and_htmx_partial_are_cached_apart(client, renders):
+    assert client.get("/media").text == "<html>Alien"
+    partial = client.get("/media", headers={"HX-Request": "true"})
+    assert partial.text == "<tr>Alien"
+    assert partial.headers["etag"] != client.get("/media").headers["etag"]
+    assert renders["media"] == 2
+
+def test_a_write_to_the_database_empties_the_cache(client, renders, database):
+    first = client.get("/media")
+    write(database, "Aliens")
+    second = client.get("/media")
+    assert second.text == "<html>Alien, Aliens"
+    assert second.headers["etag"] != first.headers["etag"]
+    assert renders["media"] == 2
+    # The old tag no longer matches
+    assert client.get("/media", headers={"If-None-Match": first.headers["etag"]}).status_code == 200
+
+def test_other_change_sources_empty_the_cache(client, renders, database):
+    page_cache.stop()
+    version = {"images": 0}
+    page_cache.start(database, lambda: version["images"])
+    client.get("/media")
+    version["images"] += 1
+    client.get("/media")
+    assert renders["media"] == 2
+
+def test_matching_validators_get_304(client, renders):
+    etag = client.get("/media").headers["etag"]
+    for headers in ({"If-None-Match": etag}, {"If-None-Match": f'W/"other", {etag}'}, {"If-None-Match": "*"}):
+        response = client.get("/media", headers=headers)
+        assert response.status_code == 304 and response.content == b""
+        assert response.headers["etag"] == etag
+    assert renders["media"] == 1
+    last_modified = client.get("/media").headers["last-modified"]
+    assert client.get("/media", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+def test_a_tag_from_another_page_is_not_a_match(client):
+    etag = client.get("/media").headers["etag"]
+    client.get("/media?page=2")
+    assert client.get("/media?page=2", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/media", headers={"If-None-Match": etag, "HX-Request": "true"}).status_code == 200
+
+@pytest.mark.parametrize("path, status, name", [("/missing", 404, "missing"), ("/old", 307, "old"),
+                                                ("/export.csv", 200, "export")])
+def test_only_cached_pages_are_answered_304(client, renders, path, status, name):
+    for _ in range(2):
+        response = client.get(path, headers={"If-None-Match": "*"}, follow_redirects=False)
+        assert response.status_code == status
+    # Never stored, so the route ran both times
+    assert renders[name] == 2
+
+def test_disabled_cache_runs_every_request(client, renders, database, monkeypatch):
+    page_cache.stop()
+    monkeypatch.setenv("BMM_PAGE_CACHE", "0")
+    page_cache.start(database)
+    client.get("/media")
+    response = client.get("/media", headers={"If-None-Match": "*"})
+    assert response.status_code == 200 and "etag" not in response.headers
+    assert renders["media"] == 2
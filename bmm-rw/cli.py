@@ -0,0 +1,206 @@
+# File: bmm-rw/cli.py
+# Revision: 1.6 - migrate creates missing base tables first
+#
+# Run from the bmm-rw directory (it uses the same .env and media_assets.db as the app):
+#   python cli.py import-tmdb --type movie 603 604 605
+#   python cli.py import-tmdb --type tv --query "star trek" --page 2
+#   python cli.py import-tmdb --type movie --file ids.txt
+#   python cli.py migrate [--status]
+#   python cli.py export media --format csv --output media.csv.gz
+#   python cli.py import-file --media media.csv --assets assets.ndjson.gz --links links.csv
+#   python cli.py dedupe [--rebuild] [--watch 30]
+#   python cli.py jobs [--refresh 100] [--retry-failed] [--run]
+import argparse
+import asyncio
+import re
+import sys
+import time
+
+from fastapi import HTTPException
+from sqlmodel import SQLModel
+
+import dedupe
+import exporter
+import importer
+import jobs
+import main
+import migrations
+import tmdb_client
+
+async def _import_tmdb(args) -> dict:
+    try:
+        ids = [int(tmdb_id) for tmdb_id in args.ids]
+        if args.file:
+            with open(args.file) as f:
+                ids += [int(tmdb_id) for tmdb_id in re.findall(r"\d+", f.read())]
+        if args.query:
+            ids += await main.tmdb_search_page_ids(args.type, args.query, args.page)
+        return await main.import_from_tmdb(ids, args.type)
+    finally:
+        await tmdb_client.stop()
+
+def import_tmdb(args) -> int:
+    if not (args.ids or args.file or args.query):
+        print("import-tmdb: give TMDB ids, --file or --query", file=sys.stderr)
+        return 2
+    main.create_db_and_tables()
+    try:
+        result = asyncio.run(_import_tmdb(args))
+    except HTTPException as e:
+        print(f"import-tmdb: {e.detail}", file=sys.stderr)
+        return 1
+    print(f"Created {len(result['created'])}, skipped {len(result['skipped'])} already in the library, "
+          f"failed {len(result['failed'])} of {result['requested']} requested")
+    if result["failed"]:
+        print("Failed TMDB ids: " + " ".join(str(tmdb_id) for tmdb_id in result["failed"]))
+    return 1 if result["failed"] else 0
+
+def migrate(args) -> int:
+    if args.status:
+        version = migrations.current_version(main.engine)
+        print(f"Schema version {version} (latest {migrations.latest_version()})")
+        for number, description, _ in migrations.pending(main.engine):
+            print(f"  pending {number}: {description}")
+        return 0
+    # Migrations assume the base tables exist; a new database gets them from create_all,
+    # as at app startup (the migrations then only record their versions)
+    SQLModel.metadata.create_all(main.engine)
+    applied = migrations.migrate(main.engine)
+    print(f"Applied migrations {', '.join(str(v) for v in applied)}" if applied else "Schema is up to date")
+    return 0
+
+def export(args) -> int:
+    compress = args.gzip or bool(args.output and args.output.endswith(".gz"))
+    statement = main.export_statement(args.entity, args.search, args.status)
+    chunks = exporter.stream(main.engine, statement, args.format, compress)
+    if args.output:
+        with open(args.output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    return 0
+
+def import_file(args) -> int:
+    files = [(entity, path) for entity, path in (("media", args.media), ("assets", args.assets), ("links", args.links)) if path]
+    if not files:
+        print("import-file: give --media, --assets and/or --links", file=sys.stderr)
+        return 2
+    main.create_db_and_tables()
+    # Shared by the three imports, so ids in the assets and links files follow the new media/asset ids
+    id_maps = {}
+    failed = False
+    for entity, path in files:
+        started = time.monotonic()
+
+        def progress(report):
+            rate = report["rows"] / max(time.monotonic() - started, 0.001)
+            print(f"\r{importer.format_report(report)} ({rate:.0f} rows/s)", end="", file=sys.stderr, flush=True)
+        try:
+            report = main.bulk_import(
+                entity, importer.read_rows(path, args.format), id_maps,
+                batch_size=args.batch_size, link_by_tmdb=args.link_by_tmdb, progress=progress,
+            )
+        except (OSError, ValueError) as e:
+            print(f"\nimport-file: {e}", file=sys.stderr)
+            return 1
+        print(f"\r{importer.format_report(report)} in {time.monotonic() - started:.1f}s", file=sys.stderr)
+        for error in report["errors"]:
+            print(f"  {path} {error}", file=sys.stderr)
+        if report["invalid"] > len(report["errors"]):
+            print(f"  ... and {report['invalid'] - len(report['errors'])} more invalid rows", file=sys.stderr)
+        failed = failed or report["invalid"] > 0
+    return 1 if failed else 0
+
+def run_dedupe(args) -> int:
+    main.create_db_and_tables()
+    if args.rebuild:
+        dedupe.requeue_all(main.engine)
+    while True:
+        before = dict(dedupe.stats)
+        started = time.monotonic()
+        processed = dedupe.process_queue(main.engine)
+        if processed or not args.watch:
+            print(f"Checked {processed} changed assets in {time.monotonic() - started:.1f}s: "
+                  f"{dedupe.stats['marked'] - before['marked']} marked duplicate, "
+                  f"{dedupe.stats['cleared'] - before['cleared']} cleared", file=sys.stderr)
+        if not args.watch:
+            return 0
+        time.sleep(args.watch)
+
+async def _run_jobs() -> int:
+    try:
+        return await jobs.run_due(main.engine, main.JOB_HANDLERS)
+    finally:
+        await tmdb_client.stop()
+
+def run_jobs(args) -> int:
+    main.create_db_and_tables()
+    if args.retry_failed:
+        print(f"Queued {jobs.retry_failed(main.engine)} failed jobs again", file=sys.stderr)
+    if args.refresh:
+        print(f"Queued {main.queue_stale_media(args.refresh)} media for a TMDB refresh", file=sys.stderr)
+    if args.run:
+        started = time.monotonic()
+        ran = asyncio.run(_run_jobs())
+        print(f"Ran {ran} jobs in {time.monotonic() - started:.1f}s: {jobs.stats['done']} done, "
+              f"{jobs.stats['retried']} to retry, {jobs.stats['failed']} failed", file=sys.stderr)
+    for kind, state, count in jobs.summary(main.engine):
+        print(f"{kind:<14} {state:<8} {count}")
+    for kind, target, attempts, error in jobs.failures(main.engine):
+        print(f"  failed {kind}({target}) after {attempts} attempts: {error}")
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Media Assets Manager command line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_import = commands.add_parser("import-tmdb", help="Create \"To Acquire\" media from TMDB ids")
+    parser_import.add_argument("ids", nargs="*", help="TMDB ids to import")
+    parser_import.add_argument("--type", choices=["movie", "tv"], default="movie", help="TMDB media type (default movie)")
+    parser_import.add_argument("--file", help="read TMDB ids from this file (any separators)")
+    parser_import.add_argument("--query", help="import every result on one TMDB search page")
+    parser_import.add_argument("--page", type=int, default=1, help="search result page for --query (default 1)")
+    parser_import.set_defaults(func=import_tmdb)
+
+    parser_migrate = commands.add_parser("migrate", help="Apply pending schema migrations to media_assets.db")
+    parser_migrate.add_argument("--status", action="store_true", help="only show the schema version and pending migrations")
+    parser_migrate.set_defaults(func=migrate)
+
+    parser_export = commands.add_parser("export", help="Write media, assets or links as CSV or JSON Lines")
+    parser_export.add_argument("entity", choices=["media", "assets", "links"], help="what to export")
+    parser_export.add_argument("--format", choices=list(exporter.FORMATS), default="csv", help="output format (default csv)")
+    parser_export.add_argument("--output", help="file to write (default stdout; a .gz name implies --gzip)")
+    parser_export.add_argument("--gzip", action="store_true", help="gzip the output")
+    parser_export.add_argument("--search", help="only rows matching this search, as in the list pages")
+    parser_export.add_argument("--status", help="media only: active, inactive, flagged or acquire")
+    parser_export.set_defaults(func=export)
+
+    parser_import_file = commands.add_parser("import-file", help="Bulk import media, assets and links from CSV or JSON Lines")
+    parser_import_file.add_argument("--media", help="media file (\"-\" for stdin)")
+    parser_import_file.add_argument("--assets", help="assets file; a media_ids column links them to media")
+    parser_import_file.add_argument("--links", help="media_id,asset_id file")
+    parser_import_file.add_argument("--format", choices=importer.FORMATS, help="file format (default from the file name)")
+    parser_import_file.add_argument("--batch-size", type=int, default=main.IMPORT_BATCH_ROWS,
+                                    help=f"rows per transaction (default {main.IMPORT_BATCH_ROWS})")
+    parser_import_file.add_argument("--link-by-tmdb", action="store_true",
+                                    help="link new assets without media_ids to the media with the same TMDB id")
+    parser_import_file.set_defaults(func=import_file)
+
+    parser_dedupe = commands.add_parser("dedupe", help="Mark duplicate assets (the assets changed since the last run)")
+    parser_dedupe.add_argument("--rebuild", action="store_true", help="check every asset again, e.g. after changing BMM_DUPE_THRESHOLD")
+    parser_dedupe.add_argument("--watch", type=float, metavar="SECONDS", help="keep running, checking for changes this often")
+    parser_dedupe.set_defaults(func=run_dedupe)
+
+    parser_jobs = commands.add_parser("jobs", help="Show the background job queue (TMDB enrichment) and run or requeue jobs")
+    parser_jobs.add_argument("--refresh", type=int, metavar="N", help="queue a TMDB refresh for the N media with the oldest details")
+    parser_jobs.add_argument("--retry-failed", action="store_true", help="queue failed jobs again")
+    parser_jobs.add_argument("--run", action="store_true", help="run the due jobs now (e.g. while bmm-rw is stopped)")
+    parser_jobs.set_defaults(func=run_jobs)
+    return parser
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,415 @@
+# File: bmm-rw/dedupe.py
+# Revision: 1.1 - Assets unmarked by hand stay out of duplicate groups
+#
+# Keeps assets.dupe and assets.dupe_group up to date. Triggers on "assets"
+# (migration 5) put the id of every inserted, deleted or re-identified row
+# (title, subtitle, format, ISBN, IMDB/TMDB id or type changed) in the
+# "dupe_queue" table, inside the same transaction as the write. The job takes
+# queued ids a batch at a time and:
+#   1. stores their blocking keys in "dupe_keys": the normalized title
+#      (title_key) and ISBN (isbn_key), each indexed; IMDB and TMDB ids use
+#      the indexes on assets. (A first pass stores the keys of the whole
+#      queue, so a rebuild sees the same keys whatever the batch order.)
+#   2. finds candidates - rows sharing any key - and scores each pair
+#      (score()); pairs at or above the threshold are duplicates
+#   3. follows the duplicate pairs from the changed rows (and the rest of their
+#      old groups) to everything connected, joins them into groups whose rows
+#      agree on format, ISBN and TMDB/IMDB id, and writes dupe = 1 and
+#      dupe_group = the group's lowest asset id. Rows that drop out of a group
+#      get dupe = 0 and no group.
+# The work per batch depends on the number of changed rows and the size of
+# their groups, not on the size of the collection. A row marked dupe by hand
+# without a group is left alone.
+#
+# Unmarking an asset by hand (mark_by_hand(), from the edit form and the bulk
+# actions) records it in "dupe_exempt" (migration 8): it leaves its group and
+# is never put in one again, until it is marked a duplicate by hand.
+#
+# bmm-rw runs the job in a background thread every BMM_DEDUPE_INTERVAL seconds;
+# "python cli.py dedupe" runs it once (--watch to keep going, --rebuild to
+# rescan every asset).
+#
+# Settings (read from the environment / .env):
+#   BMM_DEDUPE_INTERVAL        seconds between runs inside bmm-rw (default 30, 0 disables)
+#   BMM_DUPE_THRESHOLD         pair score counted as a duplicate (default 0.9)
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, text
+
+import metrics
+
+logger = logging.getLogger("bmm.dedupe")
+
+BATCH_ROWS = 500
+# A key shared by more rows than this (a very common title) doesn't produce candidates
+BLOCK_LIMIT = 50
+# Evidence weights for score()
+ID_WEIGHT = 0.7
+TITLE_WEIGHT = 0.7
+FORMAT_WEIGHT = 0.2
+SUBTITLE_PENALTY = 0.3
+
+# Record fields that candidates are found by
+BLOCK_FIELDS = ("title_key", "isbn_key", "imdbid", "tmdbid")
+
+ARTICLES = ("the", "a", "an")
+ASSET_COLUMNS = "id, title, subtitle, format, isbn, imdbid, tmdbid, mtype, dupe, dupe_group"
+
+_settings = {}
+_stop = threading.Event()
+_workers: List[threading.Thread] = []
+
+# Counters, exposed for monitoring
+stats = {"runs": 0, "processed": 0, "marked": 0, "cleared": 0, "errors": 0}
+
+def _collect():
+    for name, value in sorted(stats.items()):
+        yield (name,), value
+metrics.Gauge("bmm_dedupe_events_total", "Duplicate detection job events since start", ("event",), _collect, kind="counter")
+
+def _chunks(values: List, size: int = 500):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def title_key(title: Optional[str]) -> Optional[str]:
+    """Title folded for comparison: no accents, case, punctuation or leading (or ", The") article"""
+    if not title:
+        return None
+    folded = "".join(ch for ch in unicodedata.normalize("NFKD", title) if not unicodedata.combining(ch)).casefold()
+    words = re.findall(r"[^\W_]+", folded)
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    elif len(words) > 1 and words[-1] in ARTICLES and re.search(r",\s*\w+\s*$", folded):
+        # "Matrix, The" - the catalogue form
+        words = words[:-1]
+    return " ".join(words) or None
+
+def isbn_key(isbn: Optional[str]) -> Optional[str]:
+    """ISBN without separators, as ISBN-13 (so the 10- and 13-digit forms match)"""
+    digits = re.sub(r"[^0-9X]", "", (isbn or "").upper())
+    if len(digits) == 10 and digits[:9].isdigit():
+        body = "978" + digits[:9]
+        check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(body)) % 10) % 10
+        return body + str(check)
+    return digits or None
+
+def _keyed(row) -> dict:
+    record = dict(row)
+    record["title_key"] = title_key(record["title"])
+    record["isbn_key"] = isbn_key(record["isbn"])
+    return record
+
+def _same(a, b) -> Optional[bool]:
+    """True/False when both values are set, None when either is missing"""
+    if a in (None, "") or b in (None, ""):
+        return None
+    return a == b
+
+def score(a: dict, b: dict) -> float:
+    """How strongly two asset records look like the same item (keyed rows from _keyed)"""
+    same_format = _same((a["format"] or "").casefold(), (b["format"] or "").casefold())
+    same_isbn = _same(a["isbn_key"], b["isbn_key"])
+    same_tmdb = _same(a["tmdbid"], b["tmdbid"])
+    same_imdb = _same(a["imdbid"], b["imdbid"])
+    # Another format, edition or title id is another item, whatever else matches
+    if same_format is False or same_isbn is False or same_tmdb is False or same_imdb is False:
+        return 0.0
+    if same_tmdb and _same(a["mtype"], b["mtype"]) is False:
+        return 0.0
+    if same_isbn:
+        return 1.0
+    total = 0.0
+    if same_tmdb or same_imdb:
+        total += ID_WEIGHT
+    if _same(a["title_key"], b["title_key"]):
+        total += TITLE_WEIGHT
+    if same_format:
+        total += FORMAT_WEIGHT
+    if a["subtitle"] and b["subtitle"] and title_key(a["subtitle"]) != title_key(b["subtitle"]):
+        total -= SUBTITLE_PENALTY
+    return round(total, 6)  # so 0.7 + 0.2 compares equal to a 0.9 threshold
+
+def threshold() -> float:
+    return float(os.getenv("BMM_DUPE_THRESHOLD", "0.9"))
+
+def _fetch(conn, ids: Iterable[int], stored_keys: bool = False) -> Dict[int, dict]:
+    """Keyed asset records by id (ids of deleted rows are absent).
+
+    stored_keys takes title_key / isbn_key from dupe_keys instead of computing
+    them - for candidates, whose keys were stored when they were processed.
+    """
+    if stored_keys:
+        sql = (f"SELECT {', '.join('a.' + column for column in ASSET_COLUMNS.split(', '))}, k.title_key, k.isbn_key "
+               "FROM assets a LEFT JOIN dupe_keys k ON k.asset_id = a.id WHERE a.id IN :ids")
+    else:
+        sql = f"SELECT {ASSET_COLUMNS} FROM assets WHERE id IN :ids"
+    query = text(sql).bindparams(bindparam("ids", expanding=True))
+    records = {}
+    for chunk in _chunks(sorted(set(ids))):
+        for row in conn.execute(query, {"ids": chunk}).mappings():
+            records[row["id"]] = dict(row) if stored_keys else _keyed(row)
+    return records
+
+def _candidates(conn, records: Dict[int, dict]) -> Set[int]:
+    """Ids of rows sharing a blocking key with any of records (keys shared by over BLOCK_LIMIT rows are skipped)"""
+    found = set()
+    lookups = (
+        ("dupe_keys", "asset_id", "title_key", "title_key"),
+        ("dupe_keys", "asset_id", "isbn_key", "isbn_key"),
+        ("assets", "id", "imdbid", "imdbid"),
+        ("assets", "id", "tmdbid", "tmdbid"),
+    )
+    for table, id_column, column, field in lookups:
+        keys = sorted({record[field] for record in records.values() if record[field] not in (None, "")})
+        # Counting on the index first keeps a very common key from pulling in thousands of rows
+        crowded = text(
+            f"SELECT {column} FROM {table} WHERE {column} IN :keys GROUP BY {column} HAVING count(*) > :limit"
+        ).bindparams(bindparam("keys", expanding=True))
+        members = text(f"SELECT {id_column} FROM {table} WHERE {column} IN :keys").bindparams(bindparam("keys", expanding=True))
+        for chunk in _chunks(keys):
+            skip = set(conn.execute(crowded, {"keys": chunk, "limit": BLOCK_LIMIT}).scalars())
+            usable = [key for key in chunk if key not in skip]
+            if usable:
+                found.update(conn.execute(members, {"keys": usable}).scalars())
+    return found
+
+def _identity(record: dict) -> dict:
+    """The values two copies of one item can't disagree on"""
+    return {
+        "format": (record["format"] or "").casefold() or None,
+        "isbn": record["isbn_key"],
+        "tmdb": (record["mtype"], record["tmdbid"]) if record["tmdbid"] is not None else None,
+        "imdb": record["imdbid"] or None,
+    }
+
+def _merged(a: dict, b: dict) -> Optional[dict]:
+    """Identity of two groups joined, or None if they conflict"""
+    merged = {}
+    for name, value in a.items():
+        if value is not None and b[name] is not None and value != b[name]:
+            return None
+        merged[name] = value if value is not None else b[name]
+    return merged
+
+def _exempt(conn, ids: Iterable[int]) -> Set[int]:
+    """Those of ids unmarked as duplicates by hand"""
+    query = text("SELECT asset_id FROM dupe_exempt WHERE asset_id IN :ids").bindparams(bindparam("ids", expanding=True))
+    found = set()
+    for chunk in _chunks(sorted(set(ids))):
+        found.update(conn.execute(query, {"ids": chunk}).scalars())
+    return found
+
+def _groups(conn, start: Set[int], records: Dict[int, dict], limit: float) -> List[Set[int]]:
+    """Groups of duplicates reachable from start.
+
+    Duplicate pairs are found one breadth-first level at a time, taking in
+    the old group of every row reached. Groups are
+    then joined pair by pair, strongest first, and only while their rows agree
+    on format, ISBN and TMDB/IMDB id - otherwise a copy without ids that
+    matches two different films by title would chain them together. Rows in
+    dupe_exempt join no group.
+    """
+    nodes = {record_id for record_id in start if record_id in records}
+    pairs: Set[Tuple[float, int, int]] = set()
+    frontier = set(nodes)
+    seen_groups = {records[record_id]["dupe_group"] for record_id in nodes}
+    group_query = text("SELECT id FROM assets WHERE dupe_group IN :groups").bindparams(bindparam("groups", expanding=True))
+    while frontier:
+        level = {record_id: records[record_id] for record_id in frontier}
+        candidate_ids = _candidates(conn, level)
+        missing = candidate_ids - set(records)
+        records.update(_fetch(conn, missing, stored_keys=True))
+        # Candidates by blocking key, so each record is only scored against rows sharing a key
+        blocks: Dict[Tuple[str, object], List[int]] = {}
+        for other_id in candidate_ids:
+            other = records.get(other_id)
+            for field in BLOCK_FIELDS:
+                if other is not None and other[field] not in (None, ""):
+                    blocks.setdefault((field, other[field]), []).append(other_id)
+        next_frontier = set()
+        for record_id, record in level.items():
+            others = set()
+            for field in BLOCK_FIELDS:
+                members = blocks.get((field, record[field]), ())
+                if len(members) <= BLOCK_LIMIT:
+                    others.update(members)
+            others.discard(record_id)
+            for other_id in others:
+                pair_score = score(record, records[other_id])
+                if pair_score >= limit:
+                    pairs.add((pair_score, min(record_id, other_id), max(record_id, other_id)))
+                    if other_id not in nodes:
+                        nodes.add(other_id)
+                        next_frontier.add(other_id)
+        # A row reached here takes the rest of its old group along, so no member keeps a stale group id
+        new_groups = {records[record_id]["dupe_group"] for record_id in next_frontier} - seen_groups - {None}
+        seen_groups |= new_groups
+        members = set()
+        for chunk in _chunks(sorted(new_groups)):
+            members.update(conn.execute(group_query, {"groups": chunk}).scalars())
+        members -= nodes
+        records.update(_fetch(conn, members - set(records), stored_keys=True))
+        nodes |= members
+        next_frontier |= members
+        frontier = next_frontier
+
+    parent = {node: node for node in nodes}
+    identity = {node: _identity(records[node]) for node in nodes}
+    exempt = _exempt(conn, nodes)
+
+    def root(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    for _, a, b in sorted(pairs, key=lambda pair: (-pair[0], pair[1], pair[2])):
+        root_a, root_b = root(a), root(b)
+        if root_a == root_b or a in exempt or b in exempt:
+            continue
+        joined = _merged(identity[root_a], identity[root_b])
+        if joined is not None:
+            parent[root_b] = root_a
+            identity[root_a] = joined
+
+    groups: Dict[int, Set[int]] = {}
+    for node in nodes:
+        groups.setdefault(root(node), set()).add(node)
+    return list(groups.values())
+
+def _store_keys(conn, records: Dict[int, dict]) -> None:
+    """Replace the stored blocking keys of records"""
+    for chunk in _chunks(sorted(records)):
+        conn.execute(text("DELETE FROM dupe_keys WHERE asset_id IN :ids").bindparams(bindparam("ids", expanding=True)), {"ids": chunk})
+    keys = [
+        {"asset_id": record_id, "title_key": record["title_key"], "isbn_key": record["isbn_key"]}
+        for record_id, record in records.items() if record["title_key"] or record["isbn_key"]
+    ]
+    if keys:
+        conn.execute(text("INSERT INTO dupe_keys (asset_id, title_key, isbn_key) VALUES (:asset_id, :title_key, :isbn_key)"), keys)
+
+def _process_batch(conn, queued: List[Tuple[int, Optional[int]]], limit: float) -> None:
+    ids = [asset_id for asset_id, _ in queued]
+    records = _fetch(conn, ids)
+    # Again here, in case a row changed since the key pass
+    _store_keys(conn, records)
+
+    # The changed rows plus everyone in the groups they were in, which may split
+    old_groups = {group for _, group in queued if group is not None}
+    old_groups |= {record["dupe_group"] for record in records.values() if record["dupe_group"] is not None}
+    group_query = text(f"SELECT {ASSET_COLUMNS} FROM assets WHERE dupe_group IN :groups").bindparams(bindparam("groups", expanding=True))
+    for chunk in _chunks(sorted(old_groups)):
+        for row in conn.execute(group_query, {"groups": chunk}).mappings():
+            records.setdefault(row["id"], _keyed(row))
+    start = set(records)
+
+    changes = []
+    for group in _groups(conn, start, records, limit):
+        group_id = min(group) if len(group) > 1 else None
+        for record_id in group:
+            record = records[record_id]
+            if group_id is not None and (record["dupe_group"] != group_id or not record["dupe"]):
+                changes.append({"id": record_id, "dupe": True, "dupe_group": group_id})
+                stats["marked"] += 1
+            elif group_id is None and record["dupe_group"] is not None:
+                changes.append({"id": record_id, "dupe": False, "dupe_group": None})
+                stats["cleared"] += 1
+    if changes:
+        conn.execute(text("UPDATE assets SET dupe = :dupe, dupe_group = :dupe_group WHERE id = :id"), changes)
+
+def mark_by_hand(conn, ids: List[int], dupe: bool) -> None:
+    """Record a user's decision that these assets are (or are not) duplicates, in the caller's transaction.
+
+    Unmarked rows leave their groups at once and go into dupe_exempt; marked
+    rows come out of it. Either way they are queued, so the rest of their old
+    groups is checked again on the next run. The caller sets assets.dupe.
+    """
+    by_id = bindparam("ids", expanding=True)
+    for chunk in _chunks(sorted(set(ids))):
+        conn.execute(text(
+            "INSERT INTO dupe_queue (asset_id, old_group) SELECT id, dupe_group FROM assets WHERE id IN :ids "
+            "ON CONFLICT (asset_id) DO UPDATE SET old_group = coalesce(excluded.old_group, dupe_queue.old_group)"
+        ).bindparams(by_id), {"ids": chunk})
+        if dupe:
+            conn.execute(text("DELETE FROM dupe_exempt WHERE asset_id IN :ids").bindparams(by_id), {"ids": chunk})
+        else:
+            conn.execute(text("INSERT OR IGNORE INTO dupe_exempt (asset_id) SELECT id FROM assets WHERE id IN :ids")
+                         .bindparams(by_id), {"ids": chunk})
+            conn.execute(text("UPDATE assets SET dupe_group = NULL WHERE id IN :ids").bindparams(by_id), {"ids": chunk})
+
+def process_queue(engine, batch_rows: int = BATCH_ROWS, limit: Optional[int] = None) -> int:
+    """Work through the queued asset changes (at most limit of them); returns how many were processed"""
+    processed = 0
+    score_limit = threshold()
+    # Keys of every queued row first, so how crowded a key is doesn't depend on the batch order
+    last_id, keyed = 0, 0
+    while limit is None or keyed < limit:
+        size = batch_rows if limit is None else min(batch_rows, limit - keyed)
+        with engine.begin() as conn:
+            ids = conn.execute(
+                text("SELECT asset_id FROM dupe_queue WHERE asset_id > :last ORDER BY asset_id LIMIT :size"),
+                {"last": last_id, "size": size}
+            ).scalars().all()
+            if not ids:
+                break
+            _store_keys(conn, _fetch(conn, ids))
+        last_id = ids[-1]
+        keyed += len(ids)
+    while limit is None or processed < limit:
+        size = batch_rows if limit is None else min(batch_rows, limit - processed)
+        with engine.begin() as conn:
+            # Taking the batch is the first write, so the rest of it runs under the write lock
+            queued = conn.execute(
+                text("DELETE FROM dupe_queue WHERE asset_id IN "
+                     "(SELECT asset_id FROM dupe_queue ORDER BY asset_id LIMIT :size) RETURNING asset_id, old_group"),
+                {"size": size}
+            ).all()
+            if not queued:
+                break
+            _process_batch(conn, [tuple(row) for row in queued], score_limit)
+        processed += len(queued)
+        stats["processed"] += len(queued)
+    stats["runs"] += 1
+    return processed
+
+def pending(engine) -> int:
+    """Number of asset changes waiting to be processed"""
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT count(*) FROM dupe_queue")).scalar()
+
+def requeue_all(engine) -> None:
+    """Queue every asset for a full rescan (after changing the threshold or the scoring)"""
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM dupe_keys"))
+        conn.execute(text("INSERT OR IGNORE INTO dupe_queue (asset_id) SELECT id FROM assets"))
+
+def _worker(engine) -> None:
+    while not _stop.is_set():
+        try:
+            process_queue(engine)
+        except Exception:
+            # Locked database or a bad row: leave the rest queued and try again next time
+            stats["errors"] += 1
+            logger.exception("duplicate detection run failed")
+        _stop.wait(_settings["interval"])
+
+def start(engine) -> None:
+    """Start the background job (called from the app's startup event)"""
+    _settings["interval"] = float(os.getenv("BMM_DEDUPE_INTERVAL", "30"))
+    if _settings["interval"] <= 0 or _workers:
+        return
+    _stop.clear()
+    worker = threading.Thread(target=_worker, args=(engine,), name="dedupe", daemon=True)
+    worker.start()
+    _workers.append(worker)
+
+def stop() -> None:
+    """Stop the background job after its current batch"""
+    _stop.set()
+    for worker in _workers:
+        worker.join(timeout=10)
+    _workers.clear()
@@ -0,0 +1,110 @@
+# File: bmm-rw/exporter.py
+# Revision: 1.0 - Streaming CSV / JSON Lines export
+#
+# Rows are read with a streaming cursor (yield_per) and written out in chunks
+# of about CHUNK_BYTES as they arrive, so an export of any size uses the same
+# small amount of memory and the first bytes go out straight away. Used by
+# the /export/ routes (as a StreamingResponse body) and by bmm-rw's "cli.py export".
+#
+# The export holds one read transaction open until it finishes; in WAL mode
+# that never blocks writers.
+#
+# Formats: .csv (header row, booleans as true/false, empty for NULL) and
+# .ndjson (one JSON object per line). A trailing .gz gzips the stream.
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+GZIP_MEDIA_TYPE = "application/gzip"
+CHUNK_BYTES = 64 * 1024
+YIELD_PER = 1000
+
+def parse_name(name: str) -> Optional[Tuple[str, str, bool]]:
+    """Split "media.csv.gz" into ("media", "csv", True); None if the format is unknown"""
+    compress = name.endswith(".gz")
+    if compress:
+        name = name[:-3]
+    entity, _, fmt = name.rpartition(".")
+    if not entity or fmt not in FORMATS:
+        return None
+    return entity, fmt, compress
+
+def media_type(fmt: str, compress: bool) -> str:
+    return GZIP_MEDIA_TYPE if compress else FORMATS[fmt]
+
+def table_columns(table) -> list:
+    """The table's columns with the primary key first"""
+    keys = list(table.primary_key.columns)
+    return keys + [column for column in table.columns if column not in keys]
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def csv_text(columns: List[str], rows: Iterable) -> Iterator[str]:
+    """CSV text in pieces of about CHUNK_BYTES"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def ndjson_text(columns: List[str], rows: Iterable) -> Iterator[str]:
+    """JSON Lines text in pieces of about CHUNK_BYTES"""
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps({name: _json_value(value) for name, value in zip(columns, row)}, ensure_ascii=False)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield "\n".join(lines) + "\n"
+            lines = []
+            size = 0
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def gzipped(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream(engine, statement, fmt: str, compress: bool = False) -> Iterator[bytes]:
+    """Run statement and yield the encoded export as it is read"""
+    def encoded() -> Iterator[bytes]:
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=YIELD_PER).execute(statement)
+            columns = list(result.keys())
+            text = csv_text(columns, result) if fmt == "csv" else ndjson_text(columns, result)
+            for piece in text:
+                if piece:
+                    yield piece.encode("utf-8")
+    return gzipped(encoded()) if compress else encoded()
+
+def filename(entity: str, fmt: str, compress: bool) -> str:
+    return f"{entity}-{datetime.now():%Y%m%d}.{fmt}{'.gz' if compress else ''}"
@@ -0,0 +1,281 @@
+# File: bmm-rw/images.py
+# Revision: 1.3 - Posters not cached yet are remembered, not looked up on every render
+#
+# Poster URLs stored in "imageurl" point at TMDB's CDN. The first time a page
+# renders one, it is queued for a background worker that downloads it once,
+# stores it on disk under the SHA-256 of its bytes and (when Pillow is
+# installed) writes a few smaller widths for srcset. Pages keep using the
+# remote URL until the local copy exists; afterwards the app serves the files
+# itself under /images/ with strong ETags and immutable cache headers, since a
+# content-addressed file name never changes meaning.
+#
+# Lookups are answered from memory: known copies stay known, and a URL found
+# missing isn't checked on disk again for MISS_RECHECK seconds (sooner when
+# this process stores it), so a page of posters not cached yet costs no file
+# system calls. The recheck picks up copies made by another process.
+#
+# Settings (read from the environment / .env when the cache is started):
+#   BMM_IMAGE_CACHE_DIR        directory for cached images (default ./image_cache, "" disables)
+#   BMM_IMAGE_SOURCE_SIZE      TMDB size fetched as the source image (default w342)
+#   BMM_IMAGE_WIDTHS           smaller widths generated for srcset (default 92,185; needs Pillow)
+#   BMM_IMAGE_HOSTS            hosts posters may be fetched from (default image.tmdb.org)
+#   BMM_IMAGE_WORKERS          background download threads (default 2)
+import hashlib
+import io
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import metrics
+
+try:
+    from PIL import Image  # optional: without it only the source size is served
+except ImportError:
+    Image = None
+
+# Served file names: <digest>.<ext> for the source, <digest>-w<width>.<ext> for smaller copies
+FILE_NAME = re.compile(r"^([0-9a-f]{32})(?:-w(\d+))?\.(jpg|png|webp)$")
+TMDB_SIZE = re.compile(r"^(/t/p/)[a-z0-9]+(/.+)$")
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+RETRY_FAILED_AFTER = 3600.0
+MISS_RECHECK = 60.0
+MISSES_KEPT = 10000
+
+class CachedImage(NamedTuple):
+    digest: str
+    ext: str
+    width: Optional[int]
+    widths: List[int]
+
+_settings = {}
+_lock = threading.Lock()
+_known: Dict[str, CachedImage] = {}
+# URLs with no local copy at the last look, and when that was (oldest first)
+_missing: "OrderedDict[str, float]" = OrderedDict()
+_pending = set()
+_failed: Dict[str, float] = {}
+_queue: "queue.Queue[Optional[str]]" = queue.Queue()
+_workers: List[threading.Thread] = []
+
+# Bumped whenever a poster is stored: pages rendered before then still point at TMDB
+generation = 0
+
+# Counters, exposed for monitoring
+stats = {"local_hits": 0, "remote_fallbacks": 0, "fetched": 0, "fetch_errors": 0}
+metrics.register_cache("image", stats, hit_keys=("local_hits",), miss_keys=("remote_fallbacks",))
+
+def start() -> None:
+    """Read settings and start the download workers (called from the app's startup event)"""
+    directory = os.getenv("BMM_IMAGE_CACHE_DIR", "./image_cache")
+    _settings.update({
+        "dir": directory,
+        "source_size": os.getenv("BMM_IMAGE_SOURCE_SIZE", "w342"),
+        "widths": sorted({int(w) for w in os.getenv("BMM_IMAGE_WIDTHS", "92,185").split(",") if w.strip()}),
+        "hosts": {h.strip() for h in os.getenv("BMM_IMAGE_HOSTS", "image.tmdb.org").split(",") if h.strip()},
+    })
+    if not directory or _workers:
+        return
+    os.makedirs(os.path.join(directory, "urls"), exist_ok=True)
+    for _ in range(max(1, int(os.getenv("BMM_IMAGE_WORKERS", "2")))):
+        worker = threading.Thread(target=_worker, name="image-cache", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+def stop() -> None:
+    """Ask the download workers to finish (queued downloads are dropped)"""
+    with _lock:
+        _pending.clear()
+    while True:
+        try:
+            _queue.get_nowait()
+        except queue.Empty:
+            break
+    for _ in _workers:
+        _queue.put(None)
+    for worker in _workers:
+        worker.join(timeout=5)
+    _workers.clear()
+
+def enabled() -> bool:
+    return bool(_settings.get("dir"))
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+def _path(name: str) -> str:
+    """Files are spread over 256 subdirectories by the first two digest characters"""
+    return os.path.join(_settings["dir"], name[:2], name)
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def fetchable(url: Optional[str]) -> bool:
+    if not url or not enabled():
+        return False
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and parts.hostname in _settings["hosts"]
+
+def lookup(url: str) -> Optional[CachedImage]:
+    """Return the local copy of url, or None. Also sees copies made by another process."""
+    now = time.monotonic()
+    with _lock:
+        image = _known.get(url)
+        checked = _missing.get(url)
+        if image is None and checked is not None and now - checked < MISS_RECHECK:
+            return None
+    if image is not None:
+        return image
+    try:
+        with open(os.path.join(_settings["dir"], "urls", _url_key(url))) as f:
+            digest, ext, width, *widths = f.read().split()
+    except (OSError, ValueError):
+        with _lock:
+            _missing[url] = now
+            _missing.move_to_end(url)
+            while len(_missing) > MISSES_KEPT:
+                _missing.popitem(last=False)
+        return None
+    image = CachedImage(digest, ext, int(width) if width != "-" else None, [int(w) for w in widths])
+    global generation
+    with _lock:
+        _known[url] = image
+        _missing.pop(url, None)
+        generation += 1
+    return image
+
+def prefetch(url: Optional[str]) -> None:
+    """Queue url for download unless it is cached, queued or failed recently"""
+    if not fetchable(url) or lookup(url) is not None:
+        return
+    with _lock:
+        if url in _pending or time.time() - _failed.get(url, 0) < RETRY_FAILED_AFTER:
+            return
+        _pending.add(url)
+    _queue.put(url)
+
+def source_url(url: str) -> str:
+    """The URL actually downloaded.
+
+    With Pillow, TMDB posters are fetched at the configured source size so the
+    smaller widths are scaled down from it; without it the stored URL is used
+    as is, so the page looks exactly as it did with the remote image.
+    """
+    parts = urlsplit(url)
+    match = TMDB_SIZE.match(parts.path) if Image is not None and parts.hostname == "image.tmdb.org" else None
+    if match is None:
+        return url
+    return parts._replace(path=f"{match.group(1)}{_settings['source_size']}{match.group(2)}").geturl()
+
+def _extension(url: str, content_type: str) -> str:
+    if "png" in content_type or url.lower().endswith(".png"):
+        return "png"
+    if "webp" in content_type or url.lower().endswith(".webp"):
+        return "webp"
+    return "jpg"
+
+def store(url: str, data: bytes, content_type: str = "") -> CachedImage:
+    """Write the image (and its smaller widths) and record it as the local copy of url"""
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    ext = _extension(url, content_type)
+    source_path = _path(f"{digest}.{ext}")
+    if not os.path.exists(source_path):
+        _write_atomic(source_path, data)
+
+    width, widths = None, []
+    if Image is not None:
+        with Image.open(io.BytesIO(data)) as original:
+            width = original.width
+            for target in _settings["widths"]:
+                if target >= original.width:
+                    continue
+                variant_path = _path(f"{digest}-w{target}.{ext}")
+                if not os.path.exists(variant_path):
+                    height = max(1, round(original.height * target / original.width))
+                    resized = original.resize((target, height), Image.LANCZOS)
+                    if ext == "jpg" and resized.mode not in ("RGB", "L"):
+                        resized = resized.convert("RGB")
+                    buffer = io.BytesIO()
+                    resized.save(buffer, format="JPEG" if ext == "jpg" else ext.upper(), quality=85)
+                    _write_atomic(variant_path, buffer.getvalue())
+                widths.append(target)
+
+    image = CachedImage(digest, ext, width, widths)
+    record = " ".join([digest, ext, str(width) if width else "-"] + [str(w) for w in widths])
+    _write_atomic(os.path.join(_settings["dir"], "urls", _url_key(url)), record.encode("ascii"))
+    global generation
+    with _lock:
+        _known[url] = image
+        _missing.pop(url, None)
+        generation += 1
+    return image
+
+def _download(url: str) -> None:
+    request = urllib.request.Request(source_url(url), headers={"User-Agent": "bmm-image-cache"})
+    with urllib.request.urlopen(request, timeout=15) as response:
+        data = response.read()
+        content_type = response.headers.get("Content-Type", "")
+    store(url, data, content_type)
+
+def _worker() -> None:
+    while True:
+        url = _queue.get()
+        if url is None:
+            return
+        try:
+            _download(url)
+            stats["fetched"] += 1
+        except Exception:
+            # Keep showing the remote URL; try again after RETRY_FAILED_AFTER
+            stats["fetch_errors"] += 1
+            with _lock:
+                _failed[url] = time.time()
+        finally:
+            with _lock:
+                _pending.discard(url)
+
+def poster_src(url: Optional[str], width: Optional[int] = None) -> str:
+    """Jinja filter: local URL of the cached poster (closest width >= width), else the original URL"""
+    if not url:
+        return ""
+    image = lookup(url) if fetchable(url) else None
+    if image is None:
+        stats["remote_fallbacks"] += 1
+        prefetch(url)
+        return url
+    stats["local_hits"] += 1
+    if width is not None:
+        for candidate in image.widths:
+            if candidate >= width:
+                return f"/images/{image.digest}-w{candidate}.{image.ext}"
+    return f"/images/{image.digest}.{image.ext}"
+
+def poster_srcset(url: Optional[str]) -> str:
+    """Jinja filter: srcset for the cached poster, or "" until it (and its sizes) exist"""
+    image = lookup(url) if fetchable(url) else None
+    if image is None or image.width is None:
+        return ""
+    entries = [f"/images/{image.digest}-w{w}.{image.ext} {w}w" for w in image.widths]
+    entries.append(f"/images/{image.digest}.{image.ext} {image.width}w")
+    return ", ".join(entries)
+
+def file_for(name: str) -> Optional[str]:
+    """Path of a served image file name, or None if the name is invalid or not cached"""
+    if not enabled() or FILE_NAME.match(name) is None:
+        return None
+    path = _path(name)
+    return path if os.path.isfile(path) else None
+
+def etag_for(name: str) -> str:
+    """Strong ETag: the file name already identifies the bytes"""
+    return f'"{os.path.splitext(name)[0]}"'
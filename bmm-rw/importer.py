@@ -0,0 +1,96 @@
+# File: bmm-rw/importer.py
+# Revision: 1.0 - Streaming CSV / JSON Lines reader for bulk import
+#
+# Reads the files written by exporter.py (or any CSV with a header row / JSON
+# Lines file using the same column names) one row at a time and hands them to
+# main.bulk_import() in batches, so memory use doesn't grow with the file.
+# Validation, duplicate checks and the batched inserts live in main.py, next
+# to the models.
+#
+#   python cli.py import-file --media media.csv --assets assets.ndjson.gz --links links.csv
+import csv
+import gzip
+import io
+import json
+import sys
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+FORMATS = ("csv", "ndjson")
+# Invalid rows reported in detail; the rest are only counted
+MAX_ERRORS = 20
+
+def detect_format(path: str) -> Optional[str]:
+    """"csv" or "ndjson" from the file name (ignoring a .gz suffix)"""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return None
+
+def open_text(path: str) -> IO[str]:
+    """Open path for reading as UTF-8 text; "-" is stdin and .gz files are decompressed"""
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    """Yield (line number, row) pairs; a row is a dict with empty values removed, or an error message"""
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"{path}: unknown format (use a .csv or .ndjson name, or give the format)")
+    with open_text(path) as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {name: value for name, value in row.items() if name and value not in ("", None)}
+        else:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield number, f"invalid JSON: {exc}"
+                    continue
+                if not isinstance(row, dict):
+                    yield number, "expected a JSON object"
+                    continue
+                yield number, {name: value for name, value in row.items() if value not in ("", None)}
+
+def batches(rows: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def chunks(values: List, size: int = 500) -> Iterator[List]:
+    """Slices of values small enough for an IN list (SQLite's bound-parameter limit)"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def new_report(entity: str) -> dict:
+    return {
+        "entity": entity, "rows": 0, "created": 0, "duplicates": 0, "invalid": 0,
+        "linked": 0, "missing_links": 0, "errors": []
+    }
+
+def add_error(report: dict, line: int, message: str) -> None:
+    report["invalid"] += 1
+    if len(report["errors"]) < MAX_ERRORS:
+        report["errors"].append(f"line {line}: {message}")
+
+def format_report(report: dict) -> str:
+    text = (f"{report['entity']}: {report['rows']} rows, {report['created']} created, "
+            f"{report['duplicates']} duplicates, {report['invalid']} invalid")
+    if report["linked"]:
+        text += f", {report['linked']} links added"
+    if report["missing_links"]:
+        text += f", {report['missing_links']} links to unknown rows skipped"
+    return text
@@ -0,0 +1,213 @@
+# File: bmm-rw/jobs.py
+# Revision: 1.0 - Persistent background job queue with retries
+#
+# Work that shouldn't hold up a request (fetching TMDB details for a new media
+# row, refreshing old metadata) is written to the "jobs" table (migration 6)
+# in the same transaction as the change that needs it, so a job is never lost
+# to a crash or restart. One asyncio task inside bmm-rw takes due jobs a batch
+# at a time and runs the handler registered for their kind, a few at once.
+#
+# A job is one (kind, target) pair - target is usually a row id - so queueing
+# the same work twice is a no-op. A handler that raises is retried after an
+# exponential backoff (RETRY_DELAY doubled per attempt, at most RETRY_MAX_DELAY);
+# after BMM_JOB_ATTEMPTS failures the job stays in the table as "failed" with
+# its last error, for "python cli.py jobs" to show or --retry-failed to requeue.
+# Jobs left "running" by a process that died are queued again at startup.
+#
+# Periodic tasks (registered with start()) run on the same task, e.g. queueing
+# a bounded batch of stale rows for refresh every hour.
+#
+# Settings (read from the environment / .env):
+#   BMM_JOBS                   "0" disables the background worker (jobs stay queued)
+#   BMM_JOB_CONCURRENCY        jobs run at once (default 4)
+#   BMM_JOB_BATCH              jobs taken from the table per round (default 20)
+#   BMM_JOB_ATTEMPTS           attempts before a job is marked failed (default 5)
+#   BMM_JOB_POLL_INTERVAL      seconds between checks for due jobs when idle (default 5)
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import anyio
+from sqlalchemy import text
+
+import metrics
+
+QUEUED, RUNNING, FAILED = "queued", "running", "failed"
+RETRY_DELAY = 30.0
+RETRY_MAX_DELAY = 3600.0
+
+logger = logging.getLogger("bmm.jobs")
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    target: int
+    attempts: int
+
+Handler = Callable[[int], Awaitable[None]]
+
+_settings = {}
+_state = {"task": None, "wake": None, "loop": None}
+
+# Counters, exposed for monitoring
+stats = {"queued": 0, "done": 0, "retried": 0, "failed": 0, "errors": 0}
+
+def _collect():
+    for name, value in sorted(stats.items()):
+        yield (name,), value
+metrics.Gauge("bmm_job_events_total", "Background job events since start", ("event",), _collect, kind="counter")
+
+def enqueue(conn, kind: str, targets: Iterable[int], priority: int = 0, delay: float = 0) -> None:
+    """Queue kind for each target on conn, inside the caller's transaction.
+
+    A job already queued or running is left as it is; a failed one is queued
+    again with fresh attempts. Lower priority values run first.
+    """
+    rows = [
+        {"kind": kind, "target": target, "priority": priority, "run_after": time.time() + delay,
+         "created": datetime.now().isoformat(timespec="seconds")}
+        for target in dict.fromkeys(targets)
+    ]
+    if not rows:
+        return
+    conn.execute(text(
+        "INSERT INTO jobs (kind, target, priority, state, attempts, run_after, created) "
+        "VALUES (:kind, :target, :priority, 'queued', 0, :run_after, :created) "
+        "ON CONFLICT (kind, target) DO UPDATE SET state = 'queued', attempts = 0, last_error = NULL, "
+        "priority = excluded.priority, run_after = excluded.run_after WHERE jobs.state = 'failed'"
+    ), rows)
+    stats["queued"] += len(rows)
+
+def wake() -> None:
+    """Run due jobs now instead of at the next poll (safe to call from any thread)"""
+    loop, event = _state["loop"], _state["wake"]
+    if loop is not None and event is not None:
+        loop.call_soon_threadsafe(event.set)
+
+def _claim(engine, limit: int) -> List[Job]:
+    with engine.begin() as conn:
+        rows = conn.execute(text(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1 WHERE id IN "
+            "(SELECT id FROM jobs WHERE state = 'queued' AND run_after <= :now "
+            "ORDER BY priority, run_after, id LIMIT :limit) RETURNING id, kind, target, attempts"
+        ), {"now": time.time(), "limit": limit}).all()
+    return [Job(*row) for row in rows]
+
+def _finish(engine, job: Job, error: Optional[str]) -> None:
+    with engine.begin() as conn:
+        if error is None:
+            conn.execute(text("DELETE FROM jobs WHERE id = :id"), {"id": job.id})
+            stats["done"] += 1
+        elif job.attempts >= _settings["attempts"]:
+            conn.execute(text("UPDATE jobs SET state = 'failed', last_error = :error WHERE id = :id"),
+                         {"id": job.id, "error": error})
+            stats["failed"] += 1
+        else:
+            delay = min(RETRY_DELAY * 2 ** (job.attempts - 1), RETRY_MAX_DELAY)
+            conn.execute(text("UPDATE jobs SET state = 'queued', last_error = :error, run_after = :run_after WHERE id = :id"),
+                         {"id": job.id, "error": error, "run_after": time.time() + delay})
+            stats["retried"] += 1
+
+async def _run_job(engine, handlers: Dict[str, Handler], job: Job, limit: asyncio.Semaphore) -> None:
+    async with limit:
+        handler = handlers.get(job.kind)
+        error = None
+        try:
+            if handler is None:
+                raise LookupError(f"no handler for job kind {job.kind!r}")
+            await handler(job.target)
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"[:500]
+            logger.warning("job %s %s(%s) attempt %s failed: %s", job.id, job.kind, job.target, job.attempts, error)
+        await anyio.to_thread.run_sync(_finish, engine, job, error)
+
+async def run_due(engine, handlers: Dict[str, Handler], limit: Optional[int] = None) -> int:
+    """Run the jobs that are due now (at most limit); returns how many ran"""
+    _settings.setdefault("attempts", int(os.getenv("BMM_JOB_ATTEMPTS", "5")))
+    semaphore = asyncio.Semaphore(max(1, int(os.getenv("BMM_JOB_CONCURRENCY", "4"))))
+    batch = int(os.getenv("BMM_JOB_BATCH", "20"))
+    ran = 0
+    while limit is None or ran < limit:
+        jobs = await anyio.to_thread.run_sync(_claim, engine, batch if limit is None else min(batch, limit - ran))
+        if not jobs:
+            break
+        await asyncio.gather(*(_run_job(engine, handlers, job, semaphore) for job in jobs))
+        ran += len(jobs)
+    return ran
+
+async def _worker(engine, handlers: Dict[str, Handler], periodic: List[Tuple[float, Callable]]) -> None:
+    next_run = [time.monotonic() for _ in periodic]
+    while True:
+        try:
+            for number, (interval, task) in enumerate(periodic):
+                if time.monotonic() >= next_run[number]:
+                    next_run[number] = time.monotonic() + interval
+                    await anyio.to_thread.run_sync(task)
+            await run_due(engine, handlers)
+        except Exception:
+            # Locked database and the like: everything stays in the table for the next round
+            stats["errors"] += 1
+            logger.exception("background job round failed")
+        _state["wake"].clear()
+        try:
+            await asyncio.wait_for(_state["wake"].wait(), _settings["poll"])
+        except asyncio.TimeoutError:
+            pass
+
+def requeue_running(engine) -> int:
+    """Queue jobs left running by a process that stopped mid-job; returns how many"""
+    with engine.begin() as conn:
+        return conn.execute(text("UPDATE jobs SET state = 'queued' WHERE state = 'running'")).rowcount
+
+def retry_failed(engine) -> int:
+    """Queue the failed jobs again with fresh attempts; returns how many"""
+    with engine.begin() as conn:
+        return conn.execute(text(
+            "UPDATE jobs SET state = 'queued', attempts = 0, run_after = :now WHERE state = 'failed'"
+        ), {"now": time.time()}).rowcount
+
+def summary(engine) -> List[Tuple[str, str, int]]:
+    """(kind, state, count) for the jobs in the table"""
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(
+            "SELECT kind, state, count(*) FROM jobs GROUP BY kind, state ORDER BY kind, state"
+        ))]
+
+def failures(engine, limit: int = 20) -> List[Tuple[str, int, int, str]]:
+    """(kind, target, attempts, last error) of the most recent failed jobs"""
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(
+            "SELECT kind, target, attempts, last_error FROM jobs WHERE state = 'failed' ORDER BY id DESC LIMIT :limit"
+        ), {"limit": limit})]
+
+def start(engine, handlers: Dict[str, Handler], periodic: Iterable[Tuple[float, Callable]] = ()) -> None:
+    """Start the worker task on the running event loop (called from the app's startup event).
+
+    periodic is a list of (interval seconds, function) run on a worker thread;
+    an interval of 0 or less leaves that task out.
+    """
+    _settings.update({
+        "attempts": int(os.getenv("BMM_JOB_ATTEMPTS", "5")),
+        "poll": float(os.getenv("BMM_JOB_POLL_INTERVAL", "5")),
+    })
+    if os.getenv("BMM_JOBS", "1") == "0" or _state["task"] is not None:
+        return
+    requeue_running(engine)
+    _state["loop"] = asyncio.get_running_loop()
+    _state["wake"] = asyncio.Event()
+    periodic = [(interval, task) for interval, task in periodic if interval > 0]
+    _state["task"] = asyncio.ensure_future(_worker(engine, handlers, periodic))
+
+async def stop() -> None:
+    """Cancel the worker task; a job cut off mid-run is queued again at the next start"""
+    task = _state["task"]
+    _state.update({"task": None, "wake": None, "loop": None})
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,283 @@
+# File: bmm-rw/live_search.py
+# Revision: 1.1 - Results rendered before a change aren't cached; empty prefixes bounded
+#
+# The search boxes on /assets/, /media/ and /tmdb-search/ send a request per
+# debounced keystroke. HTMX aborts the superseded ones (hx-sync), but the
+# server would still run them to the end. Here, for HTMX GETs:
+#
+#   - Supersession: every page load sends an X-Search-Client id (base.html).
+#     A newer live-search request from the same page and path marks the older
+#     one superseded; a superseded request stops where it is - a running
+#     SQLite statement is interrupted through a progress handler - and is
+#     answered 204, which HTMX ignores.
+#   - Single flight: a request identical to one already running (same path
+#     and query string) waits for that one's rendered result instead of
+#     running the queries again.
+#   - Result cache: rendered results are kept in a small LRU for as long as
+#     the database doesn't change (PRAGMA data_version, read on a connection
+#     of our own, so commits from any connection or process count). A result
+#     whose rendering overlapped a change is served but not kept.
+#   - Empty prefixes: a search is every word as a prefix, so once "starx"
+#     matched nothing, "starxy" can't match anything either and skips the
+#     full-text query. The most recent EMPTY_PREFIXES of these are kept.
+#     (Narrowing non-empty results the same way doesn't pay:
+#     bm25 ranking needs the full query anyway, and a MATCH restricted to a
+#     rowid list is far slower than the plain one.)
+#
+# TMDB calls are coalesced separately, in tmdb_client.get_json().
+#
+# Settings (read from the environment / .env when live search is started):
+#   BMM_LIVE_SEARCH            "0" disables all of the above (default on)
+#   BMM_LIVE_SEARCH_ITEMS      rendered results kept in memory (default 256)
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlencode
+
+from fastapi import Response
+
+import metrics
+
+CLIENT_HEADER = "X-Search-Client"
+PROGRESS_STEPS = 1000  # SQLite VM steps between checks for supersession
+POLL_SECONDS = 0.05
+EMPTY_PREFIXES = 1024
+
+class Superseded(Exception):
+    """The same page has sent a newer search; this one's result would be thrown away"""
+
+class Ticket:
+    __slots__ = ("superseded",)
+
+    def __init__(self):
+        self.superseded = False
+
+class _Flight:
+    __slots__ = ("done", "body", "failed")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body: Optional[bytes] = None
+        self.failed = False
+
+_settings = {}
+_lock = threading.Lock()
+_state = {"conn": None, "version": None, "generation": 0}
+_tickets: Dict[Tuple[str, str], Ticket] = {}
+_flights: Dict[Tuple[str, str], _Flight] = {}
+_results: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+_empty: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+# Counters, exposed for monitoring
+stats = {"hits": 0, "misses": 0, "coalesced": 0, "superseded": 0, "empty_prefix": 0}
+metrics.register_cache("live_search", stats, hit_keys=("hits", "coalesced", "empty_prefix"), miss_keys=("misses",))
+
+def start(database_path: str) -> None:
+    """Open the change-detection connection (called from the app's startup event)"""
+    _settings.update({
+        "enabled": os.getenv("BMM_LIVE_SEARCH", "1") != "0",
+        "items": int(os.getenv("BMM_LIVE_SEARCH_ITEMS", "256")),
+    })
+    if not _settings["enabled"] or _state["conn"] is not None:
+        return
+    path = os.path.abspath(database_path)
+    _state["conn"] = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, check_same_thread=False)
+
+def stop() -> None:
+    with _lock:
+        if _state["conn"] is not None:
+            _state["conn"].close()
+            _state["conn"] = None
+        _results.clear()
+        _empty.clear()
+
+def enabled(request) -> bool:
+    return (_state["conn"] is not None and request.method == "GET"
+            and request.headers.get("HX-Request") == "true")
+
+def _check_version() -> int:
+    """Drop cached results if the database changed since the last look and return the
+    current generation (call with _lock held)"""
+    version = _state["conn"].execute("PRAGMA data_version").fetchone()[0]
+    if version != _state["version"]:
+        _state["version"] = version
+        _state["generation"] += 1
+        _results.clear()
+        _empty.clear()
+    return _state["generation"]
+
+def generation() -> Optional[int]:
+    """Current data generation; take it before querying and pass it to remember_empty()"""
+    if _state["conn"] is None:
+        return None
+    with _lock:
+        return _check_version()
+
+def _result_key(request) -> Tuple[str, str]:
+    # Sorted parameters, so the same search reached two ways shares an entry
+    return request.url.path, urlencode(sorted(parse_qsl(request.url.query, keep_blank_values=True)))
+
+# Supersession
+
+def supersede(request) -> Optional[Ticket]:
+    """Register request as its page's latest search on this path, superseding the previous one"""
+    client = request.headers.get(CLIENT_HEADER)
+    if not client:
+        return None
+    key = (client, request.url.path)
+    ticket = Ticket()
+    with _lock:
+        previous = _tickets.get(key)
+        if previous is not None:
+            previous.superseded = True
+        _tickets[key] = ticket
+    return ticket
+
+def release(request, ticket: Optional[Ticket]) -> None:
+    if ticket is None:
+        return
+    key = (request.headers.get(CLIENT_HEADER), request.url.path)
+    with _lock:
+        if _tickets.get(key) is ticket:
+            del _tickets[key]
+
+def _interrupt_when_superseded(session, ticket: Optional[Ticket]):
+    """Make SQLite abort statements on session's connection once ticket is superseded"""
+    if ticket is None:
+        return None
+    dbapi_connection = session.connection().connection.dbapi_connection
+    dbapi_connection.set_progress_handler(lambda: 1 if ticket.superseded else 0, PROGRESS_STEPS)
+    return dbapi_connection
+
+def _render(session, ticket: Optional[Ticket], render: Callable[[], Response]) -> bytes:
+    if ticket is not None and ticket.superseded:
+        raise Superseded()
+    dbapi_connection = _interrupt_when_superseded(session, ticket)
+    try:
+        response = render()
+    except Exception:
+        if ticket is not None and ticket.superseded:
+            raise Superseded()  # sqlite3 "interrupted", however the driver wrapped it
+        raise
+    finally:
+        if dbapi_connection is not None:
+            dbapi_connection.set_progress_handler(None, 0)
+    if ticket is not None and ticket.superseded:
+        raise Superseded()
+    return response.body
+
+def _shared(key: Tuple[str, str], ticket: Optional[Ticket], compute: Callable[[], bytes]) -> bytes:
+    """compute(), unless an identical request is already computing - then its result"""
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        stats["coalesced"] += 1
+        while not flight.done.wait(POLL_SECONDS):
+            if ticket is not None and ticket.superseded:
+                raise Superseded()
+        if not flight.failed:
+            return flight.body
+        # The leader was superseded (or failed): run it ourselves
+        return compute()
+    stats["misses"] += 1
+    try:
+        flight.body = compute()
+        return flight.body
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+def respond(request, session, render: Callable[[], Response]) -> Response:
+    """Serve a live-search partial (from a sync route): cached, shared or rendered by render()"""
+    if not enabled(request):
+        return render()
+    key = _result_key(request)
+    with _lock:
+        render_generation = _check_version()
+        body = _results.get(key)
+        if body is not None:
+            _results.move_to_end(key)
+    if body is not None:
+        stats["hits"] += 1
+        return Response(content=body, media_type="text/html")
+
+    ticket = supersede(request)
+    try:
+        body = _shared(key, ticket, lambda: _render(session, ticket, render))
+    except Superseded:
+        stats["superseded"] += 1
+        return Response(status_code=204)
+    finally:
+        release(request, ticket)
+    with _lock:
+        # Rendered from data older than a change that committed meanwhile: serve it, don't keep it
+        if _check_version() == render_generation:
+            _results[key] = body
+            while len(_results) > _settings["items"]:
+                _results.popitem(last=False)
+    return Response(content=body, media_type="text/html")
+
+async def unless_superseded(request, work: Awaitable):
+    """Await work (from an async route), giving up with Superseded once the page sends a newer search.
+
+    The work itself runs on as a task, so a TMDB call others share still
+    finishes and fills the cache.
+    """
+    ticket = supersede(request) if enabled(request) else None
+    task = asyncio.ensure_future(work)
+    try:
+        while ticket is not None and not task.done():
+            await asyncio.wait({task}, timeout=POLL_SECONDS)
+            if ticket.superseded and not task.done():
+                stats["superseded"] += 1
+                # Nobody else is waiting for its result; don't leave a warning behind
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                raise Superseded()
+        return await task
+    finally:
+        release(request, ticket)
+
+# Searches known to match nothing
+
+def _normalized(search: str) -> str:
+    return " ".join(re.findall(r"\w+", search.lower()))
+
+def known_empty(scope: str, search: Optional[str]) -> bool:
+    """True if a prefix of search (in the same list and filter scope) matched no rows"""
+    if not search or _state["conn"] is None:
+        return False
+    normalized = _normalized(search)
+    with _lock:
+        _check_version()
+        for end in range(1, len(normalized) + 1):
+            key = (scope, normalized[:end])
+            if key in _empty:
+                _empty.move_to_end(key)
+                stats["empty_prefix"] += 1
+                return True
+    return False
+
+def remember_empty(scope: str, search: Optional[str], search_generation: Optional[int]) -> None:
+    """Note that search matched nothing in data of search_generation (from generation())"""
+    if not search or search_generation is None:
+        return
+    normalized = _normalized(search)
+    if normalized:
+        with _lock:
+            if _check_version() != search_generation:
+                return
+            _empty[(scope, normalized)] = None
+            _empty.move_to_end((scope, normalized))
+            while len(_empty) > EMPTY_PREFIXES:
+                _empty.popitem(last=False)
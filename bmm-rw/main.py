@@ -1,17 +1,42 @@
-# main.py  version 1.42
+# main.py  version 1.75
 #
 from fastapi import FastAPI, Request, Form, Depends, Query, HTTPException, Header
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Field, Session, SQLModel, create_engine, select, delete, Relationship, col, func
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from sqlalchemy import Index, and_, false, or_, text, update
+from sqlalchemy.orm import joinedload
+from urllib.parse import urlencode
+from typing import Optional, List, Dict, Any, Callable, Iterable, Tuple
+from datetime import datetime, timedelta
+from functools import partial
 import os
+import asyncio
+import json
+import anyio
 import httpx
 import re
 from typing import TYPE_CHECKING
 from dotenv import load_dotenv
+from pydantic import ValidationError
+import search_index
+import pagination
+import counters
+import migrations
+import db_profile
+import dedupe
+import exporter
+import importer
+import images
+import jobs
+import live_search
+import instrumentation
+import metrics
+import tmdb_client
+from tmdb_membership import membership as tmdb_membership
+from search_index import assets_fts, media_fts
 
 # Load environment variables from .env file
 load_dotenv()
@@ -58,6 +83,8 @@ class Asset(AssetBase, table=True):
     
     id: Optional[int] = Field(default=None, primary_key=True)
     creation: datetime = Field(default_factory=datetime.now)
+    # Lowest asset id of the duplicate group, set by the duplicate detection job (dedupe.py)
+    dupe_group: Optional[int] = Field(default=None, index=True)
     
     # Relationship to Media
     media: List["Media"] = Relationship(back_populates="assets", link_model=MediaAssetLink)
@@ -99,9 +126,14 @@ class MediaBase(SQLModel):
 
 class Media(MediaBase, table=True):
     __tablename__ = "media"
+    # Serves the "already in library" check on TMDB search results
+    __table_args__ = (Index("ix_media_mtype_tmdbid", "mtype", "tmdbid"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     creation: datetime = Field(default_factory=datetime.now)
+    # When the TMDB details were last fetched; None for rows still waiting for them
+    # (indexed by migration 6, not here - create_db_and_tables adds Media indexes before migrating)
+    tmdb_updated: Optional[datetime] = None
     
     # Relationship to Asset
     assets: List["Asset"] = Relationship(back_populates="media", link_model=MediaAssetLink)
@@ -126,24 +158,74 @@ class MediaUpdate(SQLModel):
     acquire: Optional[bool] = None
 
 # Constants
-DATABASE_URL = "sqlite:///./media_assets.db"
-TMDB_API_KEY = os.getenv("TMDB_API_KEY")  # Read from .env file
-TMDB_BASE_URL = "https://api.themoviedb.org/3"
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
+# BMM_DATABASE_PATH points the app at another database file (e.g. a benchmark dataset)
+DATABASE_PATH = os.getenv("BMM_DATABASE_PATH", "./media_assets.db")
+DATABASE_URL = db_profile.database_url(DATABASE_PATH)
+# Keep an in-process set of library TMDB ids for search results (see tmdb_membership.py)
+TMDB_MEMBERSHIP = os.getenv("BMM_TMDB_MEMBERSHIP", "0") == "1"
+
+# Size of the worker pool that runs blocking database work off the event loop
+DB_THREADS = int(os.getenv("BMM_DB_THREADS", "8"))
+# Most TMDB detail requests a bulk import keeps in flight at once
+TMDB_IMPORT_CONCURRENCY = int(os.getenv("TMDB_IMPORT_CONCURRENCY", "8"))
+engine = create_engine(
+    DATABASE_URL,
+    echo=instrumentation.sql_echo(),
+    connect_args={"check_same_thread": False},
+    pool_size=DB_THREADS,
+    max_overflow=DB_THREADS
+)
+db_profile.apply_profile(engine)
+instrumentation.instrument_engine(engine)
+metrics.register_pool(engine)
+metrics.register_thread_pool()
+
+# Set at startup once the FTS5 search index has been verified
+FTS_ENABLED = False
 
 def create_db_and_tables():
+    global FTS_ENABLED
     SQLModel.metadata.create_all(engine)
+    # create_all skips tables that already exist, so add any newer indexes to them
+    for index in Media.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    # Versioned schema changes for databases created by older versions (see migrations.py)
+    migrations.migrate(engine)
+    FTS_ENABLED = search_index.ensure_fts(engine)
+    counters.ensure_counters(engine)
+    if TMDB_MEMBERSHIP:
+        with Session(engine) as session:
+            tmdb_membership.load(session.exec(select(Media.mtype, Media.tmdbid).where(Media.tmdbid.is_not(None))).all())
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+async def run_db(fn, *args):
+    """Run fn(session, *args) on the DB worker pool with a short-lived session of its own.
+
+    For async routes that also await TMDB: the event loop is never blocked by
+    SQLite, and no session is held open across the HTTP call.
+    """
+    def call():
+        with Session(engine) as session:
+            return fn(session, *args)
+    return await run_in_threadpool(call)
+
 # FastAPI app setup
 app = FastAPI(title="Media Assets Manager")
 
 # Templates and static files setup
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
+instrumentation.instrument_templates(templates)
+templates.env.filters["poster_src"] = images.poster_src
+templates.env.filters["poster_srcset"] = images.poster_srcset
+
+# Query count, DB/template/TMDB time per request: Server-Timing header and request log
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    return await instrumentation.handle_request(request, call_next)
 
 # Get version once at startup
 APP_VERSION = get_version()
@@ -154,98 +236,85 @@ def get_base_context(request: Request) -> dict:
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, session: Session = Depends(get_session)):
-    media_count = session.exec(select(Media)).all().__len__()
-    asset_count = session.exec(select(Asset)).all().__len__()
+def home(request: Request, session: Session = Depends(get_session)):
+    # Dashboard counters are kept current by triggers, so no table is scanned here
+    stats = counters.read_counters(session)
     context = get_base_context(request)
-    context.update({"media_count": media_count, "asset_count": asset_count})
+    context.update({
+        "media_count": stats["media"]["total"],
+        "asset_count": stats["assets"]["total"],
+        "stats": stats
+    })
     return templates.TemplateResponse("home.html", context)
 
-# TMDB Search Route - Updated with improved duplicate checking and debugging
+def find_existing_tmdb_ids(session: Session, mtype: int, search_tmdb_ids: list) -> set:
+    """Return the subset of search_tmdb_ids already in the library (runs on the DB pool).
+
+    An index seek per id on ix_media_mtype_tmdbid - cost grows with the
+    number of results, not with the size of the library.
+    """
+    existing_media_query = select(Media.tmdbid).where(
+        Media.mtype == mtype,
+        col(Media.tmdbid).in_(search_tmdb_ids)
+    )
+    return {int(tmdb_id) for tmdb_id in session.exec(existing_media_query).all() if tmdb_id is not None}
+
+# TMDB Search Route - marks results that are already in the library
 @app.get("/tmdb-search/", response_class=HTMLResponse)
 async def tmdb_search(
     request: Request,
     query: str = "",
     search_type: str = Query("movie", regex="^(movie|tv)$"),  # Validate search type
     page: int = Query(1, ge=1),
-    hx_request: Optional[str] = Header(None),
-    session: Session = Depends(get_session)
+    hx_request: Optional[str] = Header(None)
 ):
     results = []
     total_results = 0
     total_pages = 0
     current_page = page
     existing_tmdb_ids = set()
+    tmdb_error = None
+    tmdb_stale = False
     
     if query:
         # Determine the API endpoint based on search type
         endpoint = f"/search/{search_type}"
         
-        # Call TMDB API
-        async with httpx.AsyncClient() as client:
-            headers = {
-                "accept": "application/json",
-                "Authorization": f"Bearer {TMDB_API_KEY}"
-            }
-            response = await client.get(
-                f"{TMDB_BASE_URL}{endpoint}",
-                params={"query": query, "page": page},
-                headers=headers
-            )
+        # Call TMDB API through the shared, pooled client (served from cache when fresh,
+        # or from an expired entry while TMDB is unavailable)
+        async def search():
+            data = await tmdb_client.get_json(endpoint, params={"query": query, "page": page})
+            return data, tmdb_client.served_stale()
+        
+        try:
+            # A keystroke superseded by a newer one from the same page is answered with nothing
+            data, tmdb_stale = await live_search.unless_superseded(request, search())
+        except live_search.Superseded:
+            return Response(status_code=204)
+        except tmdb_client.Unavailable as e:
+            data = None
+            tmdb_error = str(e)
+        
+        if data is not None:
+            results = data.get("results", [])
+            total_results = data.get("total_results", 0)
+            total_pages = data.get("total_pages", 0)
+            current_page = data.get("page", 1)
             
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get("results", [])
-                total_results = data.get("total_results", 0)
-                total_pages = data.get("total_pages", 0)
-                current_page = data.get("page", 1)
+            # Check for existing media in database
+            if results:
+                # Determine media type for database query
+                mtype = 1 if search_type == "movie" else 2
                 
-                # Check for existing media in database
-                if results:
-                    # Determine media type for database query
-                    mtype = 1 if search_type == "movie" else 2
-                    
-                    # Get all TMDB IDs from the current search results
-                    search_tmdb_ids = [item.get("id") for item in results if item.get("id")]
-                    
-                    print(f"DEBUG: Search type: {search_type}, mtype: {mtype}")
-                    print(f"DEBUG: Search TMDB IDs from API: {search_tmdb_ids}")
-                    
-                    if search_tmdb_ids:
-                        # Query database for existing media - get all records to debug
-                        all_media_query = select(Media.id, Media.title, Media.tmdbid, Media.mtype).where(
-                            Media.mtype == mtype
-                        )
-                        all_media = session.exec(all_media_query).all()
-                        
-                        print(f"DEBUG: All media with mtype {mtype}:")
-                        for media in all_media:
-                            print(f"  ID: {media.id}, Title: {media.title}, TMDB ID: {media.tmdbid}, Type: {media.mtype}")
-                        
-                        # Now get just the existing TMDB IDs that match our search
-                        existing_media_query = select(Media.tmdbid).where(
-                            Media.tmdbid.in_(search_tmdb_ids),
-                            Media.mtype == mtype,
-                            Media.tmdbid.is_not(None)
-                        )
-                        existing_media_results = session.exec(existing_media_query).all()
-                        
-                        print(f"DEBUG: Raw existing media results: {existing_media_results}")
-                        
-                        # Create set of existing TMDB IDs for quick lookup
-                        existing_tmdb_ids = set()
-                        for tmdb_id in existing_media_results:
-                            if tmdb_id is not None:
-                                existing_tmdb_ids.add(int(tmdb_id))
-                        
-                        print(f"DEBUG: Final existing TMDB IDs set: {existing_tmdb_ids}")
-                        
-                        # Check each result item
-                        for item in results[:3]:  # Just first 3 for debugging
-                            item_id = int(item.get("id", 0))
-                            title = item.get("title") or item.get("name", "Unknown")
-                            print(f"DEBUG: Checking item '{title}' with TMDB ID {item_id}: {'EXISTS' if item_id in existing_tmdb_ids else 'NEW'}")
-    
+                # Get all TMDB IDs from the current search results
+                search_tmdb_ids = [item.get("id") for item in results if item.get("id")]
+                
+                if search_tmdb_ids:
+                    if tmdb_membership.loaded:
+                        existing_tmdb_ids = tmdb_membership.existing(mtype, search_tmdb_ids)
+                    else:
+                        existing_tmdb_ids = await run_db(find_existing_tmdb_ids, mtype, search_tmdb_ids)
+
     context = get_base_context(request)
     context.update({
         "query": query,
@@ -254,7 +323,9 @@ async def tmdb_search(
         "total_results": total_results,
         "total_pages": total_pages,
         "current_page": current_page,
-        "existing_tmdb_ids": existing_tmdb_ids
+        "existing_tmdb_ids": existing_tmdb_ids,
+        "tmdb_error": tmdb_error,
+        "tmdb_stale": tmdb_stale
     })
     
     # If it's an HTMX request, return just the content partial
@@ -264,169 +335,830 @@ async def tmdb_search(
     # Otherwise return the full page
     return templates.TemplateResponse("tmdb_search.html", context)
 
-# Create Media from TMDB Route
-@app.get("/media/create-from-tmdb/{tmdb_id}", response_class=HTMLResponse)
-async def create_media_from_tmdb(
-    request: Request,
-    tmdb_id: int,
-    session: Session = Depends(get_session)
-):
-    # Fetch movie details from TMDB
-    async with httpx.AsyncClient() as client:
-        headers = {
-            "accept": "application/json",
-            "Authorization": f"Bearer {TMDB_API_KEY}"
-        }
-        response = await client.get(
-            f"{TMDB_BASE_URL}/movie/{tmdb_id}",
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=404, detail="Movie not found on TMDB")
-        
-        movie_data = response.json()
-    
-    # Create a new Media object with TMDB data
-    # Start with "To Acquire" status (no asset associated initially)
-    media = Media(
-        title=movie_data.get("title"),
-        subtitle=movie_data.get("tagline"),
-        imageurl=f"https://image.tmdb.org/t/p/w92{movie_data.get('poster_path')}" if movie_data.get("poster_path") else None,
-        mtype=1,  # Assuming 1 is for movies
-        notes=movie_data.get("overview"),
-        imdbid=movie_data.get("imdb_id"),
+def media_from_tmdb(data: dict, tmdb_id: int, mtype: int) -> Media:
+    """Build a new Media row from a TMDB movie (mtype 1) or TV (mtype 2) detail response.
+
+    New rows start with "To Acquire" status (no asset associated initially).
+    """
+    return Media(
+        title=data.get("title") if mtype == 1 else data.get("name"),  # TV shows use "name" instead of "title"
+        subtitle=data.get("tagline"),
+        imageurl=f"https://image.tmdb.org/t/p/w92{data.get('poster_path')}" if data.get("poster_path") else None,
+        mtype=mtype,
+        notes=data.get("overview"),
+        # TV details only carry the IMDB id in external_ids (see fetch_tmdb_details)
+        imdbid=data.get("imdb_id") or (data.get("external_ids") or {}).get("imdb_id"),
         tmdbid=tmdb_id,
         active=False,  # Not active until an asset is associated
         flag=False,
-        acquire=True   # Set to "To Acquire" by default
+        acquire=True,  # Set to "To Acquire" by default
+        tmdb_updated=datetime.now()
     )
-    
+
+async def fetch_tmdb_details(mtype: int, tmdb_id: int) -> Optional[dict]:
+    """TMDB movie (mtype 1) or TV (mtype 2) details, or None if TMDB didn't answer 200"""
+    if mtype == 1:
+        return await tmdb_client.get_json(f"/movie/{tmdb_id}")
+    return await tmdb_client.get_json(f"/tv/{tmdb_id}", params={"append_to_response": "external_ids"})
+
+def save_media(session: Session, media: Media) -> int:
+    """Insert a new Media row and return its id (runs on the DB pool)"""
     session.add(media)
     session.commit()
     session.refresh(media)
+    tmdb_membership.add(media.mtype, media.tmdbid)
+    images.prefetch(media.imageurl)
+    return media.id
+
+def save_media_batch(session: Session, media_items: List[Media]) -> List[int]:
+    """Insert many Media rows in one transaction and return their ids (runs on the DB pool)"""
+    session.add_all(media_items)
+    session.flush()
+    # Read ids before commit - afterwards each row would be re-fetched on access
+    media_ids = [media.id for media in media_items]
+    tmdb_keys = [(media.mtype, media.tmdbid) for media in media_items]
+    image_urls = [media.imageurl for media in media_items]
+    for media_id, media in zip(media_ids, media_items):
+        write_tmdb_snapshot(session, media_id, media)
+    session.commit()
+    for mtype, tmdb_id in tmdb_keys:
+        tmdb_membership.add(mtype, tmdb_id)
+    for url in image_urls:
+        images.prefetch(url)
+    return media_ids
+
+async def import_from_tmdb(tmdb_ids: List[int], search_type: str) -> Dict[str, Any]:
+    """Create "To Acquire" media for many TMDB ids at once.
+
+    Ids already in the library are skipped, details for the rest are fetched
+    with at most TMDB_IMPORT_CONCURRENCY requests in flight, and all new rows
+    are inserted in a single transaction. Returns the created media ids plus
+    the skipped and failed TMDB ids.
+    """
+    mtype = 1 if search_type == "movie" else 2
+    tmdb_ids = list(dict.fromkeys(int(tmdb_id) for tmdb_id in tmdb_ids))
+    
+    if tmdb_membership.loaded:
+        existing = tmdb_membership.existing(mtype, tmdb_ids)
+    else:
+        existing = set()
+        # Keep the IN list well under SQLite's bound-parameter limit
+        for start in range(0, len(tmdb_ids), 500):
+            existing |= await run_db(find_existing_tmdb_ids, mtype, tmdb_ids[start:start + 500])
+    new_ids = [tmdb_id for tmdb_id in tmdb_ids if tmdb_id not in existing]
+    
+    limit = asyncio.Semaphore(max(1, TMDB_IMPORT_CONCURRENCY))
+    
+    async def fetch_details(tmdb_id: int) -> Optional[dict]:
+        async with limit:
+            try:
+                return await fetch_tmdb_details(mtype, tmdb_id)
+            except httpx.HTTPError:
+                return None
+    
+    details = await asyncio.gather(*(fetch_details(tmdb_id) for tmdb_id in new_ids))
+    
+    media_items = []
+    failed = []
+    for tmdb_id, data in zip(new_ids, details):
+        if data is None:
+            failed.append(tmdb_id)
+        else:
+            media_items.append(media_from_tmdb(data, tmdb_id, mtype))
+    
+    created = await run_db(save_media_batch, media_items) if media_items else []
+    return {
+        "search_type": search_type,
+        "requested": len(tmdb_ids),
+        "created": created,
+        "skipped": [tmdb_id for tmdb_id in tmdb_ids if tmdb_id in existing],
+        "failed": failed
+    }
+
+async def tmdb_search_page_ids(search_type: str, query: str, page: int) -> List[int]:
+    """TMDB ids on one page of search results"""
+    try:
+        data = await tmdb_client.get_json(f"/search/{search_type}", params={"query": query, "page": page})
+    except tmdb_client.Unavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=502, detail="TMDB search failed")
+    return [item["id"] for item in data.get("results", []) if item.get("id")]
+
+def tmdb_image_url(imageurl: Optional[str]) -> Optional[str]:
+    """Add the TMDB base URL to a bare poster path ("/abc.jpg"); full URLs are returned unchanged"""
+    if imageurl and not imageurl.startswith('http'):
+        # Make sure the image path starts with a slash if needed
+        if not imageurl.startswith('/'):
+            imageurl = f"/{imageurl}"
+        imageurl = f"https://image.tmdb.org/t/p/w92{imageurl}"
+    return imageurl
+
+# Background TMDB enrichment (see jobs.py): new media from TMDB are saved at once
+# and their details fetched by the "tmdb_enrich" job; "tmdb_refresh" jobs update
+# the oldest details a batch at a time
+TMDB_REFRESH_INTERVAL = float(os.getenv("BMM_TMDB_REFRESH_INTERVAL", "3600"))
+TMDB_REFRESH_BATCH = int(os.getenv("BMM_TMDB_REFRESH_BATCH", "100"))
+TMDB_REFRESH_DAYS = float(os.getenv("BMM_TMDB_REFRESH_DAYS", "30"))
+TMDB_FIELDS = ("title", "subtitle", "imageurl", "notes", "imdbid")
+
+def read_tmdb_snapshot(session: Session, media_id: int) -> Optional[dict]:
+    """The TMDB_FIELDS values TMDB gave the media row last time, or None (migration 7)"""
+    row = session.execute(
+        text("SELECT fields FROM media_tmdb_snapshot WHERE media_id = :media_id"), {"media_id": media_id}
+    ).first()
+    return json.loads(row[0]) if row else None
+
+def write_tmdb_snapshot(session: Session, media_id: int, details: Media) -> None:
+    """Record the TMDB_FIELDS values just taken from TMDB, inside the caller's transaction"""
+    session.execute(
+        text("INSERT OR REPLACE INTO media_tmdb_snapshot (media_id, fields) VALUES (:media_id, :fields)"),
+        {"media_id": media_id, "fields": json.dumps({field: getattr(details, field) for field in TMDB_FIELDS})}
+    )
+
+def save_media_stub(session: Session, media: Media) -> int:
+    """Insert a media row still waiting for its TMDB details and queue the job that fetches them
+    (runs on the DB pool)"""
+    session.add(media)
+    session.flush()
+    media_id, tmdb_key = media.id, (media.mtype, media.tmdbid)
+    jobs.enqueue(session.connection(), "tmdb_enrich", [media_id])
+    session.commit()
+    tmdb_membership.add(*tmdb_key)
+    return media_id
+
+def media_tmdb_key(session: Session, media_id: int) -> Optional[Tuple[Optional[int], int]]:
+    """(mtype, TMDB id) of a media row, or None if it is gone or has no TMDB id"""
+    row = session.exec(select(Media.mtype, Media.tmdbid).where(Media.id == media_id)).first()
+    return (row[0], row[1]) if row and row[1] is not None else None
+
+def apply_tmdb_details(session: Session, media_id: int, data: dict, overwrite: bool) -> Optional[str]:
+    """Copy TMDB details onto a media row and return its poster URL (runs on the DB pool).
+
+    A new row takes every detail. A refresh updates the fields that still hold
+    what TMDB sent last time (its snapshot) or are empty; a field that differs
+    from the snapshot was edited in the app and is kept. Raises LookupError for
+    details without a title, leaving tmdb_updated as it was.
+    """
+    media = session.get(Media, media_id)
+    if media is None:
+        return None
+    details = media_from_tmdb(data, media.tmdbid, media.mtype)
+    if not details.title:
+        raise LookupError(f"TMDB details for media {media_id} have no title")
+    snapshot = read_tmdb_snapshot(session, media_id)
+    for field in TMDB_FIELDS:
+        value, current = getattr(details, field), getattr(media, field)
+        from_tmdb = not current or (snapshot is not None and current == snapshot.get(field))
+        if value and (overwrite or from_tmdb):
+            setattr(media, field, value)
+    media.tmdb_updated = details.tmdb_updated
+    write_tmdb_snapshot(session, media_id, details)
+    imageurl = media.imageurl
+    session.add(media)
+    session.commit()
+    return imageurl
+
+async def enrich_media(media_id: int, overwrite: bool = True) -> None:
+    """Job handler: fetch a media row's TMDB details and store them; raises to be retried"""
+    key = await run_db(media_tmdb_key, media_id)
+    if key is None:
+        return  # deleted, or no TMDB id any more
+    if key[0] not in (1, 2):
+        # Without a media type the TMDB id can't be looked up; fail, so the job stays
+        # in the table and the row isn't queued again every refresh
+        raise ValueError(f"media {media_id} has TMDB id {key[1]} but no media type")
+    # Own rate budget and breaker, so a refresh backlog doesn't hold up interactive searches
+    with tmdb_client.background():
+        data = await fetch_tmdb_details(*key)
+    if data is None:
+        raise LookupError(f"TMDB returned no details for {'movie' if key[0] == 1 else 'tv'} {key[1]}")
+    images.prefetch(await run_db(apply_tmdb_details, media_id, data, overwrite))
+
+JOB_HANDLERS = {
+    "tmdb_enrich": enrich_media,
+    "tmdb_refresh": partial(enrich_media, overwrite=False),
+}
+
+def queue_stale_media(limit: int = TMDB_REFRESH_BATCH) -> int:
+    """Queue "tmdb_refresh" jobs for the media whose TMDB details are oldest (or missing)
+    and returns how many; runs periodically from the job worker.
+
+    Tops the queue up to limit refreshes waiting to run rather than adding limit
+    more, so a first run over a large library (or a TMDB outage that keeps jobs
+    retrying) never builds a backlog bigger than one batch.
+    """
+    cutoff = datetime.now() - timedelta(days=TMDB_REFRESH_DAYS)
+    with Session(engine) as session:
+        pending = session.execute(
+            text("SELECT count(*) FROM jobs WHERE kind = 'tmdb_refresh' AND state IN ('queued', 'running')")
+        ).scalar()
+        if pending >= limit:
+            return 0
+        media_ids = session.exec(
+            select(Media.id)
+            .where(Media.tmdbid.is_not(None), col(Media.mtype).in_((1, 2)), or_(Media.tmdb_updated.is_(None), Media.tmdb_updated < cutoff))
+            # Failed jobs stay in the table, so a row TMDB doesn't know isn't retried every round
+            .where(text("NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.target = media.id "
+                        "AND jobs.kind IN ('tmdb_enrich', 'tmdb_refresh'))"))
+            .order_by(Media.tmdb_updated, Media.id)
+            .limit(limit - pending)
+        ).all()
+        jobs.enqueue(session.connection(), "tmdb_refresh", media_ids, priority=1)
+        session.commit()
+    return len(media_ids)
+
+# Bulk import from CSV / JSON Lines files (see importer.py and "cli.py import-file")
+IMPORT_BATCH_ROWS = 1000
+
+def media_import_keys(values) -> list:
+    """Keys that identify a media row already in the library: TMDB id (per type) or IMDB id,
+    and for rows with neither, type and title (which may be empty too)"""
+    keys = []
+    if values.get("tmdbid") is not None:
+        keys.append(("tmdb", values.get("mtype"), values["tmdbid"]))
+    if values.get("imdbid"):
+        keys.append(("imdb", values["imdbid"]))
+    if not keys:
+        keys.append(("title", values.get("mtype"), values.get("title"), values.get("subtitle")))
+    return keys
+
+def asset_import_keys(values) -> list:
+    """The key of an asset already catalogued: all of its identifying fields.
+
+    Several copies of one item (same ISBN or TMDB id, even the same shelf) are
+    legitimate, so assets are matched one to one on the whole identity - see
+    import_row_batch - rather than collapsed on an id.
+    """
+    return [("asset", values.get("title"), values.get("subtitle"), values.get("format"), values.get("location"),
+             values.get("isbn"), values.get("mtype"), values.get("tmdbid"), values.get("imdbid"))]
+
+def existing_import_keys(conn, entity: str, rows: List[dict]) -> Dict[tuple, List[int]]:
+    """Dedupe keys of rows already in the database, mapped to their ids in id order (a few IN lookups per batch)"""
+    table = Media.__table__ if entity == "media" else Asset.__table__
+    key_function = media_import_keys if entity == "media" else asset_import_keys
+    columns = [table.c.id, table.c.mtype, table.c.tmdbid, table.c.imdbid, table.c.title, table.c.subtitle]
+    criteria = []
+    if entity == "media":
+        # One lookup per type, so each one seeks ix_media_mtype_tmdbid
+        tmdb_ids_by_type: Dict[Optional[int], set] = {}
+        for values in rows:
+            if values["tmdbid"] is not None:
+                tmdb_ids_by_type.setdefault(values["mtype"], set()).add(values["tmdbid"])
+        for mtype, tmdb_ids in tmdb_ids_by_type.items():
+            criteria += [and_(table.c.mtype == mtype, table.c.tmdbid.in_(chunk)) for chunk in importer.chunks(sorted(tmdb_ids))]
+        imdb_ids = sorted({values["imdbid"] for values in rows if values["imdbid"]})
+        criteria += [table.c.imdbid.in_(chunk) for chunk in importer.chunks(imdb_ids)]
+        # Rows without external ids are matched on their title (ix_media_title_id)
+        rows = [values for values in rows if media_import_keys(values)[0][0] == "title"]
+    else:
+        # Each asset is looked up on the most selective of its fields: ISBN,
+        # TMDB id, IMDB id (all indexed) and only then title
+        columns += [table.c.format, table.c.location, table.c.isbn]
+        by_title = []
+        lookups: Dict[str, set] = {"isbn": set(), "tmdbid": set(), "imdbid": set()}
+        for values in rows:
+            field = next((field for field in lookups if values[field] not in (None, "")), None)
+            if field:
+                lookups[field].add(values[field])
+            else:
+                by_title.append(values)
+        for field, keys in lookups.items():
+            criteria += [table.c[field].in_(chunk) for chunk in importer.chunks(sorted(keys))]
+        rows = by_title
+    titles = sorted({values["title"] for values in rows if values["title"] is not None})
+    criteria += [table.c.title.in_(chunk) for chunk in importer.chunks(titles)]
+    if any(values["title"] is None for values in rows):
+        criteria.append(table.c.title.is_(None))
+    
+    found: Dict[tuple, List[int]] = {}
+    seen = set()
+    for criterion in criteria:
+        for row in conn.execute(select(*columns).where(criterion).order_by(table.c.id)).mappings():
+            if row["id"] in seen:
+                continue
+            seen.add(row["id"])
+            for key in key_function(row):
+                found.setdefault(key, []).append(row["id"])
+    return found
+
+def validate_import_row(entity: str, row: dict) -> Tuple[Optional[int], dict, List[int]]:
+    """Check one media or asset input row against MediaCreate / AssetCreate.
+
+    Returns the row's id in the source file (if it has one), the column values
+    to insert and, for assets, the media ids listed in a "media_ids" column.
+    Raises ValueError with a readable message.
+    """
+    row = dict(row)
+    source_id = None
+    if "id" in row:
+        source_id = row.pop("id")
+        if not re.fullmatch(r"\s*\d+\s*", str(source_id or "")):
+            raise ValueError(f"id: must be a positive integer, not {source_id!r}")
+        source_id = int(source_id)
+    creation = row.pop("creation", None)
+    media_ids = [int(media_id) for media_id in re.findall(r"\d+", str(row.pop("media_ids", "")))]
+    model = MediaCreate if entity == "media" else AssetCreate
+    try:
+        values = model.model_validate(row).model_dump()
+    except ValidationError as exc:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors()
+        ))
+    values["imageurl"] = tmdb_image_url(values["imageurl"])
+    values["creation"] = datetime.fromisoformat(str(creation)) if creation else datetime.now()
+    return source_id, values, media_ids
+
+def resolve_import_id(id_maps: Dict[str, Dict[int, int]], entity: str, source_id: int) -> Optional[int]:
+    """Database id for an id from an import file.
+
+    If this run imported that entity from a file with an "id" column, ids refer
+    to that file's rows; otherwise they are ids already in the database.
+    """
+    if entity in id_maps:
+        return id_maps[entity].get(source_id)
+    return source_id
+
+def insert_import_links(conn, pairs: List[Tuple[Optional[int], Optional[int]]]) -> Tuple[int, int]:
+    """Insert (media_id, asset_id) pairs whose rows exist; returns (links added, pairs with a missing row)"""
+    link_table = MediaAssetLink.__table__
+    known_media, known_assets = set(), set()
+    for known, table, ids in (
+        (known_media, Media.__table__, {media_id for media_id, _ in pairs if media_id is not None}),
+        (known_assets, Asset.__table__, {asset_id for _, asset_id in pairs if asset_id is not None}),
+    ):
+        for chunk in importer.chunks(sorted(ids)):
+            known.update(conn.execute(select(table.c.id).where(table.c.id.in_(chunk))).scalars())
+    
+    valid = [
+        {"media_id": media_id, "asset_id": asset_id} for media_id, asset_id in dict.fromkeys(pairs)
+        if media_id in known_media and asset_id in known_assets
+    ]
+    missing = sum(1 for media_id, asset_id in pairs if media_id not in known_media or asset_id not in known_assets)
+    added = conn.execute(link_table.insert().prefix_with("OR IGNORE"), valid).rowcount if valid else 0
+    return added, missing
+
+def link_assets_by_tmdb(conn, asset_ids: List[int]) -> int:
+    """Link assets to the media with the same type and TMDB id, in one INSERT ... SELECT per chunk"""
+    link_table, media_table, asset_table = MediaAssetLink.__table__, Media.__table__, Asset.__table__
+    added = 0
+    for chunk in importer.chunks(asset_ids):
+        matches = select(media_table.c.id, asset_table.c.id).select_from(
+            asset_table.join(media_table, and_(
+                media_table.c.mtype == asset_table.c.mtype, media_table.c.tmdbid == asset_table.c.tmdbid
+            ))
+        ).where(asset_table.c.id.in_(chunk))
+        added += conn.execute(
+            link_table.insert().prefix_with("OR IGNORE").from_select(["media_id", "asset_id"], matches)
+        ).rowcount
+    return added
+
+def import_row_batch(
+    conn, entity: str, batch: list, id_maps: Dict[str, Dict[int, int]], report: dict, link_by_tmdb: bool, claimed: set
+) -> List[Tuple]:
+    """Validate, dedupe and insert one batch of media or asset rows in the caller's transaction.
+
+    A media row matching one already in the library (or earlier in the file)
+    is that row. An asset row matches an existing asset with the same identity
+    that no earlier row of this import matched, so N copies in the file end up
+    as N copies in the database however often the file is imported; claimed
+    holds the asset ids matched or created so far. Returns the (mtype, tmdbid)
+    of the media created.
+    """
+    table = Media.__table__ if entity == "media" else Asset.__table__
+    key_function = media_import_keys if entity == "media" else asset_import_keys
+    checked = []
+    for line, row in batch:
+        if isinstance(row, str):
+            importer.add_error(report, line, row)
+            continue
+        try:
+            checked.append((line,) + validate_import_row(entity, row))
+        except ValueError as exc:
+            importer.add_error(report, line, str(exc))
+    
+    existing = existing_import_keys(conn, entity, [values for _, _, values, _ in checked])
+    new_rows = []
+    new_keys: Dict[tuple, int] = {}
+    # Per row: (line, source id, media ids, existing id or None, index into new_rows or None)
+    decisions = []
+    for line, source_id, values, media_ids in checked:
+        keys = key_function(values)
+        existing_id = index = None
+        if entity == "media":
+            existing_id = next((existing[key][0] for key in keys if key in existing), None)
+            index = next((new_keys[key] for key in keys if key in new_keys), None)
+        else:
+            existing_id = next((asset_id for asset_id in existing.get(keys[0], ()) if asset_id not in claimed), None)
+            if existing_id is not None:
+                claimed.add(existing_id)
+        if existing_id is not None or index is not None:
+            report["duplicates"] += 1
+        else:
+            index = len(new_rows)
+            new_rows.append(values)
+            for key in keys:
+                new_keys[key] = index
+        decisions.append((line, source_id, media_ids, existing_id, index))
+    
+    new_ids = []
+    if new_rows:
+        # Batched multi-row INSERT ... RETURNING (SQLAlchemy's "insertmanyvalues"),
+        # with the ids handed back in the order of new_rows
+        new_ids = list(conn.execute(
+            table.insert().returning(table.c.id, sort_by_parameter_order=True), new_rows
+        ).scalars())
+        if entity == "assets":
+            claimed.update(new_ids)
+    report["created"] += len(new_ids)
+    
+    pairs = []
+    unlinked = []
+    for line, source_id, media_ids, existing_id, index in decisions:
+        row_id = existing_id if existing_id is not None else new_ids[index]
+        if source_id is not None:
+            id_maps.setdefault(entity, {})[source_id] = row_id
+        if media_ids:
+            pairs += [(resolve_import_id(id_maps, "media", media_id), row_id) for media_id in media_ids]
+        elif existing_id is None:
+            unlinked.append(row_id)
+    if entity == "assets":
+        added, missing = insert_import_links(conn, pairs)
+        report["linked"] += added
+        report["missing_links"] += missing
+        if link_by_tmdb and unlinked:
+            report["linked"] += link_assets_by_tmdb(conn, sorted(set(unlinked)))
+    return [(values["mtype"], values["tmdbid"]) for values in new_rows] if entity == "media" else []
+
+def import_link_batch(conn, batch: list, id_maps: Dict[str, Dict[int, int]], report: dict) -> None:
+    """Insert one batch of media_id/asset_id rows in the caller's transaction"""
+    pairs = []
+    for line, row in batch:
+        if isinstance(row, str):
+            importer.add_error(report, line, row)
+            continue
+        try:
+            media_id, asset_id = int(row["media_id"]), int(row["asset_id"])
+        except (KeyError, TypeError, ValueError):
+            importer.add_error(report, line, "needs integer media_id and asset_id")
+            continue
+        pairs.append((resolve_import_id(id_maps, "media", media_id), resolve_import_id(id_maps, "assets", asset_id)))
+    added, missing = insert_import_links(conn, pairs)
+    report["created"] += added
+    report["linked"] += added
+    report["missing_links"] += missing
+    report["duplicates"] += len(pairs) - added - missing
+
+def bulk_import(
+    entity: str,
+    rows: Iterable[Tuple[int, Any]],
+    id_maps: Optional[Dict[str, Dict[int, int]]] = None,
+    batch_size: int = IMPORT_BATCH_ROWS,
+    link_by_tmdb: bool = False,
+    progress: Optional[Callable[[dict], None]] = None
+) -> dict:
+    """Import "media", "assets" or "links" rows from importer.read_rows(), one transaction per batch.
+
+    Rows are validated against MediaCreate / AssetCreate, and rows already in
+    the library (see media_import_keys / asset_import_keys and
+    import_row_batch) are counted as duplicates instead of inserted. Each batch is one
+    multi-row INSERT plus a few IN lookups. Links come from a links file, an
+    asset "media_ids" column or, with link_by_tmdb, matching TMDB ids.
+
+    Pass the same id_maps to the media, assets and links imports of one run so
+    that ids in the files are translated to the new database ids. Returns the
+    report from importer.new_report(); progress is called after every batch.
+    """
+    id_maps = {} if id_maps is None else id_maps
+    report = importer.new_report(entity)
+    claimed = set()
+    for batch in importer.batches(rows, batch_size):
+        created_media = []
+        with engine.begin() as conn:
+            if entity == "links":
+                import_link_batch(conn, batch, id_maps, report)
+            else:
+                created_media = import_row_batch(conn, entity, batch, id_maps, report, link_by_tmdb, claimed)
+        for mtype, tmdb_id in created_media:
+            tmdb_membership.add(mtype, tmdb_id)
+        report["rows"] += len(batch)
+        if progress:
+            progress(report)
+    return report
+
+# Create Media from TMDB - the row is saved straight away with the title from the
+# search result and its details are filled in by the "tmdb_enrich" job
+async def create_media_stub(request: Request, tmdb_id: int, mtype: int, title: Optional[str]):
+    media = Media(
+        title=title or f"TMDB {tmdb_id}", mtype=mtype, tmdbid=tmdb_id,
+        active=False, flag=False, acquire=True, tmdb_updated=None
+    )
+    media_id = await run_db(save_media_stub, media)
+    jobs.wake()
     
     # Check if this is an HTMX request
     if request.headers.get("HX-Request"):
-        from fastapi.responses import Response
         response = Response(status_code=200)
-        response.headers["HX-Redirect"] = f"/media/{media.id}"
+        response.headers["HX-Redirect"] = f"/media/{media_id}"
         return response
     
-    return RedirectResponse(url=f"/media/{media.id}", status_code=303)
+    return RedirectResponse(url=f"/media/{media_id}", status_code=303)
+
+@app.get("/media/create-from-tmdb/{tmdb_id}", response_class=HTMLResponse)
+async def create_media_from_tmdb(
+    request: Request,
+    tmdb_id: int,
+    title: Optional[str] = None
+):
+    return await create_media_stub(request, tmdb_id, 1, title)
 
 # Create Media from TMDB TV Route - New route for TV shows
 @app.get("/media/create-from-tmdb-tv/{tmdb_id}", response_class=HTMLResponse)
 async def create_media_from_tmdb_tv(
     request: Request,
     tmdb_id: int,
-    session: Session = Depends(get_session)
+    title: Optional[str] = None
 ):
-    # Fetch TV show details from TMDB
-    async with httpx.AsyncClient() as client:
-        headers = {
-            "accept": "application/json",
-            "Authorization": f"Bearer {TMDB_API_KEY}"
-        }
-        response = await client.get(
-            f"{TMDB_BASE_URL}/tv/{tmdb_id}",
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=404, detail="TV show not found on TMDB")
-        
-        tv_data = response.json()
-    
-    # Create a new Media object with TMDB TV data
-    # Start with "To Acquire" status (no asset associated initially)
-    media = Media(
-        title=tv_data.get("name"),  # TV shows use "name" instead of "title"
-        subtitle=tv_data.get("tagline"),
-        imageurl=f"https://image.tmdb.org/t/p/w92{tv_data.get('poster_path')}" if tv_data.get("poster_path") else None,
-        mtype=2,  # 2 is for TV shows
-        notes=tv_data.get("overview"),
-        imdbid=None,  # TV endpoint doesn't return IMDB ID directly
-        tmdbid=tmdb_id,
-        active=False,  # Not active until an asset is associated
-        flag=False,
-        acquire=True   # Set to "To Acquire" by default
-    )
+    return await create_media_stub(request, tmdb_id, 2, title)
+
+# Bulk import from TMDB - a list of ids, or every result on one search page
+@app.post("/media/import-from-tmdb", response_class=HTMLResponse)
+async def import_media_from_tmdb(
+    request: Request,
+    search_type: str = Form("movie", regex="^(movie|tv)$"),
+    tmdb_ids: str = Form(""),
+    query: str = Form(""),
+    page: int = Form(1, ge=1),
+    hx_request: Optional[str] = Header(None)
+):
+    ids = [int(tmdb_id) for tmdb_id in re.findall(r"\d+", tmdb_ids)]
+    if not ids and query:
+        ids = await tmdb_search_page_ids(search_type, query, page)
+    if not ids:
+        raise HTTPException(status_code=400, detail="No TMDB ids to import")
     
-    session.add(media)
-    session.commit()
-    session.refresh(media)
+    result = await import_from_tmdb(ids, search_type)
     
-    # Check if this is an HTMX request
-    if request.headers.get("HX-Request"):
-        from fastapi.responses import Response
-        response = Response(status_code=200)
-        response.headers["HX-Redirect"] = f"/media/{media.id}"
-        return response
+    if hx_request:
+        context = get_base_context(request)
+        context.update({"result": result})
+        return templates.TemplateResponse("partials/tmdb_import_result.html", context)
     
-    return RedirectResponse(url=f"/media/{media.id}", status_code=303)
+    return RedirectResponse(url="/media/?status=acquire", status_code=303)
+
+# Typeahead pickers for the asset/media forms - small pages of matches, never the whole table
+PICKER_PAGE_SIZE = 20
+
+def picker_page(session: Session, model, fts, q: str, after: Optional[str]):
+    """One title-ordered page of rows matching q (FTS5 prefix match when available)"""
+    query = select(model)
+    match = search_index.match_expression(q) if q and FTS_ENABLED else None
+    if match:
+        query = query.join(fts, fts.c.rowid == model.id).where(search_index.matches(fts, match))
+    elif q:
+        query = query.where(col(model.title).contains(q))
+    
+    after_pos = pagination.decode_cursor(after) if after else None
+    if after and after_pos is None:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return pagination.keyset_page(session, query, model.title, model.id, PICKER_PAGE_SIZE, after=after_pos)
+
+@app.get("/pickers/media", response_class=HTMLResponse)
+def media_picker(
+    request: Request,
+    q: str = "",
+    after: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    items, page_info = picker_page(session, Media, media_fts, q.strip(), after)
+    context = get_base_context(request)
+    context.update({"kind": "media", "items": items, "page_info": page_info, "q": q, "after": after})
+    return templates.TemplateResponse("partials/picker_options.html", context)
+
+@app.get("/pickers/assets", response_class=HTMLResponse)
+def asset_picker(
+    request: Request,
+    q: str = "",
+    after: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    items, page_info = picker_page(session, Asset, assets_fts, q.strip(), after)
+    context = get_base_context(request)
+    context.update({"kind": "assets", "items": items, "page_info": page_info, "q": q, "after": after})
+    return templates.TemplateResponse("partials/picker_options.html", context)
+
+def search_filters(model, fts, search: Optional[str]) -> list:
+    """A list page's search as WHERE criteria on model (or an alias of it) - FTS5 when available"""
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        return [model.id.in_(select(fts.c.rowid).where(search_index.matches(fts, match)))]
+    if search:
+        return [col(model.title).contains(search)]
+    return []
+
+def with_neighbors(model, fts, search: Optional[str], criteria_for: Optional[Callable] = None):
+    """SELECT of model plus the prev_id/next_id of its row in the list a detail page was
+    opened from: relevance order for an FTS search, (title, id) order otherwise"""
+    criteria_for = criteria_for or (lambda alias: [])
+    match = search_index.match_expression(search) if search and FTS_ENABLED else None
+    if match:
+        ranked = pagination.ranked_neighbors(model, fts, search_index.matches(fts, match), criteria_for)
+        return select(model, ranked.c.prev_id, ranked.c.next_id).outerjoin(ranked, ranked.c.id == model.id)
+    return select(model, *pagination.neighbor_columns(
+        model, lambda alias: search_filters(alias, fts, search) + criteria_for(alias)
+    ))
+
+def media_status_filters(model, status: Optional[str]) -> list:
+    """The media list's status filter as WHERE criteria on model (or an alias of it)"""
+    if status == "active":
+        return [model.active == True]
+    if status == "inactive":
+        return [model.active == False]
+    if status == "flagged":
+        return [model.flag == True]
+    if status == "acquire":
+        return [model.acquire == True]
+    return []
+
+def list_query_string(search: Optional[str], status: Optional[str] = None) -> str:
+    """Query string carrying a list's search/status to its detail pages, for Previous/Next"""
+    return urlencode({name: value for name, value in (("search", search), ("status", status)) if value})
+
+# Bulk actions from the list pages: the ticked rows, or every row matching the
+# list's search/status. One UPDATE (or DELETE) per 500 ids, all in one commit.
+# An action maps to the column values it sets; None deletes the rows and their links.
+# Setting "dupe" on assets also records the choice for duplicate detection (dedupe.mark_by_hand).
+ASSET_BULK_ACTIONS = {
+    "flag": {"flag": True},
+    "unflag": {"flag": False},
+    "activate": {"active": True},
+    "deactivate": {"active": False},
+    "dupe": {"dupe": True},
+    "undupe": {"dupe": False, "dupe_group": None},
+    "relocate": {"location": None},  # location comes from the form
+    "delete": None,
+}
+MEDIA_BULK_ACTIONS = {
+    "flag": {"flag": True},
+    "unflag": {"flag": False},
+    "activate": {"active": True, "acquire": False},
+    "deactivate": {"active": False},
+    "acquire": {"active": False, "acquire": True},
+    "delete": None,
+}
+
+def bulk_target_ids(
+    session: Session, model, fts, ids: List[int], all_matching: bool,
+    search: Optional[str], status: Optional[str] = None
+) -> List[int]:
+    """Ids a bulk action applies to: the ticked ones, or all rows matching the list's filters"""
+    if not all_matching:
+        return sorted(set(ids))
+    criteria = search_filters(model, fts, search)
+    if model is Media:
+        criteria += media_status_filters(model, status)
+    if not criteria:
+        raise HTTPException(status_code=400, detail="\"All matching\" needs a search or status filter")
+    return list(session.exec(select(model.id).where(*criteria).order_by(model.id)).all())
+
+def apply_bulk_action(session: Session, model, ids: List[int], values: Optional[dict]) -> Tuple[int, list]:
+    """Set values on (or delete) the rows with these ids in one transaction.
+
+    Returns the number of rows changed and, for a delete, the (mtype, tmdbid)
+    of the deleted rows.
+    """
+    link_column = MediaAssetLink.media_id if model is Media else MediaAssetLink.asset_id
+    changed = 0
+    deleted = []
+    for chunk in importer.chunks(ids):
+        if values is None:
+            session.exec(delete(MediaAssetLink).where(link_column.in_(chunk)))
+            deleted += session.execute(
+                delete(model).where(col(model.id).in_(chunk)).returning(model.mtype, model.tmdbid),
+                execution_options={"synchronize_session": False}
+            ).all()
+            changed = len(deleted)
+        else:
+            if model is Asset and "dupe" in values:
+                # Before the UPDATE, while the rows still have their old groups
+                dedupe.mark_by_hand(session.connection(), chunk, values["dupe"])
+            changed += session.execute(
+                update(model).where(col(model.id).in_(chunk)).values(**values),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+    session.commit()
+    return changed, deleted
+
+def bulk_redirect(path: str, search: Optional[str], status: Optional[str], per_page: int) -> RedirectResponse:
+    """Back to the list with its filters (HTMX follows the redirect and swaps in the list partial)"""
+    query = list_query_string(search, status)
+    return RedirectResponse(url=f"{path}?{query + '&' if query else ''}per_page={per_page}", status_code=303)
+
+# Links from the create/edit forms: the pickers post the linked ids comma-separated
+# ("12,40,41"), and only the difference from the current links is written.
+def parse_link_ids(value: Optional[str]) -> List[int]:
+    """Linked ids from a picker field; anything that isn't a number is ignored"""
+    return sorted({int(link_id) for link_id in re.findall(r"\d+", value or "")})
+
+def sync_links(session: Session, owner, owner_id: int, linked_ids: List[int]) -> List[int]:
+    """Make the links of one Media or Asset (owner) exactly linked_ids; the caller commits.
+
+    Reads the current links once, then deletes the links dropped and inserts
+    the links added (one statement each, per 500 ids). Unchanged links aren't
+    touched, so saving a record with many links costs the same as one with a
+    single link. Ids of rows that don't exist are skipped. Returns the ids
+    linked afterwards.
+    """
+    if owner is Media:
+        own_column, other_column, other = MediaAssetLink.media_id, MediaAssetLink.asset_id, Asset
+    else:
+        own_column, other_column, other = MediaAssetLink.asset_id, MediaAssetLink.media_id, Media
+    current = set(session.exec(select(other_column).where(own_column == owner_id)).all())
+    wanted = set(linked_ids)
+    
+    removed = sorted(current - wanted)
+    for chunk in importer.chunks(removed):
+        session.exec(delete(MediaAssetLink).where(own_column == owner_id, col(other_column).in_(chunk)))
+    added = []
+    for chunk in importer.chunks(sorted(wanted - current)):
+        added += session.exec(select(other.id).where(col(other.id).in_(chunk))).all()
+    if added:
+        session.execute(MediaAssetLink.__table__.insert(), [
+            {own_column.key: owner_id, other_column.key: other_id} for other_id in added
+        ])
+    return sorted((current - set(removed)) | set(added))
 
 # Asset Routes
 @app.get("/assets/", response_class=HTMLResponse)
-async def list_assets(
+def list_assets(
     request: Request, 
     session: Session = Depends(get_session),
     page: int = Query(1, ge=1),
     per_page: int = Query(50, ge=1, le=100),
     search: str = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    count: Optional[str] = Query(None, regex="^exact$"),
     hx_request: Optional[str] = Header(None)
 ):
-    # Calculate offset based on page and per_page
-    offset = (page - 1) * per_page
-    
-    # Base query
-    query = select(Asset)
-    count_query = select(func.count()).select_from(Asset)
-    
-    # Apply search filter if provided
-    if search:
-        query = query.where(col(Asset.title).contains(search))
-        count_query = count_query.where(col(Asset.title).contains(search))
-    
-    # Get total count for pagination
-    total_count = session.exec(count_query).one()
-    
-    # Calculate total pages
-    total_pages = (total_count + per_page - 1) // per_page
-    
-    # Get assets with pagination (sorted alphabetically by title)
-    assets = session.exec(query.order_by(Asset.title).offset(offset).limit(per_page)).all()
-    
-    # Context for the template
-    context = get_base_context(request)
-    context.update({
-        "assets": assets,
-        "search": search or "", 
-        "pagination": {
-            "page": page,
-            "per_page": per_page,
-            "total_count": total_count,
-            "total_pages": total_pages
-        }
-    })
-    
-    # If it's an HTMX request, return just the content partial
-    if hx_request:
-        return templates.TemplateResponse("partials/asset_list_content.html", context)
+    def render() -> Response:
+        # Base query
+        query = select(Asset)
+        count_query = select(func.count()).select_from(Asset)
+        
+        order_by = [Asset.title]
+        
+        # Apply search filter if provided - FTS5 index when available, ranked by relevance
+        match = search_index.match_expression(search) if search and FTS_ENABLED else None
+        search_generation = live_search.generation() if match else None
+        if match and live_search.known_empty("assets", search):
+            # A shorter search already matched nothing, so this one can't either
+            query = query.where(false())
+            count_query = count_query.where(false())
+        elif match:
+            query = query.join(assets_fts, assets_fts.c.rowid == Asset.id).where(search_index.matches(assets_fts, match))
+            count_query = select(func.count()).select_from(assets_fts).where(search_index.matches(assets_fts, match))
+            order_by = [assets_fts.c.rank, Asset.title, Asset.id]
+        elif search:
+            query = query.where(col(Asset.title).contains(search))
+            count_query = count_query.where(col(Asset.title).contains(search))
+        
+        # Get assets with pagination (sorted alphabetically by title, or by rank when searching)
+        assets, page_data = pagination.paginate(
+            session, query, count_query, Asset, order_by, page, per_page,
+            after=after, before=before, exact_count=count == "exact", filtered=bool(search),
+            known_total=None if search else counters.get_count(session, "assets")
+        )
+        if match and not assets and page == 1 and not after and not before:
+            live_search.remember_empty("assets", search, search_generation)
+        
+        # Context for the template
+        context = get_base_context(request)
+        context.update({
+            "assets": assets,
+            "search": search or "", 
+            "pagination": page_data,
+            "list_query": list_query_string(search)
+        })
+        
+        # If it's an HTMX request, return just the content partial
+        if hx_request:
+            return templates.TemplateResponse("partials/asset_list_content.html", context)
+        
+        # Otherwise return the full page
+        return templates.TemplateResponse("asset_list.html", context)
     
-    # Otherwise return the full page
-    return templates.TemplateResponse("asset_list.html", context)
+    # Live-search keystrokes: cached, shared with an identical request, or cut short once superseded
+    return live_search.respond(request, session, render)
 
 @app.get("/assets/new", response_class=HTMLResponse)
-async def new_asset_form(request: Request, session: Session = Depends(get_session)):
-    # Get media list sorted alphabetically by title
-    media_list = session.exec(select(Media).order_by(Media.title)).all()
+def new_asset_form(request: Request):
+    # Media is chosen with the typeahead picker (/pickers/media), not a full list
     context = get_base_context(request)
-    context.update({"media_list": media_list})
     return templates.TemplateResponse("asset_form.html", context)
 
 @app.post("/assets/new", response_class=HTMLResponse)
-async def create_asset(
+def create_asset(
     request: Request,
     title: str = Form(None),
     subtitle: str = Form(None),
@@ -446,11 +1178,7 @@ async def create_asset(
     session: Session = Depends(get_session)
 ):
     # Process the imageurl to add TMDB base URL if not already present
-    if imageurl and not imageurl.startswith('http'):
-        # Make sure the image path starts with a slash if needed
-        if not imageurl.startswith('/'):
-            imageurl = f"/{imageurl}"
-        imageurl = f"https://image.tmdb.org/t/p/w92{imageurl}"
+    imageurl = tmdb_image_url(imageurl)
         
     asset = Asset(
         title=title,
@@ -470,57 +1198,50 @@ async def create_asset(
     )
     
     session.add(asset)
-    session.commit()
-    session.refresh(asset)
+    session.flush()
     
-    # Add relationship to the selected media if specified
-    if media_ids and media_ids.strip():
-        try:
-            media_id = int(media_ids)
-            media = session.get(Media, media_id)
-            if media:
-                link = MediaAssetLink(media_id=media.id, asset_id=asset.id)
-                session.add(link)
-                session.commit()
-        except (ValueError, TypeError):
-            # Log or handle error, but continue without adding the relationship
-            pass
+    # Link the selected media in the same transaction
+    sync_links(session, Asset, asset.id, parse_link_ids(media_ids))
+    session.commit()
     
     return RedirectResponse(url="/assets/", status_code=303)
 
 @app.get("/assets/{asset_id}", response_class=HTMLResponse)
-async def get_asset(
+def get_asset(
     request: Request,
     asset_id: int,
+    search: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
-    asset = session.get(Asset, asset_id)
-    if not asset:
+    # One statement: the asset, its linked media, and its neighbors in the
+    # list it was opened from (same order and search)
+    row = session.exec(
+        with_neighbors(Asset, assets_fts, search)
+        .where(Asset.id == asset_id)
+        .options(joinedload(Asset.media))
+    ).unique().first()
+    if not row:
         raise HTTPException(status_code=404, detail="Asset not found")
+    asset, prev_id, next_id = row
     
-    # Get the previous and next asset IDs for navigation
-    prev_asset = session.exec(
-        select(Asset).where(Asset.id < asset_id).order_by(Asset.id.desc()).limit(1)
-    ).first()
-    
-    next_asset = session.exec(
-        select(Asset).where(Asset.id > asset_id).order_by(Asset.id).limit(1)
-    ).first()
-    
-    prev_id = prev_asset.id if prev_asset else None
-    next_id = next_asset.id if next_asset else None
+    # The other assets in its duplicate group (see dedupe.py)
+    duplicates = session.exec(
+        select(Asset).where(Asset.dupe_group == asset.dupe_group, Asset.id != asset.id).order_by(Asset.id).limit(20)
+    ).all() if asset.dupe_group is not None else []
     
     context = get_base_context(request)
     context.update({
         "asset": asset,
         "prev_id": prev_id,
-        "next_id": next_id
+        "next_id": next_id,
+        "duplicates": duplicates,
+        "list_query": list_query_string(search)
     })
     
     return templates.TemplateResponse("asset_detail.html", context)
 
 @app.get("/assets/{asset_id}/edit", response_class=HTMLResponse)
-async def edit_asset_form(
+def edit_asset_form(
     request: Request,
     asset_id: int,
     session: Session = Depends(get_session)
@@ -529,21 +1250,17 @@ async def edit_asset_form(
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     
-    # Get media list sorted alphabetically by title
-    media_list = session.exec(select(Media).order_by(Media.title)).all()
-    asset_media_ids = [media.id for media in asset.media]
-    
+    # Only the linked media are loaded - others are found with the typeahead picker
     context = get_base_context(request)
     context.update({
         "asset": asset, 
-        "media_list": media_list, 
-        "asset_media_ids": asset_media_ids
+        "selected_media": asset.media
     })
     
     return templates.TemplateResponse("asset_edit.html", context)
 
 @app.post("/assets/{asset_id}/edit", response_class=HTMLResponse)
-async def update_asset(
+def update_asset(
     request: Request,
     asset_id: int,
     title: str = Form(None),
@@ -568,11 +1285,7 @@ async def update_asset(
         raise HTTPException(status_code=404, detail="Asset not found")
     
     # Process the imageurl to add TMDB base URL if not already present
-    if imageurl and not imageurl.startswith('http'):
-        # Make sure the image path starts with a slash if needed
-        if not imageurl.startswith('/'):
-            imageurl = f"/{imageurl}"
-        imageurl = f"https://image.tmdb.org/t/p/w92{imageurl}"
+    imageurl = tmdb_image_url(imageurl)
     
     # Update asset fields
     asset_data = {
@@ -592,31 +1305,23 @@ async def update_asset(
         "isbn": isbn
     }
     
+    dupe_changed = bool(asset.dupe) != dupe
     for key, value in asset_data.items():
         setattr(asset, key, value)
+    if dupe_changed:
+        # A user's call on duplicates overrides the detection job (see dedupe.py)
+        session.flush()
+        dedupe.mark_by_hand(session.connection(), [asset_id], dupe)
     
-    # Update media relationships
-    # First, remove all existing links
-    session.exec(
-        delete(MediaAssetLink).where(MediaAssetLink.asset_id == asset_id)
-    )
-    
-    # Add the new link if a media is selected
-    if media_ids and media_ids.strip():
-        try:
-            media_id = int(media_ids)
-            link = MediaAssetLink(media_id=media_id, asset_id=asset_id)
-            session.add(link)
-        except (ValueError, TypeError):
-            # Log or handle error, but continue without adding the relationship
-            pass
+    # Update media relationships - only the links added or removed are written
+    sync_links(session, Asset, asset_id, parse_link_ids(media_ids))
     
     session.commit()
     
     return RedirectResponse(url=f"/assets/{asset_id}", status_code=303)
 
 @app.post("/assets/{asset_id}/delete", response_class=HTMLResponse)
-async def delete_asset(
+def delete_asset(
     request: Request,
     asset_id: int,
     session: Session = Depends(get_session)
@@ -636,84 +1341,108 @@ async def delete_asset(
     
     return RedirectResponse(url="/assets/", status_code=303)
 
+@app.post("/assets/bulk", response_class=HTMLResponse)
+def bulk_update_assets(
+    request: Request,
+    action: str = Form(...),
+    ids: List[int] = Form([]),
+    all_matching: bool = Form(False),
+    location: str = Form(None),
+    per_page: int = Form(50),
+    search: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    if action not in ASSET_BULK_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown bulk action: {action}")
+    values = ASSET_BULK_ACTIONS[action]
+    if action == "relocate":
+        values = {"location": location.strip() if location and location.strip() else None}
+    
+    asset_ids = bulk_target_ids(session, Asset, assets_fts, ids, all_matching, search)
+    apply_bulk_action(session, Asset, asset_ids, values)
+    
+    return bulk_redirect("/assets/", search, None, per_page)
+
 # Media Routes
 @app.get("/media/", response_class=HTMLResponse)
-async def list_media(
+def list_media(
     request: Request, 
     session: Session = Depends(get_session),
     page: int = Query(1, ge=1),
     per_page: int = Query(50, ge=1, le=100),
     search: str = None,
     status: str = None,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    count: Optional[str] = Query(None, regex="^exact$"),
     hx_request: Optional[str] = Header(None)
 ):
-    # Calculate offset based on page and per_page
-    offset = (page - 1) * per_page
-    
-    # Base query
-    query = select(Media)
-    count_query = select(func.count()).select_from(Media)
-    
-    # Apply search filter if provided
-    if search:
-        query = query.where(col(Media.title).contains(search))
-        count_query = count_query.where(col(Media.title).contains(search))
-    
-    # Apply status filter if provided
-    if status:
-        if status == "active":
-            query = query.where(Media.active == True)
-            count_query = count_query.where(Media.active == True)
-        elif status == "inactive":
-            query = query.where(Media.active == False)
-            count_query = count_query.where(Media.active == False)
-        elif status == "flagged":
-            query = query.where(Media.flag == True)
-            count_query = count_query.where(Media.flag == True)
-        elif status == "acquire":
-            query = query.where(Media.acquire == True)
-            count_query = count_query.where(Media.acquire == True)
-    
-    # Get total count for pagination (with filters applied if necessary)
-    total_count = session.exec(count_query).one()
-    
-    # Calculate total pages
-    total_pages = (total_count + per_page - 1) // per_page
-    
-    # Get media items with pagination (sorted alphabetically by title)
-    media_items = session.exec(query.order_by(Media.title).offset(offset).limit(per_page)).all()
-    
-    # Context for the template
-    context = get_base_context(request)
-    context.update({
-        "media_items": media_items, 
-        "search": search or "",
-        "status": status or "",
-        "pagination": {
-            "page": page,
-            "per_page": per_page,
-            "total_count": total_count,
-            "total_pages": total_pages
-        }
-    })
-    
-    # If it's an HTMX request, return just the content partial
-    if hx_request:
-        return templates.TemplateResponse("partials/media_list_content.html", context)
+    def render() -> Response:
+        # Base query
+        query = select(Media)
+        count_query = select(func.count()).select_from(Media)
+        
+        order_by = [Media.title]
+        
+        # Apply search filter if provided - FTS5 index when available, ranked by relevance
+        match = search_index.match_expression(search) if search and FTS_ENABLED else None
+        search_generation = live_search.generation() if match else None
+        if match and live_search.known_empty(f"media:{status or ''}", search):
+            # A shorter search already matched nothing, so this one can't either
+            query = query.where(false())
+            count_query = count_query.where(false())
+        elif match:
+            query = query.join(media_fts, media_fts.c.rowid == Media.id).where(search_index.matches(media_fts, match))
+            count_query = count_query.join(media_fts, media_fts.c.rowid == Media.id).where(search_index.matches(media_fts, match))
+            order_by = [media_fts.c.rank, Media.title, Media.id]
+        elif search:
+            query = query.where(col(Media.title).contains(search))
+            count_query = count_query.where(col(Media.title).contains(search))
+        
+        # Apply status filter if provided
+        for criterion in media_status_filters(Media, status):
+            query = query.where(criterion)
+            count_query = count_query.where(criterion)
+        
+        # Get media items with pagination (sorted alphabetically by title, or by rank when searching)
+        media_items, page_data = pagination.paginate(
+            session, query, count_query, Media, order_by, page, per_page,
+            after=after, before=before, exact_count=count == "exact", filtered=bool(search or status),
+            known_total=None if search else (
+                counters.get_count(session, "media", "status", status) if status else counters.get_count(session, "media")
+            )
+        )
+        if match and not media_items and page == 1 and not after and not before:
+            live_search.remember_empty(f"media:{status or ''}", search, search_generation)
+        
+        # Context for the template
+        context = get_base_context(request)
+        context.update({
+            "media_items": media_items, 
+            "search": search or "",
+            "status": status or "",
+            "pagination": page_data,
+            "list_query": list_query_string(search, status)
+        })
+        
+        # If it's an HTMX request, return just the content partial
+        if hx_request:
+            return templates.TemplateResponse("partials/media_list_content.html", context)
+        
+        # Otherwise return the full page
+        return templates.TemplateResponse("media_list.html", context)
     
-    # Otherwise return the full page
-    return templates.TemplateResponse("media_list.html", context)
+    # Live-search keystrokes: cached, shared with an identical request, or cut short once superseded
+    return live_search.respond(request, session, render)
 
 @app.get("/media/new", response_class=HTMLResponse)
-async def new_media_form(request: Request, session: Session = Depends(get_session)):
-    # Get assets sorted alphabetically by title
-    assets = session.exec(select(Asset).order_by(Asset.title)).all()
+def new_media_form(request: Request):
+    # Assets are chosen with the typeahead picker (/pickers/assets), not a full list
     context = get_base_context(request)
-    context.update({"assets": assets})
     return templates.TemplateResponse("media_form.html", context)
 
 @app.post("/media/new", response_class=HTMLResponse)
-async def create_media(
+def create_media(
     request: Request,
     title: str = Form(None),
     subtitle: str = Form(None),
@@ -729,20 +1458,8 @@ async def create_media(
     session: Session = Depends(get_session)
 ):
     # Process the imageurl to add TMDB base URL if not already present
-    if imageurl and not imageurl.startswith('http'):
-        # Make sure the image path starts with a slash if needed
-        if not imageurl.startswith('/'):
-            imageurl = f"/{imageurl}"
-        imageurl = f"https://image.tmdb.org/t/p/w92{imageurl}"
-    
-    # Check if an asset is being associated
-    has_asset = asset_ids and asset_ids.strip()
+    imageurl = tmdb_image_url(imageurl)
     
-    # If an asset is associated, set active to True and acquire to False
-    if has_asset:
-        active = True
-        acquire = False
-        
     media = Media(
         title=title,
         subtitle=subtitle,
@@ -757,57 +1474,73 @@ async def create_media(
     )
     
     session.add(media)
-    session.commit()
-    session.refresh(media)
+    session.flush()
     
-    # Add relationship to the selected asset if specified
-    if has_asset:
-        try:
-            asset_id = int(asset_ids)
-            asset = session.get(Asset, asset_id)
-            if asset:
-                link = MediaAssetLink(media_id=media.id, asset_id=asset.id)
-                session.add(link)
-                session.commit()
-        except (ValueError, TypeError):
-            # Log or handle error, but continue without adding the relationship
-            pass
+    # Link the selected assets in the same transaction
+    # If an asset is associated, set active to True and acquire to False
+    if sync_links(session, Media, media.id, parse_link_ids(asset_ids)):
+        media.active = True
+        media.acquire = False
+    
+    session.commit()
+    tmdb_membership.add(mtype, tmdbid)
     
     return RedirectResponse(url="/media/", status_code=303)
 
 @app.get("/media/{media_id}", response_class=HTMLResponse)
-async def get_media(
+def get_media(
     request: Request,
     media_id: int,
+    search: Optional[str] = None,
+    status: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
-    media = session.get(Media, media_id)
-    if not media:
+    # One statement: the media, its linked assets, and its neighbors in the
+    # list it was opened from (same order, search and status filter)
+    row = session.exec(
+        with_neighbors(Media, media_fts, search, lambda alias: media_status_filters(alias, status))
+        .where(Media.id == media_id)
+        .options(joinedload(Media.assets))
+    ).unique().first()
+    if not row:
         raise HTTPException(status_code=404, detail="Media not found")
-    
-    # Get the previous and next media IDs for navigation
-    prev_media = session.exec(
-        select(Media).where(Media.id < media_id).order_by(Media.id.desc()).limit(1)
-    ).first()
-    
-    next_media = session.exec(
-        select(Media).where(Media.id > media_id).order_by(Media.id).limit(1)
-    ).first()
-    
-    prev_id = prev_media.id if prev_media else None
-    next_id = next_media.id if next_media else None
+    media, prev_id, next_id = row
     
     context = get_base_context(request)
     context.update({
         "media": media,
         "prev_id": prev_id,
-        "next_id": next_id
+        "next_id": next_id,
+        "tmdb_job": tmdb_enrich_job(session, media_id),
+        "list_query": list_query_string(search, status)
     })
     
     return templates.TemplateResponse("media_detail.html", context)
 
+def tmdb_enrich_job(session: Session, media_id: int) -> Optional[dict]:
+    """State and last error of the media row's pending "tmdb_enrich" job, if any"""
+    row = session.execute(
+        text("SELECT state, last_error FROM jobs WHERE kind = 'tmdb_enrich' AND target = :media_id"),
+        {"media_id": media_id}
+    ).first()
+    return {"state": row[0], "last_error": row[1]} if row else None
+
+# Polled by the media page while its TMDB details are being fetched; reloads the page when done
+@app.get("/media/{media_id}/tmdb-status", response_class=HTMLResponse)
+def media_tmdb_status(
+    request: Request,
+    media_id: int,
+    session: Session = Depends(get_session)
+):
+    tmdb_job = tmdb_enrich_job(session, media_id)
+    if tmdb_job is None:
+        return Response(status_code=200, headers={"HX-Refresh": "true"})
+    context = get_base_context(request)
+    context.update({"media_id": media_id, "tmdb_job": tmdb_job})
+    return templates.TemplateResponse("partials/tmdb_job_status.html", context)
+
 @app.get("/media/{media_id}/edit", response_class=HTMLResponse)
-async def edit_media_form(
+def edit_media_form(
     request: Request,
     media_id: int,
     session: Session = Depends(get_session)
@@ -816,21 +1549,17 @@ async def edit_media_form(
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
     
-    # Get assets sorted alphabetically by title
-    assets = session.exec(select(Asset).order_by(Asset.title)).all()
-    media_asset_ids = [asset.id for asset in media.assets]
-    
+    # Only the linked assets are loaded - others are found with the typeahead picker
     context = get_base_context(request)
     context.update({
         "media": media, 
-        "assets": assets, 
-        "media_asset_ids": media_asset_ids
+        "selected_assets": media.assets
     })
     
     return templates.TemplateResponse("media_edit.html", context)
 
 @app.post("/media/{media_id}/edit", response_class=HTMLResponse)
-async def update_media(
+def update_media(
     request: Request,
     media_id: int,
     title: str = Form(None),
@@ -849,16 +1578,13 @@ async def update_media(
     media = session.get(Media, media_id)
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
+    old_tmdb_key = (media.mtype, media.tmdbid)
     
     # Process the imageurl to add TMDB base URL if not already present
-    if imageurl and not imageurl.startswith('http'):
-        # Make sure the image path starts with a slash if needed
-        if not imageurl.startswith('/'):
-            imageurl = f"/{imageurl}"
-        imageurl = f"https://image.tmdb.org/t/p/w92{imageurl}"
+    imageurl = tmdb_image_url(imageurl)
     
-    # Check if an asset is being associated
-    has_asset = asset_ids and asset_ids.strip()
+    # Update asset relationships first - only the links added or removed are written
+    has_asset = bool(sync_links(session, Media, media_id, parse_link_ids(asset_ids)))
     
     # Checkboxes need special handling - they're only included in the form if checked
     # Form.active etc will be None if the checkbox isn't checked
@@ -888,32 +1614,19 @@ async def update_media(
     for key, value in media_data.items():
         setattr(media, key, value)
     
-    # Update asset relationship
-    # First, remove all existing links
-    session.exec(
-        delete(MediaAssetLink).where(MediaAssetLink.media_id == media_id)
-    )
-    
-    # Add the new link if an asset is selected
-    if has_asset:
-        try:
-            asset_id = int(asset_ids)
-            link = MediaAssetLink(media_id=media_id, asset_id=asset_id)
-            session.add(link)
-        except (ValueError, TypeError):
-            # Log or handle error, but continue without adding the relationship
-            pass
-    else:
+    if not has_asset:
         # If no asset is associated, revert to "To Acquire" status
         media.active = False
         media.acquire = True
     
     session.commit()
+    tmdb_membership.remove(*old_tmdb_key)
+    tmdb_membership.add(mtype, tmdbid)
     
     return RedirectResponse(url=f"/media/{media_id}", status_code=303)
 
 @app.post("/media/{media_id}/delete", response_class=HTMLResponse)
-async def delete_media(
+def delete_media(
     request: Request,
     media_id: int,
     session: Session = Depends(get_session)
@@ -930,12 +1643,108 @@ async def delete_media(
     # Then delete the media
     session.delete(media)
     session.commit()
+    tmdb_membership.remove(media.mtype, media.tmdbid)
     
     return RedirectResponse(url="/media/", status_code=303)
 
+@app.post("/media/bulk", response_class=HTMLResponse)
+def bulk_update_media(
+    request: Request,
+    action: str = Form(...),
+    ids: List[int] = Form([]),
+    all_matching: bool = Form(False),
+    per_page: int = Form(50),
+    search: Optional[str] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    if action not in MEDIA_BULK_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown bulk action: {action}")
+    
+    media_ids = bulk_target_ids(session, Media, media_fts, ids, all_matching, search, status)
+    _, deleted = apply_bulk_action(session, Media, media_ids, MEDIA_BULK_ACTIONS[action])
+    for mtype, tmdb_id in deleted:
+        tmdb_membership.remove(mtype, tmdb_id)
+    
+    return bulk_redirect("/media/", search, status, per_page)
+
+# Streaming export (see exporter.py): /export/media.csv, /export/assets.ndjson.gz, /export/links.csv ...
+# A list's search (and the media status filter) narrow the export the same way.
+def export_statement(entity: str, search: Optional[str] = None, status: Optional[str] = None):
+    """Core select for an export, in id order so rows stream straight off the primary key"""
+    if entity == "media":
+        criteria = search_filters(Media, media_fts, search) + media_status_filters(Media, status)
+        return select(*exporter.table_columns(Media.__table__)).where(*criteria).order_by(Media.id)
+    if entity == "assets":
+        return select(*exporter.table_columns(Asset.__table__)).where(*search_filters(Asset, assets_fts, search)).order_by(Asset.id)
+    if entity == "links":
+        return select(*exporter.table_columns(MediaAssetLink.__table__)).order_by(MediaAssetLink.media_id, MediaAssetLink.asset_id)
+    return None
+
+@app.get("/export/{name}")
+def export_collection(name: str, search: Optional[str] = None, status: Optional[str] = None):
+    parsed = exporter.parse_name(name)
+    statement = export_statement(parsed[0], search, status) if parsed else None
+    if statement is None:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    entity, fmt, compress = parsed
+    return StreamingResponse(
+        exporter.stream(engine, statement, fmt, compress),
+        media_type=exporter.media_type(fmt, compress),
+        headers={"Content-Disposition": f'attachment; filename="{exporter.filename(entity, fmt, compress)}"'}
+    )
+
+# Cached poster images (see images.py) - the file name is a content hash, so
+# responses never change and browsers may keep them forever
+@app.get("/images/{name}")
+def get_image(name: str, if_none_match: Optional[str] = Header(None)):
+    path = images.file_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    headers = {"ETag": images.etag_for(name), "Cache-Control": images.CACHE_CONTROL}
+    if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+# Prometheus metrics (see metrics.py) - async so scrape-time gauges read the worker
+# thread limiter from the event loop
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.on_event("startup")
 def on_startup():
+    # Bound the worker pool that sync routes and run_db() execute on
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADS
     create_db_and_tables()
+    images.start()
+    dedupe.start(engine)
+    live_search.start(DATABASE_PATH)
+
+@app.on_event("startup")
+async def start_tmdb_client():
+    await tmdb_client.start()
+    jobs.start(engine, JOB_HANDLERS, [(TMDB_REFRESH_INTERVAL, queue_stale_media)])
+
+@app.on_event("shutdown")
+async def stop_tmdb_client():
+    await jobs.stop()
+    await tmdb_client.stop()
+
+@app.on_event("shutdown")
+def stop_image_cache():
+    images.stop()
+
+@app.on_event("shutdown")
+def stop_dedupe():
+    dedupe.stop()
+
+@app.on_event("shutdown")
+def stop_live_search():
+    live_search.stop()
 
 if __name__ == "__main__":
     import uvicorn
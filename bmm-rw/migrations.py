@@ -0,0 +1,139 @@
+# File: bmm-rw/migrations.py
+# Revision: 1.5 - Migration 9: ix_media_mtype_tmdbid for databases migrated from the command line
+#
+# SQLModel's create_all only creates missing tables; it never changes a table
+# that already exists. Schema changes to existing databases are listed here
+# instead, each with a version number. The "schema_version" table records the
+# versions already applied, and migrate() applies the rest in order, each in
+# its own transaction. It runs at bmm-rw startup and from the command line:
+#   python cli.py migrate            apply pending migrations
+#   python cli.py migrate --status   show the current version and what is pending
+#
+# Append new migrations at the end with the next version number; never edit or
+# renumber one that has been released. A step is an SQL string or a function
+# taking the connection.
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+
+Step = Union[str, Callable]
+
+def _add_assets_dupe_group(conn) -> None:
+    # New databases already have the column (create_all runs first)
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(assets)"))]
+    if "dupe_group" not in columns:
+        conn.execute(text("ALTER TABLE assets ADD COLUMN dupe_group INTEGER"))
+
+def _add_media_tmdb_updated(conn) -> None:
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(media)"))]
+    if "tmdb_updated" not in columns:
+        conn.execute(text("ALTER TABLE media ADD COLUMN tmdb_updated DATETIME"))
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "Title indexes for list ordering and keyset pagination", [
+        "CREATE INDEX IF NOT EXISTS ix_assets_title_id ON assets (title, id)",
+        "CREATE INDEX IF NOT EXISTS ix_media_title_id ON media (title, id)",
+    ]),
+    (2, "Media status filter indexes (title-ordered within each status)", [
+        "CREATE INDEX IF NOT EXISTS ix_media_active_title_id ON media (active, title, id)",
+        "CREATE INDEX IF NOT EXISTS ix_media_flag_title_id ON media (flag, title, id)",
+        "CREATE INDEX IF NOT EXISTS ix_media_acquire_title_id ON media (acquire, title, id)",
+    ]),
+    (3, "External id lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_media_imdbid ON media (imdbid)",
+        "CREATE INDEX IF NOT EXISTS ix_assets_tmdbid ON assets (tmdbid)",
+        "CREATE INDEX IF NOT EXISTS ix_assets_imdbid ON assets (imdbid)",
+        "CREATE INDEX IF NOT EXISTS ix_assets_isbn ON assets (isbn)",
+    ]),
+    (4, "Asset-side index on media_asset_link (its primary key starts with media_id)", [
+        "CREATE INDEX IF NOT EXISTS ix_media_asset_link_asset_id ON media_asset_link (asset_id, media_id)",
+    ]),
+    (5, "Duplicate detection: assets.dupe_group, change queue and blocking keys (see dedupe.py)", [
+        _add_assets_dupe_group,
+        "CREATE INDEX IF NOT EXISTS ix_assets_dupe_group ON assets (dupe_group)",
+        "CREATE TABLE IF NOT EXISTS dupe_queue (asset_id INTEGER PRIMARY KEY, old_group INTEGER)",
+        "CREATE TABLE IF NOT EXISTS dupe_keys (asset_id INTEGER PRIMARY KEY, title_key TEXT, isbn_key TEXT)",
+        "CREATE INDEX IF NOT EXISTS ix_dupe_keys_title_key ON dupe_keys (title_key)",
+        "CREATE INDEX IF NOT EXISTS ix_dupe_keys_isbn_key ON dupe_keys (isbn_key)",
+        "CREATE TRIGGER IF NOT EXISTS assets_dupe_ai AFTER INSERT ON assets BEGIN "
+        "INSERT OR IGNORE INTO dupe_queue (asset_id) VALUES (new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS assets_dupe_au AFTER UPDATE OF title, subtitle, format, isbn, imdbid, tmdbid, mtype "
+        "ON assets BEGIN INSERT OR IGNORE INTO dupe_queue (asset_id) VALUES (new.id); END",
+        # Keep the deleted row's group so the rest of it is re-checked
+        "CREATE TRIGGER IF NOT EXISTS assets_dupe_ad AFTER DELETE ON assets BEGIN "
+        "INSERT OR REPLACE INTO dupe_queue (asset_id, old_group) VALUES (old.id, old.dupe_group); END",
+        # Existing assets are all checked on the first run
+        "INSERT OR IGNORE INTO dupe_queue (asset_id) SELECT id FROM assets",
+    ]),
+    (6, "Background jobs table and media.tmdb_updated for TMDB enrichment (see jobs.py)", [
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, target INTEGER NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+        "state TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, run_after REAL NOT NULL, "
+        "last_error TEXT, created TEXT NOT NULL, UNIQUE (kind, target))",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_state_priority ON jobs (state, priority, run_after)",
+        _add_media_tmdb_updated,
+        "CREATE INDEX IF NOT EXISTS ix_media_tmdb_updated ON media (tmdb_updated)",
+    ]),
+    (7, "TMDB snapshot per media row, so a refresh can tell TMDB's values from edits", [
+        "CREATE TABLE IF NOT EXISTS media_tmdb_snapshot (media_id INTEGER PRIMARY KEY, fields TEXT NOT NULL)",
+        "CREATE TRIGGER IF NOT EXISTS media_tmdb_snapshot_ad AFTER DELETE ON media BEGIN "
+        "DELETE FROM media_tmdb_snapshot WHERE media_id = old.id; END",
+        # Details stored before snapshots existed are taken to be TMDB's
+        "INSERT OR IGNORE INTO media_tmdb_snapshot (media_id, fields) "
+        "SELECT id, json_object('title', title, 'subtitle', subtitle, 'imageurl', imageurl, "
+        "'notes', notes, 'imdbid', imdbid) FROM media WHERE tmdbid IS NOT NULL",
+    ]),
+    (8, "Assets unmarked as duplicates by hand, which duplicate detection leaves out (see dedupe.py)", [
+        "CREATE TABLE IF NOT EXISTS dupe_exempt (asset_id INTEGER PRIMARY KEY)",
+        "CREATE TRIGGER IF NOT EXISTS assets_dupe_exempt_ad AFTER DELETE ON assets BEGIN "
+        "DELETE FROM dupe_exempt WHERE asset_id = old.id; END",
+    ]),
+    # Declared on the Media model and added at bmm-rw startup, but "cli.py migrate" on an
+    # existing database only creates missing tables
+    (9, "Media lookup index by type and TMDB id", [
+        "CREATE INDEX IF NOT EXISTS ix_media_mtype_tmdbid ON media (mtype, tmdbid)",
+    ]),
+]
+
+CREATE_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL)"
+)
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def current_version(engine) -> int:
+    """Highest migration version applied to the database (0 for none)"""
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_VERSION_TABLE))
+        return conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version")).scalar()
+
+def pending(engine) -> List[Tuple[int, str, List[Step]]]:
+    """Migrations not yet applied, in order"""
+    version = current_version(engine)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+def migrate(engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target (default: all) and return the versions applied"""
+    applied = []
+    for version, description, steps in pending(engine):
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description, "applied_at": datetime.now().isoformat(timespec="seconds")}
+            )
+        applied.append(version)
+    if applied:
+        # Gather statistics for the query planner so it can weigh the new indexes
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    return applied
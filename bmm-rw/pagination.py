@@ -0,0 +1,233 @@
+# File: bmm-rw/pagination.py
+# Revision: 1.3 - Ranked search results count at most COUNT_CAP matches
+#
+# Lists are ordered by (title, id). Instead of OFFSET, which makes SQLite walk
+# every skipped row, each page is fetched with a WHERE clause that seeks past
+# the last row of the previous page. Deep pages then cost the same as page 1.
+# SQLite sorts NULL titles first, so the seek clauses handle NULL explicitly.
+# Relevance-ranked search results page by OFFSET and count at most COUNT_CAP
+# matches, so a broad search typed a keystroke at a time doesn't count the
+# whole collection for every request.
+import base64
+import json
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, literal_column, or_, tuple_
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+
+COUNT_CAP = 1000
+
+def encode_cursor(title: Optional[str], row_id: int) -> str:
+    """Encode a (title, id) position as an opaque URL-safe token"""
+    raw = json.dumps([title, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(token: str) -> Optional[Tuple[Optional[str], int]]:
+    """Decode a token from encode_cursor, or return None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        title, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(row_id, int) or not (title is None or isinstance(title, str)):
+        return None
+    return title, row_id
+
+def after_clause(title_col, id_col, title: Optional[str], row_id: int):
+    """Rows strictly after (title, id) in (title, id) order"""
+    if title is None:
+        return or_(title_col.is_not(None), and_(title_col.is_(None), id_col > row_id))
+    return or_(title_col > title, and_(title_col == title, id_col > row_id))
+
+def before_clause(title_col, id_col, title: Optional[str], row_id: int):
+    """Rows strictly before (title, id) in (title, id) order"""
+    if title is None:
+        return and_(title_col.is_(None), id_col < row_id)
+    return or_(title_col.is_(None), title_col < title, and_(title_col == title, id_col < row_id))
+
+def _first_id(model, criteria_for: Callable, where: Callable, ascending: bool):
+    """Correlated scalar subquery: first id of model in (title, id) order matching the criteria"""
+    inner = aliased(model)
+    order = (inner.title, inner.id) if ascending else (inner.title.desc(), inner.id.desc())
+    return (
+        select(inner.id)
+        .where(*criteria_for(inner), *where(inner))
+        .order_by(*order)
+        .limit(1)
+        .correlate(model)
+        .scalar_subquery()
+    )
+
+def neighbor_columns(model, criteria_for: Optional[Callable] = None) -> list:
+    """prev_id/next_id columns for the row of `model` being selected, in (title, id) order.
+
+    Selected alongside the row itself, a detail page gets its record and its
+    Previous/Next ids in one statement. criteria_for(alias) returns the list's
+    filters (search, status) for an alias of model, so the links walk the same
+    rows as the list the user came from. Each subquery is a seek on (title, id)
+    rather than a scan; NULL titles sort first, as in the list.
+    """
+    criteria_for = criteria_for or (lambda alias: [])
+    title, row_id = model.title, model.id
+    prev_id = case(
+        (title.is_(None), _first_id(model, criteria_for, lambda m: [m.title.is_(None), m.id < row_id], False)),
+        else_=func.coalesce(
+            _first_id(model, criteria_for, lambda m: [tuple_(m.title, m.id) < tuple_(title, row_id)], False),
+            _first_id(model, criteria_for, lambda m: [m.title.is_(None)], False)
+        )
+    )
+    next_id = case(
+        (title.is_(None), func.coalesce(
+            _first_id(model, criteria_for, lambda m: [m.title.is_(None), m.id > row_id], True),
+            _first_id(model, criteria_for, lambda m: [m.title.is_not(None)], True)
+        )),
+        else_=_first_id(model, criteria_for, lambda m: [tuple_(m.title, m.id) > tuple_(title, row_id)], True)
+    )
+    return [prev_id.label("prev_id"), next_id.label("next_id")]
+
+def ranked_neighbors(model, fts, match_criterion, criteria_for: Optional[Callable] = None):
+    """Subquery of (id, prev_id, next_id) for a relevance-ranked search list.
+
+    Ranked lists are ordered by (rank, title, id), which has no position to
+    seek to, so the neighbors come from LAG/LEAD over every matching row:
+    cheap for a specific search, a few hundred ms for one matching most of
+    the collection. Join it to the detail row on id.
+    """
+    criteria_for = criteria_for or (lambda alias: [])
+    inner = aliased(model)
+    order = (fts.c.rank, inner.title, inner.id)
+    return (
+        select(
+            inner.id.label("id"),
+            func.lag(inner.id).over(order_by=order).label("prev_id"),
+            func.lead(inner.id).over(order_by=order).label("next_id")
+        )
+        .join(fts, fts.c.rowid == inner.id)
+        .where(match_criterion, *criteria_for(inner))
+        .subquery()
+    )
+
+def keyset_page(
+    session,
+    query,
+    title_col,
+    id_col,
+    per_page: int,
+    after: Optional[Tuple[Optional[str], int]] = None,
+    before: Optional[Tuple[Optional[str], int]] = None
+) -> Tuple[List[Any], dict]:
+    """Fetch one page of `query` relative to a cursor position.
+
+    Returns the rows in (title, id) order plus a dict with has_prev/has_next
+    and the prev_cursor/next_cursor tokens the pagination links should follow.
+    One extra row is fetched to find out whether another page exists.
+    """
+    if before is not None:
+        query = query.where(before_clause(title_col, id_col, *before))
+        rows = session.exec(query.order_by(title_col.desc(), id_col.desc()).limit(per_page + 1)).all()
+        has_more = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_prev, has_next = has_more, True
+    else:
+        if after is not None:
+            query = query.where(after_clause(title_col, id_col, *after))
+        rows = session.exec(query.order_by(title_col, id_col).limit(per_page + 1)).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev, has_next = after is not None, has_more
+
+    page_info = {
+        "has_prev": has_prev and bool(rows),
+        "has_next": has_next and bool(rows),
+        "prev_cursor": encode_cursor(rows[0].title, rows[0].id) if rows else None,
+        "next_cursor": encode_cursor(rows[-1].title, rows[-1].id) if rows else None,
+    }
+    return rows, page_info
+
+def estimate_count(session, model) -> int:
+    """Cheap row-count estimate from the highest rowid (ignores deleted gaps)"""
+    return session.exec(select(func.max(model.id))).one() or 0
+
+def paginate(
+    session,
+    query,
+    count_query,
+    model,
+    order_by: list,
+    page: int,
+    per_page: int,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    exact_count: bool = False,
+    filtered: bool = False,
+    known_total: Optional[int] = None
+) -> Tuple[List[Any], dict]:
+    """Run a list query and build the template's pagination dict.
+
+    Title-ordered lists use keyset pagination (mode "cursor") unless an old
+    style ?page=N link is followed without a cursor. Relevance-ranked search
+    results (order_by not starting with the title) keep OFFSET paging, since
+    there is no (title, id) position to seek to, and unless exact_count is
+    set only count up to COUNT_CAP rows (or to the page asked for); past that
+    the total is "capped" and there is one more page than counted.
+
+    In cursor mode the total is only counted exactly when asked for. Otherwise
+    it comes from known_total (e.g. the collection counters) when the caller
+    has one, an unfiltered list gets an estimate and a filtered one gets none.
+    """
+    title_ordered = order_by[0] is model.title
+    if title_ordered and (after or before or page == 1):
+        after_pos = decode_cursor(after) if after else None
+        before_pos = decode_cursor(before) if before else None
+        if (after and after_pos is None) or (before and before_pos is None):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+        rows, page_info = keyset_page(
+            session, query, model.title, model.id, per_page, after=after_pos, before=before_pos
+        )
+        estimated = False
+        if exact_count:
+            total_count = session.exec(count_query).one()
+        elif known_total is not None:
+            total_count = known_total
+        elif not filtered:
+            total_count = estimate_count(session, model)
+            estimated = True
+        else:
+            total_count = None
+
+        pagination = {
+            "mode": "cursor",
+            "page": page,
+            "per_page": per_page,
+            "total_count": total_count,
+            "total_pages": (total_count + per_page - 1) // per_page if total_count is not None else None,
+            "estimated": estimated,
+            "capped": False,
+        }
+        pagination.update(page_info)
+        return rows, pagination
+
+    capped = False
+    if exact_count:
+        total_count = session.exec(count_query).one()
+    else:
+        limit = max(COUNT_CAP, page * per_page)
+        # count_query's FROM and filters (e.g. the FTS table alone), stopping after limit + 1 rows
+        counted = count_query.with_only_columns(literal_column("1")).limit(limit + 1).subquery()
+        total_count = session.exec(select(func.count()).select_from(counted)).one()
+        capped = total_count > limit
+        total_count = min(total_count, limit)
+    total_pages = (total_count + capped + per_page - 1) // per_page
+    rows = session.exec(query.order_by(*order_by).offset((page - 1) * per_page).limit(per_page)).all()
+    return rows, {
+        "mode": "page",
+        "page": page,
+        "per_page": per_page,
+        "total_count": total_count,
+        "total_pages": total_pages,
+        "estimated": False,
+        "capped": capped,
+    }
@@ -0,0 +1,111 @@
+# File: bmm-rw/resilience.py
+# Revision: 1.0 - Token bucket, retry backoff and circuit breaker for upstream calls
+#
+# Building blocks for calling a service we don't control (TMDB, see
+# tmdb_client.py). They keep no locks: each instance is used from one event
+# loop, where nothing runs between two awaits.
+#
+#   TokenBucket      client-side rate limit - rate requests per second with
+#                    bursts of up to burst; callers wait their turn instead of
+#                    collecting 429s
+#   backoff()        retry delay: exponential with full jitter, or the
+#                    server's Retry-After when it sent one
+#   CircuitBreaker   after failures consecutive failures, calls are refused
+#                    at once for cooldown seconds; then one trial call
+#                    decides whether to close it again
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it (0 = go now)"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def cancel(self) -> None:
+        """Give back a reserved token that won't be used"""
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for seconds (the server asked us to slow down)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff(attempt: int, base: float, cap: float, server_delay: Optional[float] = None) -> float:
+    """Delay before retry number attempt (1 for the first retry)"""
+    if server_delay is not None:
+        return server_delay
+    # Full jitter: clients that failed together don't retry together
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failed = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+        self.opened = 0  # times opened, for monitoring
+
+    def allow(self) -> bool:
+        """Whether a call may go out now"""
+        if self.failures <= 0 or self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        # One trial call at a time; another is allowed if it never reported back (e.g. cancelled)
+        if self.state == HALF_OPEN and now - self.trial_at >= self.cooldown:
+            self.trial_at = now
+            return True
+        return False
+
+    def success(self) -> None:
+        self.state = CLOSED
+        self.failed = 0
+
+    def failure(self) -> None:
+        self.failed += 1
+        if self.failures > 0 and (self.state == HALF_OPEN or self.failed >= self.failures):
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def retry_in(self) -> float:
+        """Seconds until a trial call will be allowed (0 when closed)"""
+        if self.state == CLOSED:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
@@ -0,0 +1,45 @@
+# Shared setup for the bmm-rw tests (python -m pytest bmm-rw/tests)
+#
+# main.py reads its settings when it is imported and finds static/ and
+# templates/ relative to the working directory, so the tests run in bmm-rw/
+# with the app pointed at a throwaway database and the background workers,
+# live search and the TMDB cache switched off before anything imports it.
+# Tests that need data get a database of their own from the engine fixture.
+import os
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)
+
+os.environ.update({
+    "BMM_DATABASE_PATH": os.path.join(tempfile.mkdtemp(prefix="bmm-rw-tests-"), "media_assets.db"),
+    "BMM_JOBS": "0",
+    "BMM_DEDUPE_INTERVAL": "0",
+    "BMM_LIVE_SEARCH": "0",
+    "TMDB_CACHE_PATH": "",
+})
+
+from sqlmodel import SQLModel, create_engine  # noqa: E402
+
+import main  # noqa: E402
+import migrations  # noqa: E402
+
+@pytest.fixture
+def engine(tmp_path):
+    """A new database with the current schema (tables plus every migration)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    migrations.migrate(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def app_engine(engine, monkeypatch):
+    """engine, also used by the functions in main that open their own connections"""
+    monkeypatch.setattr(main, "engine", engine)
+    return engine
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import text
+
+import dedupe
+
+BLANK = {"title": None, "subtitle": None, "format": None, "isbn": None, "imdbid": None, "tmdbid": None, "mtype": None}
+
+def add(engine, *assets):
+    """Insert assets (dicts of column values); the triggers queue them for the job"""
+    with engine.begin() as conn:
+        for asset in assets:
+            values = {**BLANK, **asset}
+            conn.execute(text(
+                "INSERT INTO assets (id, title, subtitle, format, isbn, imdbid, tmdbid, mtype, dupe, active, flag, creation) "
+                "VALUES (:id, :title, :subtitle, :format, :isbn, :imdbid, :tmdbid, :mtype, 0, 1, 0, '2020-01-01')"
+            ), values)
+
+def groups(engine):
+    """{asset id: (dupe, dupe_group)} after running the job"""
+    dedupe.process_queue(engine)
+    with engine.connect() as conn:
+        return {row_id: (bool(dupe), group) for row_id, dupe, group in
+                conn.execute(text("SELECT id, dupe, dupe_group FROM assets ORDER BY id"))}
+
+def record(**values):
+    """A keyed row as score() takes it"""
+    base = {**BLANK, **values}
+    base["title_key"] = dedupe.title_key(base["title"])
+    base["isbn_key"] = dedupe.isbn_key(base["isbn"])
+    return base
+
+@pytest.mark.parametrize("title, key", [
+    ("The Matrix", "matrix"), ("Matrix, The", "matrix"), ("  Amélie!! ", "amelie"), ("A", "a"), ("", None),
+])
+def test_title_key(title, key):
+    assert dedupe.title_key(title) == key
+
+def test_isbn_10_and_13_give_the_same_key():
+    assert dedupe.isbn_key("0-306-40615-2") == dedupe.isbn_key("978-0-306-40615-7") == "9780306406157"
+
+def test_score():
+    dvd = record(title="Alien", format="DVD", tmdbid=348, mtype=1)
+    assert dedupe.score(dvd, record(title="alien", format="dvd", tmdbid=348, mtype=1)) >= dedupe.threshold()
+    assert dedupe.score(dvd, record(title="Alien", format="dvd")) >= dedupe.threshold()
+    assert dedupe.score(dvd, record(title="Alien", format="bluray", tmdbid=348, mtype=1)) == 0.0
+    assert dedupe.score(dvd, record(title="Alien", format="dvd", tmdbid=8077, mtype=1)) == 0.0
+    assert dedupe.score(dvd, record(title="Alien", format="dvd", tmdbid=348, mtype=2)) == 0.0
+    assert dedupe.score(record(isbn="0306406152"), record(isbn="9780306406157", title="Other")) == 1.0
+
+def test_copies_are_grouped_under_the_lowest_id(engine):
+    add(engine,
+        {"id": 3, "title": "Dune", "format": "paperback", "isbn": "978-0-441-17271-9"},
+        {"id": 5, "title": "Dune", "format": "paperback", "isbn": "0441172717"},
+        {"id": 8, "title": "Dune", "format": "paperback", "isbn": "9780441172719"},
+        {"id": 9, "title": "Dune", "format": "hardcover"},
+        {"id": 10, "title": "Emma", "format": "paperback"})
+    assert groups(engine) == {3: (True, 3), 5: (True, 3), 8: (True, 3), 9: (False, None), 10: (False, None)}
+
+def test_a_title_only_copy_does_not_chain_two_films(engine):
+    # 2 matches 1 and 3 by title and format, but 1 and 3 are different films
+    add(engine,
+        {"id": 1, "title": "Solaris", "format": "dvd", "tmdbid": 593, "mtype": 1},
+        {"id": 2, "title": "Solaris", "format": "dvd"},
+        {"id": 3, "title": "Solaris", "format": "dvd", "tmdbid": 2103, "mtype": 1})
+    result = groups(engine)
+    assert result[3] == (False, None)
+    assert result[1] == result[2] == (True, 1)
+
+def test_group_is_cleared_when_it_shrinks_to_one(engine):
+    add(engine, {"id": 1, "title": "Heat", "format": "dvd"}, {"id": 2, "title": "Heat", "format": "dvd"},
+        {"id": 3, "title": "Heat", "format": "dvd"})
+    assert {group for _, group in groups(engine).values()} == {1}
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM assets WHERE id = 1"))
+    # The rest of the old group is checked again and gets the new lowest id
+    assert groups(engine) == {2: (True, 2), 3: (True, 2)}
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE assets SET format = 'bluray' WHERE id = 3"))
+    assert groups(engine) == {2: (False, None), 3: (False, None)}
+
+def test_unmarked_by_hand_stays_out_until_marked_again(engine):
+    add(engine, *({"id": row_id, "title": "Ran", "format": "dvd"} for row_id in (1, 2, 3)))
+    assert all(dupe for dupe, _ in groups(engine).values())
+
+    with engine.begin() as conn:
+        dedupe.mark_by_hand(conn, [1], dupe=False)
+        conn.execute(text("UPDATE assets SET dupe = 0 WHERE id = 1"))
+    assert groups(engine) == {1: (False, None), 2: (True, 2), 3: (True, 2)}
+    # Still out after a full rescan
+    dedupe.requeue_all(engine)
+    assert groups(engine)[1] == (False, None)
+
+    with engine.begin() as conn:
+        dedupe.mark_by_hand(conn, [1], dupe=True)
+        conn.execute(text("UPDATE assets SET dupe = 1 WHERE id = 1"))
+    assert groups(engine) == {1: (True, 1), 2: (True, 1), 3: (True, 1)}
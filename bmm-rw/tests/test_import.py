@@ -0,0 +1,123 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+import main
+from main import Asset, Media
+
+def rows(*dicts):
+    """(line number, row) pairs as importer.read_rows() yields them"""
+    return [(line, row) for line, row in enumerate(dicts, start=2)]
+
+def copies(count, **values):
+    return [dict(values) for _ in range(count)]
+
+def table(engine, sql):
+    with engine.connect() as conn:
+        return conn.execute(text(sql)).all()
+
+BOOKS = [
+    {"title": f"Book {number}", "format": "hardcover", "location": "Shelf A", "isbn": f"978000000{number:04d}"}
+    for number in range(10)
+]
+
+def test_copies_in_a_file_are_all_imported_and_reimport_adds_nothing(app_engine):
+    file_rows = [dict(book, id=source_id) for source_id, book in
+                 enumerate((book for book in BOOKS for _ in range(3)), start=1)]
+    report = main.bulk_import("assets", rows(*file_rows))
+    assert (report["created"], report["duplicates"], report["invalid"]) == (30, 0, 0)
+
+    again = main.bulk_import("assets", rows(*file_rows))
+    assert (again["created"], again["duplicates"]) == (0, 30)
+    assert table(app_engine, "SELECT count(*) FROM assets") == [(30,)]
+
+def test_a_file_with_one_more_copy_adds_just_that_copy(app_engine):
+    main.bulk_import("assets", rows(*copies(2, **BOOKS[0])))
+    report = main.bulk_import("assets", rows(*copies(3, **BOOKS[0])))
+    assert (report["created"], report["duplicates"]) == (1, 2)
+    # Small batches: the copy created in one batch isn't taken for another row of the same run
+    report = main.bulk_import("assets", rows(*copies(5, **BOOKS[0])), batch_size=2)
+    assert (report["created"], report["duplicates"]) == (2, 3)
+
+def test_assets_that_differ_in_any_identifying_field_are_not_duplicates(app_engine):
+    main.bulk_import("assets", rows(BOOKS[0]))
+    variants = [dict(BOOKS[0], location="Shelf B"), dict(BOOKS[0], format="paperback"),
+                dict(BOOKS[0], isbn="9780000009999"), dict(BOOKS[0], subtitle="Annotated")]
+    report = main.bulk_import("assets", rows(*variants))
+    assert (report["created"], report["duplicates"]) == (4, 0)
+
+def test_rows_without_title_or_ids_are_matched_on_reimport(app_engine):
+    untitled = [{"format": "vhs"}, {"format": "vhs"}, {"location": "Attic"}]
+    assert main.bulk_import("assets", rows(*untitled))["created"] == 3
+    assert main.bulk_import("assets", rows(*untitled))["created"] == 0
+    assert main.bulk_import("media", rows({"mtype": 1}))["created"] == 1
+    assert main.bulk_import("media", rows({"mtype": 1}))["created"] == 0
+
+def test_media_dedupe_on_tmdb_id_and_title(app_engine):
+    report = main.bulk_import("media", rows(
+        {"title": "Alien", "mtype": 1, "tmdbid": 348},
+        {"title": "Alien (1979)", "mtype": 1, "tmdbid": 348},
+        {"title": "Alien", "mtype": 2, "tmdbid": 348},
+        {"title": "Home movie", "mtype": 1},
+        {"title": "Home movie", "mtype": 1},
+    ))
+    assert (report["created"], report["duplicates"]) == (3, 2)
+
+def test_bad_ids_are_reported_per_row(app_engine):
+    report = main.bulk_import("assets", rows(
+        {"id": "abc", "title": "Bad"}, {"id": 1.5, "title": "Fraction"}, {"id": "-3", "title": "Negative"},
+        {"id": " 7 ", "title": "Padded"}, {"title": "No id"},
+    ))
+    assert (report["created"], report["invalid"]) == (2, 3)
+    assert [error.split(":")[0] for error in report["errors"]] == ["line 2", "line 3", "line 4"]
+    assert all("id: must be a positive integer" in error for error in report["errors"])
+
+def test_source_ids_map_to_new_ids_when_the_database_has_gaps(app_engine):
+    # Existing rows with a hole in the ids, so new ids don't start at 1 or run on from the file's
+    with Session(app_engine) as session:
+        for title in ("Existing 1", "Existing 2", "Existing 3"):
+            session.add(Media(title=title, mtype=1, creation=datetime(2020, 1, 1)))
+            session.add(Asset(title=title, creation=datetime(2020, 1, 1)))
+        session.commit()
+    with app_engine.begin() as conn:
+        conn.execute(text("DELETE FROM media WHERE id = 2"))
+
+    id_maps = {}
+    media = main.bulk_import("media", rows(
+        {"id": 500, "title": "Alien", "mtype": 1, "tmdbid": 348},
+        {"id": 7, "title": "Existing 1", "mtype": 1},
+        {"id": 501, "title": "Aliens", "mtype": 1, "tmdbid": 679},
+    ), id_maps)
+    assets = main.bulk_import("assets", rows(
+        {"id": 40, "title": "Alien", "format": "dvd", "media_ids": "500"},
+        {"id": 41, "title": "Alien", "format": "dvd", "media_ids": "500,501"},
+        {"id": 42, "title": "Existing 1", "format": "vhs", "media_ids": "7"},
+    ), id_maps)
+    links = main.bulk_import("links", rows({"media_id": 501, "asset_id": 40}, {"media_id": 999, "asset_id": 40}), id_maps)
+
+    assert (media["created"], media["duplicates"]) == (2, 1)
+    titles = dict(table(app_engine, "SELECT id, title FROM media"))
+    assert titles[id_maps["media"][500]] == "Alien"
+    assert titles[id_maps["media"][501]] == "Aliens"
+    assert id_maps["media"][7] == 1  # matched the row already there
+    asset_titles = dict(table(app_engine, "SELECT id, format FROM assets"))
+    assert [asset_titles[id_maps["assets"][source]] for source in (40, 41, 42)] == ["dvd", "dvd", "vhs"]
+    assert len(set(id_maps["assets"].values())) == 3
+
+    assert assets["linked"] == 4 and links["linked"] == 1 and links["missing_links"] == 1
+    linked = set(table(app_engine, "SELECT m.title, a.id FROM media_asset_link l "
+                                   "JOIN media m ON m.id = l.media_id JOIN assets a ON a.id = l.asset_id"))
+    assert linked == {
+        ("Alien", id_maps["assets"][40]), ("Aliens", id_maps["assets"][40]),
+        ("Alien", id_maps["assets"][41]), ("Aliens", id_maps["assets"][41]),
+        ("Existing 1", id_maps["assets"][42]),
+    }
+
+def test_link_by_tmdb_links_new_assets_only(app_engine):
+    main.bulk_import("media", rows({"title": "Alien", "mtype": 1, "tmdbid": 348}))
+    report = main.bulk_import("assets", rows(
+        {"title": "Alien", "format": "dvd", "mtype": 1, "tmdbid": 348},
+        {"title": "Alien", "format": "bluray", "mtype": 2, "tmdbid": 348},
+    ), link_by_tmdb=True)
+    assert report["created"] == 2 and report["linked"] == 1
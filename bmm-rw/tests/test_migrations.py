@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlmodel import SQLModel
+
+import main  # noqa: F401  (registers the models with SQLModel.metadata)
+import migrations
+
+# The schema the first release created, before any migration existed
+BASELINE_SCHEMA = [
+    "CREATE TABLE assets (format VARCHAR, location VARCHAR, notes VARCHAR, subtitle VARCHAR, title VARCHAR, "
+    "imageurl VARCHAR, image VARCHAR, dupe BOOLEAN, imdbid VARCHAR, tmdbid INTEGER, active BOOLEAN NOT NULL, "
+    "flag BOOLEAN NOT NULL, mtype INTEGER, isbn VARCHAR, id INTEGER NOT NULL, creation DATETIME NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE media (title VARCHAR, subtitle VARCHAR, imageurl VARCHAR, mtype INTEGER, notes VARCHAR, "
+    "imdbid VARCHAR, tmdbid INTEGER, active BOOLEAN NOT NULL, flag BOOLEAN NOT NULL, acquire BOOLEAN NOT NULL, "
+    "id INTEGER NOT NULL, creation DATETIME NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE media_asset_link (media_id INTEGER NOT NULL, asset_id INTEGER NOT NULL, "
+    "PRIMARY KEY (media_id, asset_id), FOREIGN KEY(media_id) REFERENCES media (id), "
+    "FOREIGN KEY(asset_id) REFERENCES assets (id))",
+]
+
+@pytest.fixture
+def baseline(tmp_path):
+    """A database as the first release left it, with a few rows"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO media (id, title, subtitle, mtype, tmdbid, active, flag, acquire, creation) VALUES "
+            "(1, 'Alien', 'In space...', 1, 348, 1, 0, 0, '2020-01-01'), "
+            "(2, 'Home movie', NULL, 1, NULL, 1, 0, 0, '2020-01-01')"
+        ))
+        conn.execute(text(
+            "INSERT INTO assets (id, title, format, isbn, dupe, active, flag, creation) VALUES "
+            "(1, 'Alien', 'dvd', NULL, 0, 1, 0, '2020-01-01'), (2, 'Alien', 'dvd', NULL, 1, 1, 0, '2020-01-01')"
+        ))
+        conn.execute(text("INSERT INTO media_asset_link (media_id, asset_id) VALUES (1, 1), (1, 2)"))
+    yield engine
+    engine.dispose()
+
+def test_fresh_baseline_is_at_version_zero(baseline):
+    assert migrations.current_version(baseline) == 0
+    assert [version for version, _, _ in migrations.pending(baseline)] == [
+        version for version, _, _ in migrations.MIGRATIONS
+    ]
+
+def test_migrates_baseline_to_latest(baseline):
+    applied = migrations.migrate(baseline)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(baseline) == migrations.latest_version()
+    assert migrations.pending(baseline) == []
+
+    schema = inspect(baseline)
+    assert "dupe_group" in {column["name"] for column in schema.get_columns("assets")}
+    assert "tmdb_updated" in {column["name"] for column in schema.get_columns("media")}
+    assert {"dupe_queue", "dupe_keys", "jobs", "media_tmdb_snapshot", "dupe_exempt"} <= set(schema.get_table_names())
+    indexes = {index["name"] for table in ("assets", "media") for index in schema.get_indexes(table)}
+    assert {"ix_assets_title_id", "ix_media_title_id", "ix_media_mtype_tmdbid", "ix_assets_dupe_group"} <= indexes
+
+    with baseline.connect() as conn:
+        # Existing rows are kept and queued for their first duplicate check
+        assert conn.execute(text("SELECT count(*) FROM assets")).scalar() == 2
+        assert conn.execute(text("SELECT count(*) FROM media_asset_link")).scalar() == 2
+        assert conn.execute(text("SELECT asset_id FROM dupe_queue ORDER BY asset_id")).scalars().all() == [1, 2]
+        # Only media with a TMDB id get a snapshot of their details
+        snapshots = conn.execute(text("SELECT media_id, fields FROM media_tmdb_snapshot")).all()
+    assert [media_id for media_id, _ in snapshots] == [1]
+    assert json.loads(snapshots[0][1])["subtitle"] == "In space..."
+
+def test_migrate_again_is_a_no_op(baseline):
+    migrations.migrate(baseline)
+    with baseline.connect() as conn:
+        applied_at = conn.execute(text("SELECT version, applied_at FROM schema_version ORDER BY version")).all()
+    assert migrations.migrate(baseline) == []
+    with baseline.connect() as conn:
+        assert conn.execute(text("SELECT version, applied_at FROM schema_version ORDER BY version")).all() == applied_at
+
+def test_migrate_stops_at_target(baseline):
+    assert migrations.migrate(baseline, target=4) == [1, 2, 3, 4]
+    assert migrations.current_version(baseline) == 4
+    assert "dupe_group" not in {column["name"] for column in inspect(baseline).get_columns("assets")}
+    assert migrations.migrate(baseline)[0] == 5
+
+def test_triggers_work_after_migrating(baseline):
+    migrations.migrate(baseline)
+    with baseline.begin() as conn:
+        conn.execute(text("DELETE FROM dupe_queue"))
+        conn.execute(text("UPDATE assets SET dupe_group = 1 WHERE id IN (1, 2)"))
+        conn.execute(text("INSERT INTO dupe_exempt (asset_id) VALUES (2)"))
+        conn.execute(text("DELETE FROM assets WHERE id = 2"))
+        conn.execute(text("DELETE FROM media WHERE id = 1"))
+    with baseline.connect() as conn:
+        # The deleted asset is queued with its old group, so the rest of the group is re-checked
+        assert conn.execute(text("SELECT asset_id, old_group FROM dupe_queue")).all() == [(2, 1)]
+        assert conn.execute(text("SELECT count(*) FROM dupe_exempt")).scalar() == 0
+        assert conn.execute(text("SELECT count(*) FROM media_tmdb_snapshot")).scalar() == 0
+
+def test_new_database_with_create_all_then_migrate(tmp_path):
+    # "cli.py migrate" and the app's startup create the tables first, then migrate
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    SQLModel.metadata.create_all(engine)
+    assert migrations.migrate(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.latest_version()
+    engine.dispose()
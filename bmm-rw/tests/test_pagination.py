@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, func, select
+
+import pagination
+from main import Asset
+
+# NULL titles sort first, then by title; equal titles by id
+TITLES = [None, "Alien", None, "Blade Runner", "Alien", "Alien", "Contact", "Blade Runner", None, "Dune"]
+ORDER = [1, 3, 9, 2, 5, 6, 4, 8, 7, 10]
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        for title in TITLES:
+            session.add(Asset(title=title, creation=datetime(2020, 1, 1)))
+        session.commit()
+        yield session
+
+def page(session, per_page, after=None, before=None):
+    rows, info = pagination.keyset_page(session, select(Asset), Asset.title, Asset.id, per_page, after=after, before=before)
+    return [row.id for row in rows], info
+
+def walk_forward(session, per_page):
+    pages, after = [], None
+    while True:
+        ids, info = page(session, per_page, after=after)
+        pages.append(ids)
+        if not info["has_next"]:
+            return pages
+        after = pagination.decode_cursor(info["next_cursor"])
+
+@pytest.mark.parametrize("per_page", [1, 3, 4, 10, 11])
+def test_forward_walk_visits_every_row_once_in_order(session, per_page):
+    pages = walk_forward(session, per_page)
+    assert [row_id for ids in pages for row_id in ids] == ORDER
+    assert all(len(ids) == per_page for ids in pages[:-1])
+
+@pytest.mark.parametrize("per_page", [1, 3, 4])
+def test_backward_walk_returns_the_same_pages(session, per_page):
+    pages = walk_forward(session, per_page)
+    first_of_last = session.get(Asset, pages[-1][0])
+    before = (first_of_last.title, first_of_last.id)
+    backwards = []
+    while True:
+        ids, info = page(session, per_page, before=before)
+        backwards.insert(0, ids)
+        assert info["has_next"]
+        if not info["has_prev"]:
+            break
+        before = pagination.decode_cursor(info["prev_cursor"])
+    assert backwards == pages[:-1]
+
+def test_cursor_at_the_edges(session):
+    # Past the last row: an empty page with no links either way
+    ids, info = page(session, 3, after=("Dune", 10))
+    assert ids == [] and not info["has_prev"] and not info["has_next"]
+    # Before the first (NULL-titled) row
+    ids, info = page(session, 3, before=(None, 1))
+    assert ids == [] and not info["has_prev"]
+    # Between NULL titles and the first real title
+    ids, info = page(session, 2, after=(None, 9))
+    assert ids == [2, 5] and info["has_prev"] and info["has_next"]
+    ids, info = page(session, 2, before=("Alien", 2))
+    assert ids == [3, 9] and info["has_prev"]
+
+def test_cursor_round_trip_including_null_title():
+    for position in [(None, 3), ("Alien", 12), ("Ünïcode / &?", 1)]:
+        assert pagination.decode_cursor(pagination.encode_cursor(*position)) == position
+
+@pytest.mark.parametrize("token", ["", "not base64!", "bnVsbA", "WzEsMl0", "WyJhIiwiYiJd"])
+def test_malformed_cursor_decodes_to_none(token):
+    # "null", [1, 2] and ["a", "b"] are valid JSON but not (title, id) positions
+    assert pagination.decode_cursor(token) is None
+
+def test_paginate_rejects_a_malformed_cursor(session):
+    with pytest.raises(HTTPException) as raised:
+        pagination.paginate(session, select(Asset), select(func.count()).select_from(Asset), Asset,
+                            [Asset.title], 2, 3, after="garbage")
+    assert raised.value.status_code == 400
+
+def test_paginate_cursor_mode_totals(session):
+    count_query = select(func.count()).select_from(Asset)
+    _, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.title], 1, 4)
+    assert info["mode"] == "cursor" and info["estimated"] and info["total_count"] == len(TITLES)
+    _, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.title], 1, 4, exact_count=True)
+    assert info["total_count"] == len(TITLES) and info["total_pages"] == 3 and not info["estimated"]
+    _, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.title], 1, 4, filtered=True)
+    assert info["total_count"] is None
+
+def test_neighbor_columns_follow_the_list_order(session):
+    rows = session.exec(select(Asset.id, *pagination.neighbor_columns(Asset))).all()
+    neighbors = {row_id: (prev_id, next_id) for row_id, prev_id, next_id in rows}
+    for position, row_id in enumerate(ORDER):
+        prev_id = ORDER[position - 1] if position else None
+        next_id = ORDER[position + 1] if position + 1 < len(ORDER) else None
+        assert neighbors[row_id] == (prev_id, next_id)
+
+def test_page_mode_count_is_capped(session, monkeypatch):
+    # Ordered by id rather than title, so page mode is used
+    monkeypatch.setattr(pagination, "COUNT_CAP", 4)
+    count_query = select(func.count()).select_from(Asset)
+    rows, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.id], 1, 3)
+    assert [row.id for row in rows] == [1, 2, 3]
+    assert (info["total_count"], info["capped"], info["total_pages"]) == (4, True, 2)
+    # The count reaches at least as far as the page asked for
+    rows, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.id], 3, 3)
+    assert [row.id for row in rows] == [7, 8, 9]
+    assert (info["total_count"], info["capped"], info["total_pages"]) == (9, True, 4)
+    _, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.id], 1, 3, exact_count=True)
+    assert (info["total_count"], info["capped"], info["total_pages"]) == (len(TITLES), False, 4)
+    monkeypatch.setattr(pagination, "COUNT_CAP", len(TITLES))
+    _, info = pagination.paginate(session, select(Asset), count_query, Asset, [Asset.id], 1, 3)
+    assert (info["total_count"], info["capped"]) == (len(TITLES), False)
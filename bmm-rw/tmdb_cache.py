@@ -0,0 +1,144 @@
+# File: bmm-rw/tmdb_cache.py
+# Revision: 1.2 - Expired entries served while TMDB is unavailable
+#
+# Successful TMDB JSON responses are kept in an in-memory LRU in front of a
+# small SQLite table in its own file (not media_assets.db), so repeated
+# searches and detail lookups are answered locally and survive restarts.
+# Expired entries stay on disk until evicted: tmdb_client falls back to them
+# while TMDB is unavailable.
+#
+# Settings (read from the environment / .env when the cache is opened):
+#   TMDB_CACHE_PATH            SQLite file for the disk cache (default ./tmdb_cache.db, "" disables it)
+#   TMDB_CACHE_SEARCH_TTL      seconds a /search/... response stays fresh (default 3600)
+#   TMDB_CACHE_DETAIL_TTL      seconds any other response stays fresh (default 86400)
+#   TMDB_CACHE_MEMORY_ITEMS    entries kept in the in-memory LRU (default 512)
+#   TMDB_CACHE_MAX_BYTES       disk cache size before oldest entries are evicted (default 50 MB)
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import anyio
+
+import metrics
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_db: Optional[sqlite3.Connection] = None
+_settings = {}
+
+# Hit/miss counters, exposed for monitoring
+stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+metrics.register_cache("tmdb", stats, hit_keys=("memory_hits", "disk_hits"), miss_keys=("misses",))
+
+def make_key(path: str, params: Optional[dict] = None) -> str:
+    """Cache key from endpoint, normalized search query and page"""
+    parts = []
+    for name, value in sorted((params or {}).items()):
+        if name == "query":
+            value = " ".join(str(value).lower().split())
+        parts.append(f"{name}={value}")
+    return f"{path}?{'&'.join(parts)}"
+
+def ttl_for(path: str) -> float:
+    return _settings["search_ttl"] if path.startswith("/search/") else _settings["detail_ttl"]
+
+def open_cache() -> None:
+    """Read settings and open the disk cache (safe to call more than once)"""
+    global _db
+    _settings.update({
+        "search_ttl": float(os.getenv("TMDB_CACHE_SEARCH_TTL", "3600")),
+        "detail_ttl": float(os.getenv("TMDB_CACHE_DETAIL_TTL", "86400")),
+        "memory_items": int(os.getenv("TMDB_CACHE_MEMORY_ITEMS", "512")),
+        "max_bytes": int(os.getenv("TMDB_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+    })
+    path = os.getenv("TMDB_CACHE_PATH", "./tmdb_cache.db")
+    if _db is not None or not path:
+        return
+    _db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    # It's only a cache: favour speed over durability
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db.execute("PRAGMA synchronous=OFF")
+    _db.execute(
+        "CREATE TABLE IF NOT EXISTS tmdb_cache ("
+        "key TEXT PRIMARY KEY, body TEXT NOT NULL, stored_at REAL NOT NULL, size INTEGER NOT NULL)"
+    )
+    _db.execute("CREATE INDEX IF NOT EXISTS ix_tmdb_cache_stored_at ON tmdb_cache (stored_at)")
+
+def close_cache() -> None:
+    global _db
+    with _lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+
+def _remember(key: str, stored_at: float, data: Any) -> None:
+    """Put an entry in the in-memory LRU, dropping the least recently used"""
+    with _lock:
+        _memory[key] = (stored_at, data)
+        _memory.move_to_end(key)
+        while len(_memory) > _settings.get("memory_items", 512):
+            _memory.popitem(last=False)
+
+def _disk_get(key: str) -> Optional[Tuple[float, Any]]:
+    with _lock:
+        if _db is None:
+            return None
+        row = _db.execute("SELECT stored_at, body FROM tmdb_cache WHERE key = ?", (key,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+def _disk_put(key: str, stored_at: float, data: Any) -> None:
+    body = json.dumps(data, separators=(",", ":"))
+    with _lock:
+        if _db is None:
+            return
+        _db.execute(
+            "INSERT OR REPLACE INTO tmdb_cache (key, body, stored_at, size) VALUES (?, ?, ?, ?)",
+            (key, body, stored_at, len(body))
+        )
+        # Size-based eviction: drop the oldest entries until back under the limit
+        total = _db.execute("SELECT coalesce(sum(size), 0) FROM tmdb_cache").fetchone()[0]
+        if total > _settings["max_bytes"]:
+            target = _settings["max_bytes"] * 0.9
+            for old_key, size in _db.execute("SELECT key, size FROM tmdb_cache ORDER BY stored_at").fetchall():
+                if total <= target:
+                    break
+                _db.execute("DELETE FROM tmdb_cache WHERE key = ?", (old_key,))
+                total -= size
+                stats["evictions"] += 1
+
+async def get(path: str, params: Optional[dict] = None, stale: bool = False) -> Optional[Any]:
+    """Return a fresh cached response body, or None; stale=True accepts expired entries too
+    (until they are evicted) - tmdb_client's fallback while TMDB is unavailable"""
+    if not _settings:
+        open_cache()
+    key = make_key(path, params)
+    now = time.time()
+    ttl = float("inf") if stale else ttl_for(path)
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+    if entry is not None and now - entry[0] < ttl:
+        stats["memory_hits"] += 1
+        return entry[1]
+    entry = await anyio.to_thread.run_sync(_disk_get, key)
+    if entry is not None and now - entry[0] < ttl:
+        stats["disk_hits"] += 1
+        _remember(key, entry[0], entry[1])
+        return entry[1]
+    stats["misses"] += 1
+    return None
+
+async def put(path: str, params: Optional[dict], data: Any) -> None:
+    """Store a successful response body in both levels"""
+    if not _settings:
+        open_cache()
+    key = make_key(path, params)
+    stored_at = time.time()
+    _remember(key, stored_at, data)
+    stats["stores"] += 1
+    await anyio.to_thread.run_sync(_disk_put, key, stored_at, data)
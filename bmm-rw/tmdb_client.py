@@ -0,0 +1,299 @@
+# File: bmm-rw/tmdb_client.py
+# Revision: 1.6 - Background jobs get their own rate budget and circuit breaker
+#
+# One httpx.AsyncClient for the whole app, opened at startup and closed at
+# shutdown, so live-search keystrokes reuse warm keep-alive (and HTTP/2)
+# connections to TMDB instead of paying a TCP+TLS handshake per request.
+#
+# Every call goes through request(), which
+#   - waits for a token from a client-side token bucket (TMDB_RATE_LIMIT), so
+#     bursts queue here instead of drawing 429s
+#   - has one deadline for all its attempts (TMDB_DEADLINE); each attempt's
+#     timeout is cut to the time left, and waits that wouldn't fit give up early
+#   - retries transport errors, 429 and 5xx (TMDB_RETRIES) with jittered
+#     exponential backoff, or after the Retry-After TMDB asked for - a 429 also
+#     pauses the bucket for everyone
+#   - is refused at once while the circuit breaker is open: after
+#     TMDB_BREAKER_FAILURES failed attempts in a row, for TMDB_BREAKER_COOLDOWN
+#     seconds, then one trial call decides whether to close it
+# and raises Unavailable when it gets no usable answer. get_json() then serves
+# the cached response even if it has expired (served_stale() tells the caller),
+# so an outage degrades search to recent results instead of tying up workers.
+# Identical get_json() calls made while one is in flight wait for that one
+# (single flight) instead of sending their own request.
+#
+# Calls made inside background() - the tmdb_enrich / tmdb_refresh jobs - draw
+# on a token bucket and circuit breaker of their own (TMDB_BACKGROUND_*), so a
+# refresh backlog can neither use up the rate interactive searches need nor
+# open the breaker on them. They are still refused while the interactive
+# breaker is open, and a 429 on either side pauses both buckets.
+#
+# Settings (read from the environment / .env when the client starts):
+#   TMDB_API_KEY               bearer token sent with every request
+#   TMDB_BASE_URL              API root, e.g. a local stub server for testing
+#   TMDB_TIMEOUT               longest single attempt in seconds (default 10)
+#   TMDB_CONNECT_TIMEOUT       connect timeout in seconds (default 5)
+#   TMDB_MAX_CONNECTIONS       connection pool size (default 20)
+#   TMDB_HTTP2                 "0" to disable HTTP/2 (default on when h2 is installed)
+#   TMDB_DEADLINE              seconds a call may take including retries and waits (default 8)
+#   TMDB_RETRIES               retries after a failed attempt (default 2)
+#   TMDB_RETRY_BASE            first retry delay cap in seconds, doubled per retry (default 0.25)
+#   TMDB_RATE_LIMIT            requests per second (default 40, 0 disables the limiter)
+#   TMDB_RATE_BURST            requests allowed at once before the rate applies (default 20)
+#   TMDB_BREAKER_FAILURES      consecutive failures that open the breaker (default 5, 0 disables)
+#   TMDB_BREAKER_COOLDOWN      seconds the breaker stays open (default 30)
+#   TMDB_BACKGROUND_RATE_LIMIT requests per second for background() calls, on top of
+#                              TMDB_RATE_LIMIT (default 4, 0 disables the limiter)
+#   TMDB_BACKGROUND_BREAKER_FAILURES  as TMDB_BREAKER_FAILURES, for background() calls (default 5)
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import httpx
+
+import instrumentation
+import metrics
+import resilience
+import tmdb_cache
+
+DEFAULT_BASE_URL = "https://api.themoviedb.org/3"
+
+RETRY_MAX_DELAY = 4.0
+
+class Unavailable(httpx.HTTPError):
+    """TMDB gave no usable answer in time: failing, rate limited, too slow or the breaker is open"""
+
+_client: Optional[httpx.AsyncClient] = None
+_settings = {}
+_limiter = resilience.TokenBucket(40, 20)
+_breaker = resilience.CircuitBreaker(5, 30)
+_background_limiter = resilience.TokenBucket(4, 4)
+_background_breaker = resilience.CircuitBreaker(5, 30)
+# Whether calls in this task are background work (see background())
+_background: "ContextVar[bool]" = ContextVar("tmdb_background", default=False)
+# Whether the last get_json() in this task answered from an expired cache entry
+_stale: "ContextVar[bool]" = ContextVar("tmdb_stale", default=False)
+# get_json() calls in flight, by (background, cache key)
+_inflight: Dict[Tuple[bool, str], "asyncio.Future"] = {}
+
+# Counters, exposed for monitoring
+stats = {"retries": 0, "throttled": 0, "rejected": 0, "gave_up": 0, "stale_served": 0, "coalesced": 0}
+
+def _collect():
+    for name, value in sorted(stats.items()):
+        yield (name,), value
+    yield ("breaker_opened",), _breaker.opened
+    yield ("background_breaker_opened",), _background_breaker.opened
+metrics.Gauge("bmm_tmdb_resilience_events_total", "TMDB retries, throttling and breaker events since start", ("event",), _collect, kind="counter")
+metrics.Gauge("bmm_tmdb_breaker_open", "1 while TMDB calls are refused by the circuit breaker", (),
+              lambda: [((), 0 if _breaker.state == resilience.CLOSED else 1)])
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (optional dependency, installed by httpx[http2])
+    except ImportError:
+        return False
+    return True
+
+def configure() -> None:
+    """Read the resilience settings and reset the limiters and breakers"""
+    global _limiter, _breaker, _background_limiter, _background_breaker
+    _settings.update({
+        "timeout": float(os.getenv("TMDB_TIMEOUT", "10")),
+        "connect_timeout": float(os.getenv("TMDB_CONNECT_TIMEOUT", "5")),
+        "deadline": float(os.getenv("TMDB_DEADLINE", "8")),
+        "retries": int(os.getenv("TMDB_RETRIES", "2")),
+        "retry_base": float(os.getenv("TMDB_RETRY_BASE", "0.25")),
+    })
+    _limiter = resilience.TokenBucket(float(os.getenv("TMDB_RATE_LIMIT", "40")), float(os.getenv("TMDB_RATE_BURST", "20")))
+    _breaker = resilience.CircuitBreaker(int(os.getenv("TMDB_BREAKER_FAILURES", "5")), float(os.getenv("TMDB_BREAKER_COOLDOWN", "30")))
+    background_rate = float(os.getenv("TMDB_BACKGROUND_RATE_LIMIT", "4"))
+    _background_limiter = resilience.TokenBucket(background_rate, background_rate)
+    _background_breaker = resilience.CircuitBreaker(
+        int(os.getenv("TMDB_BACKGROUND_BREAKER_FAILURES", "5")), float(os.getenv("TMDB_BREAKER_COOLDOWN", "30"))
+    )
+
+@contextmanager
+def background() -> Iterator[None]:
+    """Make the TMDB calls inside the block use the background rate budget and breaker"""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+def build_client() -> httpx.AsyncClient:
+    """Create a client configured from the environment"""
+    timeout = float(os.getenv("TMDB_TIMEOUT", "10"))
+    max_connections = int(os.getenv("TMDB_MAX_CONNECTIONS", "20"))
+    http2 = os.getenv("TMDB_HTTP2", "1") != "0" and _http2_available()
+    return httpx.AsyncClient(
+        base_url=os.getenv("TMDB_BASE_URL", DEFAULT_BASE_URL).rstrip("/"),
+        headers={
+            "accept": "application/json",
+            "Authorization": f"Bearer {os.getenv('TMDB_API_KEY')}"
+        },
+        timeout=httpx.Timeout(timeout, connect=float(os.getenv("TMDB_CONNECT_TIMEOUT", "5"))),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=60.0
+        ),
+        http2=http2
+    )
+
+async def start() -> None:
+    """Open the shared client (called from the app's startup event)"""
+    global _client
+    if _client is None:
+        _client = build_client()
+    configure()
+    tmdb_cache.open_cache()
+
+async def stop() -> None:
+    """Close the shared client and its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    tmdb_cache.close_cache()
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use outside the app (e.g. scripts)"""
+    global _client
+    if _client is None:
+        _client = build_client()
+    if not _settings:
+        configure()
+    return _client
+
+async def fetch(path: str, params: Optional[dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+    """One GET of a TMDB API path such as "/search/movie" or "/tv/1399" (no retries)"""
+    endpoint = metrics.tmdb_endpoint(path)
+    start = time.perf_counter()
+    client = get_client()
+    if timeout is not None:
+        timeout = httpx.Timeout(timeout, connect=min(timeout, _settings["connect_timeout"]))
+    with instrumentation.timed("tmdb"):
+        try:
+            response = await client.get(path, params=params, timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT)
+        except httpx.HTTPError as e:
+            metrics.tmdb_errors.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            metrics.tmdb_duration.observe(time.perf_counter() - start, endpoint)
+    metrics.tmdb_responses.inc(endpoint, str(response.status_code))
+    return response
+
+async def _wait(seconds: float, deadline: float, reason: str) -> None:
+    if time.monotonic() + seconds >= deadline:
+        stats["gave_up"] += 1
+        raise Unavailable(f"TMDB {reason}: no time left before the deadline")
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+async def request(path: str, params: Optional[dict] = None) -> httpx.Response:
+    """GET a TMDB API path with rate limiting, retries and the circuit breaker.
+
+    Returns the response for any status other than 429 and 5xx (a 404 is an
+    answer too); raises Unavailable when there is none within TMDB_DEADLINE.
+    """
+    get_client()
+    deadline = time.monotonic() + _settings["deadline"]
+    in_background = _background.get()
+    limiter, breaker = (_background_limiter, _background_breaker) if in_background else (_limiter, _breaker)
+    attempt = 0
+    while True:
+        wait = limiter.reserve()
+        if wait > 0:
+            stats["throttled"] += 1
+            try:
+                await _wait(wait, deadline, "rate limit")
+            except Unavailable:
+                limiter.cancel()
+                raise
+        # Background work also waits while interactive calls are failing, without taking their trial call
+        if (in_background and _breaker.state != resilience.CLOSED) or not breaker.allow():
+            stats["rejected"] += 1
+            raise Unavailable(f"TMDB circuit breaker open, retrying in {max(_breaker.retry_in(), breaker.retry_in()):.0f}s")
+
+        server_delay = None
+        try:
+            response = await fetch(path, params, timeout=min(_settings["timeout"], deadline - time.monotonic()))
+        except httpx.HTTPError as e:
+            breaker.failure()
+            problem = type(e).__name__
+        else:
+            if response.status_code != 429 and response.status_code < 500:
+                breaker.success()
+                return response
+            breaker.failure()
+            problem = f"HTTP {response.status_code}"
+            server_delay = resilience.retry_after(response.headers.get("retry-after"))
+            if response.status_code == 429:
+                # TMDB's limit covers both budgets
+                for bucket in (_limiter, _background_limiter):
+                    bucket.pause(server_delay if server_delay is not None else 1.0)
+
+        attempt += 1
+        if attempt > _settings["retries"]:
+            stats["gave_up"] += 1
+            raise Unavailable(f"TMDB {problem} after {attempt} attempts")
+        stats["retries"] += 1
+        await _wait(resilience.backoff(attempt, _settings["retry_base"], RETRY_MAX_DELAY, server_delay), deadline, problem)
+
+async def _get_json(path: str, params: Optional[dict]) -> Tuple[Optional[Any], bool]:
+    """get_json() without the coalescing: (data, served from an expired entry)"""
+    data = await tmdb_cache.get(path, params)
+    if data is not None:
+        return data, False
+    try:
+        response = await request(path, params=params)
+    except Unavailable:
+        data = await tmdb_cache.get(path, params, stale=True)
+        if data is None:
+            raise
+        stats["stale_served"] += 1
+        return data, True
+    if response.status_code != 200:
+        return None, False
+    data = response.json()
+    await tmdb_cache.put(path, params, data)
+    return data, False
+
+async def get_json(path: str, params: Optional[dict] = None) -> Optional[Any]:
+    """GET a TMDB API path and return the decoded JSON, or None if TMDB answered but not with 200.
+
+    Fresh responses come from tmdb_cache; successful ones are stored there.
+    When TMDB is unavailable an expired cached response is returned instead
+    (see served_stale()); with none cached, Unavailable is raised.
+
+    Identical calls made while one is in flight share its answer, so two
+    clients typing the same search cost one TMDB request. Interactive and
+    background() calls don't wait for each other's.
+    """
+    _stale.set(False)
+    key = (_background.get(), tmdb_cache.make_key(path, params))
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(_get_json(path, params))
+        task.add_done_callback(lambda done: _finished(key, done))
+    else:
+        stats["coalesced"] += 1
+    # A caller that gives up (superseded search, client gone) doesn't cancel the others' call
+    data, stale = await asyncio.shield(task)
+    _stale.set(stale)
+    return data
+
+def _finished(key: Tuple[bool, str], task: "asyncio.Future") -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # retrieved here, so one nobody awaited isn't logged as lost
+
+def served_stale() -> bool:
+    """True if the last get_json() of this request answered from an expired cache entry"""
+    return _stale.get()
@@ -0,0 +1,47 @@
+# File: bmm-rw/tmdb_membership.py
+# Revision: 1.0 - In-process "already in library" set for TMDB search results
+#
+# Optional (BMM_TMDB_MEMBERSHIP=1). Loaded once at startup with the
+# (mtype, tmdbid) pairs of every Media row, then kept warm by the media write
+# routes, so marking TMDB search results costs O(results) with no database
+# round trip. Counts are kept per pair because duplicates can share a tmdbid.
+# Writes made by other processes (scripts) show up after the next restart;
+# leave it off to always use the indexed query instead.
+import threading
+from collections import Counter
+from typing import Iterable, Optional, Set, Tuple
+
+class TmdbMembership:
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, pairs: Iterable[Tuple[Optional[int], Optional[int]]]) -> None:
+        """Replace the contents with (mtype, tmdbid) pairs from the database"""
+        counts = Counter((mtype, int(tmdbid)) for mtype, tmdbid in pairs if tmdbid is not None)
+        with self._lock:
+            self._counts = counts
+            self.loaded = True
+
+    def add(self, mtype: Optional[int], tmdbid: Optional[int]) -> None:
+        if tmdbid is None:
+            return
+        with self._lock:
+            self._counts[(mtype, int(tmdbid))] += 1
+
+    def remove(self, mtype: Optional[int], tmdbid: Optional[int]) -> None:
+        if tmdbid is None:
+            return
+        key = (mtype, int(tmdbid))
+        with self._lock:
+            self._counts[key] -= 1
+            if self._counts[key] <= 0:
+                del self._counts[key]
+
+    def existing(self, mtype: int, tmdb_ids: Iterable[int]) -> Set[int]:
+        """Return the subset of tmdb_ids already in the library for this mtype"""
+        with self._lock:
+            return {int(tmdb_id) for tmdb_id in tmdb_ids if (mtype, int(tmdb_id)) in self._counts}
+
+membership = TmdbMembership()